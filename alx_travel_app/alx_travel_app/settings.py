@@ -14,7 +14,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 import environ
+from corsheaders.defaults import default_headers as default_cors_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -117,6 +119,46 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# CACHE_URL (e.g. rediscache://...) is required in production: cache
+# invalidations must reach every worker process. The per-process
+# local-memory backend is only the default under DEBUG and in tests.
+
+TESTING = len(sys.argv) > 1 and sys.argv[1] == "test"
+
+if DEBUG or TESTING:
+    CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+else:
+    CACHES = {"default": env.cache("CACHE_URL")}  # No default - requires env var
+
+# Seconds a serialized listing detail payload stays cached
+LISTING_DETAIL_CACHE_TIMEOUT = env.int("LISTING_DETAIL_CACHE_TIMEOUT", default=300)
+
+# Seconds facet counts for a given filter set stay cached
+LISTING_FACETS_CACHE_TIMEOUT = env.int("LISTING_FACETS_CACHE_TIMEOUT", default=60)
+
+# Seconds a listing's compiled rate calendar stays cached
+LISTING_RATES_CACHE_TIMEOUT = env.int("LISTING_RATES_CACHE_TIMEOUT", default=3600)
+
+# Seconds a listing's booked-nights calendar stays cached
+LISTING_AVAILABILITY_CACHE_TIMEOUT = env.int(
+    "LISTING_AVAILABILITY_CACHE_TIMEOUT", default=3600
+)
+
+# Seconds an unreferenced image blob is kept before garbage collection
+LISTING_BLOB_GRACE_PERIOD = env.int("LISTING_BLOB_GRACE_PERIOD", default=3600)
+
+# Seconds a pending booking holds its nights before it expires unpaid
+BOOKING_HOLD_TTL = env.int("BOOKING_HOLD_TTL", default=3600)
+
+# Seconds the response to an Idempotency-Key POST is kept for replays
+IDEMPOTENCY_KEY_TTL = env.int("IDEMPOTENCY_KEY_TTL", default=60 * 60 * 24)
+
+# Seconds before a key whose request never stored a response can be retried
+IDEMPOTENCY_LOCK_TIMEOUT = env.int("IDEMPOTENCY_LOCK_TIMEOUT", default=60)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -183,6 +225,8 @@ REST_FRAMEWORK = {
 
 # CORS settings
 CORS_ALLOWED_ORIGINS = env.list("CORS_ALLOWED_ORIGINS")  # No default - requires env var
+CORS_ALLOW_HEADERS = (*default_cors_headers, "idempotency-key")
+CORS_EXPOSE_HEADERS = ["Idempotent-Replayed"]
 
 # Swagger settings
 SWAGGER_SETTINGS = {
@@ -200,6 +244,24 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    "refresh-featured-rankings": {
+        "task": "listings.tasks.refresh_featured_rankings",
+        "schedule": 60 * 60,  # hourly
+    },
+    "collect-image-blobs": {
+        "task": "listings.tasks.collect_image_blobs",
+        "schedule": 60 * 60 * 6,  # every six hours
+    },
+    "expire-pending-bookings": {
+        "task": "listings.tasks.expire_pending_bookings",
+        "schedule": 60 * 5,  # every five minutes
+    },
+    "purge-idempotency-keys": {
+        "task": "listings.tasks.purge_idempotency_keys",
+        "schedule": 60 * 60,  # hourly
+    },
+}
 
 # Email settings
 # For development, use console backend to see emails in console
@@ -1,5 +1,12 @@
 from django.contrib import admin
-from .models import Listing, ListingImage, Amenity, ListingAmenity
+from .models import (
+    Listing,
+    ListingImage,
+    Amenity,
+    ListingAmenity,
+    RateOverride,
+    StayDiscount,
+)
 
 
 class ListingImageInline(admin.TabularInline):
@@ -12,6 +19,16 @@ class ListingAmenityInline(admin.TabularInline):
     extra = 2
 
 
+class RateOverrideInline(admin.TabularInline):
+    model = RateOverride
+    extra = 1
+
+
+class StayDiscountInline(admin.TabularInline):
+    model = StayDiscount
+    extra = 1
+
+
 @admin.register(Listing)
 class ListingAdmin(admin.ModelAdmin):
     list_display = (
@@ -31,7 +48,12 @@ class ListingAdmin(admin.ModelAdmin):
     )
     search_fields = ("title", "description", "location", "address")
     prepopulated_fields = {"slug": ("title",)}
-    inlines = [ListingImageInline, ListingAmenityInline]
+    inlines = [
+        ListingImageInline,
+        ListingAmenityInline,
+        RateOverrideInline,
+        StayDiscountInline,
+    ]
     fieldsets = (
         (
             None,
@@ -46,7 +68,19 @@ class ListingAdmin(admin.ModelAdmin):
                 )
             },
         ),
-        ("Pricing & Location", {"fields": ("price_per_night", "location", "address")}),
+        (
+            "Pricing & Location",
+            {
+                "fields": (
+                    "price_per_night",
+                    "weekend_multiplier",
+                    "location",
+                    "address",
+                    "latitude",
+                    "longitude",
+                )
+            },
+        ),
         ("Details", {"fields": ("max_guests", "bedrooms", "bathrooms")}),
     )
 
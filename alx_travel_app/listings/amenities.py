@@ -0,0 +1,92 @@
+"""
+Amenity bitset filtering for listings.
+
+This module maintains ``Listing.amenity_mask`` and contains the filter
+backend behind ``?amenities=wifi,pool``. Each amenity owns one bit of the
+mask, so "has all of these amenities" is a single predicate on the listing
+row instead of one join through ``ListingAmenity`` per amenity.
+"""
+
+from functools import reduce
+from operator import or_
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import slugify
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+from .models import Amenity, Listing, ListingAmenity
+
+
+def amenity_mask(bits):
+    """OR together the masks of the given amenity bits."""
+    return reduce(or_, (1 << bit for bit in bits if bit is not None), 0)
+
+
+def refresh_amenity_mask(listing_id):
+    """Recompute a listing's mask from its ``ListingAmenity`` rows."""
+    bits = ListingAmenity.objects.filter(listing_id=listing_id).values_list(
+        "amenity__bit", flat=True
+    )
+    Listing.objects.filter(pk=listing_id).update(
+        amenity_mask=amenity_mask(bits), updated_at=timezone.now()
+    )
+
+
+def amenity_keys():
+    """
+    Map every way of naming an amenity to its ``(pk, bit)``.
+
+    Keys are the amenity's id and its slugified name, so lookups should
+    slugify the user's token first.
+    """
+    keys = {}
+    for pk, name, bit in Amenity.objects.values_list("pk", "name", "bit"):
+        keys[str(pk)] = (pk, bit)
+        keys[slugify(name)] = (pk, bit)
+    return keys
+
+
+class AmenityFilter(filters.BaseFilterBackend):
+    """
+    Keep listings offering every amenity in ``?amenities=``.
+
+    Amenities are given by id or by name in any case, with spaces or
+    hyphens (``wifi``, ``swimming-pool``, ``3``). Amenities without a bit
+    (beyond ``Amenity.MAX_BITS``) fall back to a join.
+    """
+
+    amenities_param = "amenities"
+
+    def resolve(self, tokens):
+        by_key = amenity_keys()
+        resolved, unknown = [], []
+        for token in tokens:
+            match = by_key.get(slugify(token))
+            if match is None:
+                unknown.append(token)
+            else:
+                resolved.append(match)
+        if unknown:
+            raise ValidationError(
+                {self.amenities_param: f"Unknown amenities: {', '.join(unknown)}."}
+            )
+        return resolved
+
+    def filter_queryset(self, request, queryset, view):
+        value = request.query_params.get(self.amenities_param, "")
+        tokens = [token.strip() for token in value.split(",") if token.strip()]
+        if not tokens:
+            return queryset
+
+        resolved = self.resolve(tokens)
+        required = amenity_mask(bit for _, bit in resolved)
+        if required:
+            queryset = queryset.alias(
+                _amenity_match=F("amenity_mask").bitand(required)
+            ).filter(_amenity_match=required)
+        for pk, bit in resolved:
+            if bit is None:
+                queryset = queryset.filter(listing_amenities__amenity_id=pk)
+        return queryset
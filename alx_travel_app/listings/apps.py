@@ -10,3 +10,6 @@ class ListingsConfig(AppConfig):
 
     default_auto_field = "django.db.models.BigAutoField"
     name = "listings"
+
+    def ready(self):
+        from . import signals  # noqa: F401
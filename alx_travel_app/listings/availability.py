@@ -0,0 +1,132 @@
+"""
+Availability search for listings.
+
+This module contains the filter backend behind the
+``?check_in=&check_out=&guests=`` listing filters and the per-listing
+calendar of booked nights served by the ``availability`` action.
+"""
+
+import base64
+from datetime import timedelta
+
+from django.db.models import Exists, OuterRef
+from django.utils.dateparse import parse_date
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+from .models import Booking
+
+
+def overlapping_bookings(check_in, check_out):
+    """Return active bookings that share at least one night with the stay."""
+    return Booking.objects.filter(
+        status__in=Booking.ACTIVE_STATUSES,
+        check_in_date__lt=check_out,
+        check_out_date__gt=check_in,
+    )
+
+
+class AvailabilityFilter(filters.BaseFilterBackend):
+    """
+    Keep only listings that are free for a stay.
+
+    Listings with an overlapping pending or confirmed booking are excluded
+    with a correlated ``NOT EXISTS`` served by the
+    ``(listing, check_in_date, check_out_date, status)`` index, so the
+    whole search is one query.
+    """
+
+    check_in_param = "check_in"
+    check_out_param = "check_out"
+    guests_param = "guests"
+
+    def parse_date(self, params, name):
+        try:
+            value = parse_date(params.get(name, ""))
+        except ValueError:
+            value = None
+        if value is None:
+            raise ValidationError({name: "Enter a date in YYYY-MM-DD format."})
+        return value
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        guests = params.get(self.guests_param)
+        if guests:
+            try:
+                guests = int(guests)
+            except ValueError:
+                guests = 0
+            if guests < 1:
+                raise ValidationError(
+                    {self.guests_param: "Must be a positive integer."}
+                )
+            queryset = queryset.filter(max_guests__gte=guests)
+
+        if not (params.get(self.check_in_param) or params.get(self.check_out_param)):
+            return queryset
+
+        check_in = self.parse_date(params, self.check_in_param)
+        check_out = self.parse_date(params, self.check_out_param)
+        if check_out <= check_in:
+            raise ValidationError(
+                {self.check_out_param: "Must be after the check-in date."}
+            )
+
+        conflicts = overlapping_bookings(check_in, check_out).filter(
+            listing=OuterRef("pk")
+        )
+        return queryset.filter(is_available=True).exclude(Exists(conflicts))
+
+
+DEFAULT_CALENDAR_DAYS = 365
+MAX_CALENDAR_DAYS = 731
+ENCODINGS = ("bitmap", "runs")
+
+
+def booked_runs(listing_id, start, days):
+    """
+    Return the listing's booked nights in ``[start, start + days)``.
+
+    Nights are merged into ``(first_night, check_out)`` runs, clipped to
+    the window, from one query over the overlapping active bookings.
+    """
+    end = start + timedelta(days=days)
+    stays = (
+        overlapping_bookings(start, end)
+        .filter(listing_id=listing_id)
+        .order_by("check_in_date")
+        .values_list("check_in_date", "check_out_date")
+    )
+    runs = []
+    for check_in, check_out in stays:
+        check_in, check_out = max(check_in, start), min(check_out, end)
+        if runs and check_in <= runs[-1][1]:
+            runs[-1][1] = max(runs[-1][1], check_out)
+        else:
+            runs.append([check_in, check_out])
+    return [tuple(run) for run in runs]
+
+
+def encode_bitmap(runs, start, days):
+    """
+    Encode booked runs as base64, one bit per night.
+
+    The most significant bit of the first byte is ``start``; a set bit is a
+    booked night.
+    """
+    bitmap = bytearray((days + 7) // 8)
+    for first_night, check_out in runs:
+        for offset in range((first_night - start).days, (check_out - start).days):
+            bitmap[offset // 8] |= 0x80 >> (offset % 8)
+    return base64.b64encode(bytes(bitmap)).decode("ascii")
+
+
+def availability_calendar(listing_id, start, days):
+    """Return the booked nights of a listing in both encodings."""
+    runs = booked_runs(listing_id, start, days)
+    return {
+        "bitmap": encode_bitmap(runs, start, days),
+        "runs": [[first.isoformat(), last.isoformat()] for first, last in runs],
+    }
@@ -0,0 +1,111 @@
+"""
+Reference counting for content-addressed listing images.
+
+This module keeps ``StoredBlob.refcount`` in step with the image fields and
+variant sets that point at each blob, and deletes blobs that nothing has
+referenced for a grace period. Reference changes are ``F()`` updates made in
+the writing transaction; deletion re-checks the count under the row lock
+that the storage's upload path also takes, so a blob that is uploaded again
+or re-referenced in the meantime is never removed.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import images
+from .models import Listing, ListingImage, StoredBlob
+from .storage import image_storage
+
+# Model -> (image field, variants field)
+REFERENCE_FIELDS = {
+    Listing: ("featured_image", "featured_image_variants"),
+    ListingImage: ("image", "variants"),
+}
+
+
+def referenced_files(name, variants):
+    """Return the storage names referenced by an image and its variants."""
+    files = set(images.variant_files(variants))
+    if name:
+        files.add(name)
+    return files
+
+
+def instance_files(instance):
+    file_field, variants_field = REFERENCE_FIELDS[type(instance)]
+    return referenced_files(
+        getattr(instance, file_field).name, getattr(instance, variants_field)
+    )
+
+
+def stored_files(instance):
+    """Return the files referenced by ``instance``'s row as stored in the database."""
+    if instance._state.adding or instance.pk is None:
+        return set()
+    row = (
+        type(instance)
+        ._default_manager.filter(pk=instance.pk)
+        .values_list(*REFERENCE_FIELDS[type(instance)])
+        .first()
+    )
+    return referenced_files(*row) if row else set()
+
+
+def change_references(added=(), removed=()):
+    """Adjust the reference counts of blobs; names that are not blobs are ignored."""
+    if added:
+        StoredBlob.objects.filter(name__in=added).update(refcount=F("refcount") + 1)
+    if removed:
+        StoredBlob.objects.filter(name__in=removed).update(
+            refcount=F("refcount") - 1, touched_at=timezone.now()
+        )
+
+
+def replace_references(old, new):
+    old, new = set(old), set(new)
+    change_references(added=new - old, removed=old - new)
+
+
+def grace_period():
+    return timedelta(seconds=getattr(settings, "LISTING_BLOB_GRACE_PERIOD", 3600))
+
+
+def collect_garbage(grace=None, storage=image_storage):
+    """
+    Delete blobs that have been unreferenced for longer than ``grace``.
+
+    Returns the number of blobs deleted.
+    """
+    cutoff = timezone.now() - (grace_period() if grace is None else grace)
+    candidates = StoredBlob.objects.filter(refcount__lte=0, touched_at__lt=cutoff)
+    deleted = 0
+    for pk in candidates.values_list("pk", flat=True).iterator(chunk_size=1000):
+        with transaction.atomic():
+            blob = candidates.select_for_update().filter(pk=pk).first()
+            if blob is None:
+                continue
+            storage.remove(blob.name)
+            blob.delete()
+            deleted += 1
+    return deleted
+
+
+def recount():
+    """Recompute every reference count from the image columns. Returns the blob count."""
+    counts = {}
+    for model, fields in REFERENCE_FIELDS.items():
+        rows = model._default_manager.order_by().values_list(*fields)
+        for name, variants in rows.iterator(chunk_size=1000):
+            for file_name in referenced_files(name, variants):
+                counts[file_name] = counts.get(file_name, 0) + 1
+
+    blobs = list(StoredBlob.objects.only("pk", "name", "refcount"))
+    changed = [blob for blob in blobs if blob.refcount != counts.get(blob.name, 0)]
+    for blob in changed:
+        blob.refcount = counts.get(blob.name, 0)
+    StoredBlob.objects.bulk_update(changed, ["refcount"], batch_size=1000)
+    return len(blobs)
@@ -0,0 +1,228 @@
+"""
+Response caching for the listings app.
+
+This module caches serialized listing detail payloads keyed by slug, facet
+counts keyed by the normalized filter parameters, and per-listing rate and
+availability calendars. Each slug (and each listing's calendars) has a
+version token that is rotated on invalidation, so every cached variant of a
+listing (one per request host, since image URLs are absolute) is dropped
+with a single write. A global generation token allows bulk writes that
+bypass signals to invalidate everything at once.
+"""
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = "listing:detail"
+GENERATION_KEY = f"{KEY_PREFIX}:generation"
+HITS_KEY = f"{KEY_PREFIX}:hits"
+MISSES_KEY = f"{KEY_PREFIX}:misses"
+
+
+def _version_key(slug):
+    return f"{KEY_PREFIX}:version:{slug}"
+
+
+def _slug_key(listing_id):
+    return f"{KEY_PREFIX}:slug:{listing_id}"
+
+
+def _timeout():
+    return getattr(settings, "LISTING_DETAIL_CACHE_TIMEOUT", 300)
+
+
+def _token():
+    return uuid.uuid4().hex
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def _data_key(slug, host, tokens):
+    """Return the payload key for ``slug`` given its version tokens."""
+    generation = tokens[GENERATION_KEY]
+    version = tokens[_version_key(slug)]
+    return f"{KEY_PREFIX}:{generation}:{version}:{slug}:{host}"
+
+
+def _detail_tokens(slug):
+    """Return the generation and slug version tokens, creating missing ones."""
+    keys = [GENERATION_KEY, _version_key(slug)]
+    tokens = cache.get_many(keys)
+    if len(tokens) < len(keys):
+        for key in keys:
+            if key not in tokens:
+                cache.add(key, _token(), timeout=None)
+        tokens = cache.get_many(keys)
+    return tokens
+
+
+def get_listing_detail(slug, host):
+    """
+    Return ``(entry, tokens)`` for ``slug``.
+
+    ``entry`` is the cached ``(data, etag, last_modified)`` or ``None`` on
+    a miss. Pass ``tokens`` back to ``set_listing_detail`` so a payload
+    rendered before an invalidation is never served after it.
+    """
+    tokens = _detail_tokens(slug)
+    entry = cache.get(_data_key(slug, host, tokens))
+    _incr(HITS_KEY if entry is not None else MISSES_KEY)
+    return entry, tokens
+
+
+def set_listing_detail(slug, host, tokens, data, etag=None, last_modified=None):
+    """Cache a serialized listing payload with its HTTP validators."""
+    cache.set_many(
+        {
+            _data_key(slug, host, tokens): (data, etag, last_modified),
+            _slug_key(data["id"]): slug,
+        },
+        timeout=_timeout(),
+    )
+
+
+def invalidate_listing(listing_id, slug=None):
+    """
+    Drop every cached payload of a listing.
+
+    ``slug`` is the listing's current slug when known; the slug the payload
+    was cached under is looked up too so renamed listings are covered.
+    """
+    slugs = {slug, cache.get(_slug_key(listing_id))}
+    if slugs == {None}:
+        from .models import Listing
+
+        slugs.update(
+            Listing.objects.filter(pk=listing_id).values_list("slug", flat=True)
+        )
+    cache.set_many(
+        {_version_key(s): _token() for s in slugs if s is not None}, timeout=None
+    )
+
+
+def invalidate_all():
+    """Drop every cached listing payload."""
+    cache.set(GENERATION_KEY, _token(), timeout=None)
+
+
+def get_stats():
+    """Return the hit and miss counters."""
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {"hits": counters.get(HITS_KEY, 0), "misses": counters.get(MISSES_KEY, 0)}
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+FACETS_PREFIX = "listing:facets"
+
+# Query parameters that change ordering or paging but not the result set
+FACETS_IGNORED_PARAMS = {"ordering", "cursor", "page_size", "fields", "expand"}
+
+
+def _facets_key(params):
+    """Build a cache key from a normalized copy of the filter parameters."""
+    normalized = sorted(
+        (name, sorted(v for v in params.getlist(name) if v))
+        for name in params
+        if name not in FACETS_IGNORED_PARAMS
+    )
+    normalized = [(name, values) for name, values in normalized if values]
+    digest = hashlib.md5(repr(normalized).encode()).hexdigest()
+    return f"{FACETS_PREFIX}:{digest}"
+
+
+def get_facets(params):
+    """Return cached facet counts for the filter parameters, if any."""
+    return cache.get(_facets_key(params))
+
+
+def set_facets(params, data):
+    cache.set(
+        _facets_key(params),
+        data,
+        timeout=getattr(settings, "LISTING_FACETS_CACHE_TIMEOUT", 60),
+    )
+
+
+RATES_PREFIX = "listing:rates"
+AVAILABILITY_PREFIX = "listing:availability"
+
+
+def _listing_version(prefix, listing_id):
+    """Return the current version token of a per-listing entry, creating it."""
+    version_key = f"{prefix}:version:{listing_id}"
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, _token(), timeout=None)
+        version = cache.get(version_key)
+    return version
+
+
+def _rotate_versions(prefix, listing_ids):
+    cache.set_many(
+        {f"{prefix}:version:{listing_id}": _token() for listing_id in listing_ids},
+        timeout=None,
+    )
+
+
+def get_rate_calendar(listing_id):
+    """
+    Return ``(calendar, version)`` for a listing's compiled rate calendar.
+
+    ``calendar`` is ``None`` on a miss; pass ``version`` back to
+    ``set_rate_calendar`` so a calendar compiled before an invalidation is
+    never served after it.
+    """
+    version = _listing_version(RATES_PREFIX, listing_id)
+    return cache.get(f"{RATES_PREFIX}:{version}:{listing_id}"), version
+
+
+def set_rate_calendar(listing_id, version, calendar):
+    cache.set(
+        f"{RATES_PREFIX}:{version}:{listing_id}",
+        calendar,
+        timeout=getattr(settings, "LISTING_RATES_CACHE_TIMEOUT", 3600),
+    )
+
+
+def invalidate_rate_calendar(listing_id):
+    """Drop a listing's compiled rate calendar after its rates change."""
+    _rotate_versions(RATES_PREFIX, [listing_id])
+
+
+def _availability_key(listing_id, version, start, days):
+    return f"{AVAILABILITY_PREFIX}:{version}:{listing_id}:{start.isoformat()}:{days}"
+
+
+def get_availability(listing_id, start, days):
+    """
+    Return ``(data, version)`` for a listing's booked-nights calendar.
+
+    Works like ``get_rate_calendar``; ``data`` is ``None`` on a miss.
+    """
+    version = _listing_version(AVAILABILITY_PREFIX, listing_id)
+    return cache.get(_availability_key(listing_id, version, start, days)), version
+
+
+def set_availability(listing_id, version, start, days, data):
+    cache.set(
+        _availability_key(listing_id, version, start, days),
+        data,
+        timeout=getattr(settings, "LISTING_AVAILABILITY_CACHE_TIMEOUT", 3600),
+    )
+
+
+def invalidate_availability(*listing_ids):
+    """Drop the cached calendars of listings whose bookings changed."""
+    _rotate_versions(AVAILABILITY_PREFIX, listing_ids)
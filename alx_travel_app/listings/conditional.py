@@ -0,0 +1,117 @@
+"""
+Conditional GET support for the listings API.
+
+This module contains a viewset mixin that emits ``ETag``/``Last-Modified``
+validators and answers matching ``If-None-Match``/``If-Modified-Since``
+requests with ``304 Not Modified`` before any serializer work is done.
+"""
+
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    """Build a quoted ETag from the string form of ``parts``."""
+    digest = hashlib.md5("|".join(str(part) for part in parts).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def latest_timestamp(values):
+    """Return the newest of ``values`` as a POSIX timestamp, or ``None``."""
+    values = [value for value in values if value is not None]
+    return int(max(values).timestamp()) if values else None
+
+
+class ConditionalGetMixin:
+    """
+    Add ETag/Last-Modified handling to ``list`` and ``retrieve``.
+
+    ``conditional_fields`` are the timestamp fields whose newest value marks
+    a change of the rendered data; nested relations can be listed with
+    ``__`` lookups. List validators come from one aggregate query over the
+    filtered queryset (max timestamps plus row count, so deletes are seen),
+    detail validators from a single ``values_list`` lookup.
+    """
+
+    conditional_fields = ("updated_at",)
+    # Query parameters that select a different representation of one object
+    representation_params = ("fields", "expand")
+
+    def get_list_validators(self, request, queryset):
+        aggregates = queryset.order_by().aggregate(
+            _count=Count("pk"),
+            **{
+                f"_max_{i}": Max(field)
+                for i, field in enumerate(self.conditional_fields)
+            },
+        )
+        count = aggregates.pop("_count")
+        timestamps = list(aggregates.values())
+        etag = make_etag(request.get_full_path(), count, *timestamps)
+        return etag, latest_timestamp(timestamps)
+
+    def get_detail_validators(self, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = (
+            self.filter_queryset(self.get_queryset())
+            .filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+            .order_by()
+            .values_list("pk", *self.conditional_fields)
+            .first()
+        )
+        if row is None:
+            return None
+        variant = [
+            self.request.query_params.get(param, "")
+            for param in self.representation_params
+        ]
+        return make_etag(*row, *variant), latest_timestamp(row[1:])
+
+    def get_not_modified(self, request, etag, last_modified):
+        """Return a 304 response if the client's copy is current, else ``None``."""
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is not None:
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    def set_validators(self, response, etag, last_modified):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        etag, last_modified = self.get_list_validators(request, queryset)
+        not_modified = self.get_not_modified(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = self.list_response(queryset)
+        return self.set_validators(response, etag, last_modified)
+
+    def list_response(self, queryset):
+        """Paginate and serialize ``queryset`` like ``ListModelMixin.list``."""
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = self.get_detail_validators(**kwargs)
+        if validators is None:
+            # Let the regular lookup raise the 404
+            return super().retrieve(request, *args, **kwargs)
+        not_modified = self.get_not_modified(request, *validators)
+        if not_modified is not None:
+            return not_modified
+        response = super().retrieve(request, *args, **kwargs)
+        return self.set_validators(response, *validators)
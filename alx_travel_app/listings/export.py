@@ -0,0 +1,190 @@
+"""
+Bulk export for the listings app.
+
+This module contains the streaming NDJSON/CSV export of listings, bookings
+and reviews used by the ``export`` API actions and the ``export_data``
+management command. Rows are read with keyset pagination (``pk > last``) in
+fixed-size batches of ``values()`` dicts and each batch is encoded and
+yielded before the next one is fetched, so memory stays constant however
+large the table is.
+"""
+
+import csv
+import datetime
+import json
+from decimal import Decimal
+
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+
+from .models import Booking, Listing, Review
+
+FORMAT_PARAM = "export_format"
+CHUNK_SIZE_PARAM = "chunk_size"
+DEFAULT_CHUNK_SIZE = 2000
+MAX_CHUNK_SIZE = 10000
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Exported columns per dataset; the first column must be the primary key
+EXPORTS = {
+    "listings": (
+        Listing,
+        [
+            "id",
+            "title",
+            "slug",
+            "description",
+            "listing_type",
+            "price_per_night",
+            "location",
+            "address",
+            "latitude",
+            "longitude",
+            "max_guests",
+            "bedrooms",
+            "bathrooms",
+            "is_available",
+            "rating_avg",
+            "rating_count",
+            "created_at",
+            "updated_at",
+        ],
+    ),
+    "bookings": (
+        Booking,
+        [
+            "id",
+            "user_id",
+            "listing_id",
+            "check_in_date",
+            "check_out_date",
+            "num_guests",
+            "total_price",
+            "status",
+            "created_at",
+            "updated_at",
+        ],
+    ),
+    "reviews": (
+        Review,
+        [
+            "id",
+            "user_id",
+            "listing_id",
+            "booking_id",
+            "rating",
+            "comment",
+            "created_at",
+            "updated_at",
+        ],
+    ),
+}
+
+
+def normalize(value):
+    """Convert a column value to the JSON/CSV-friendly form used by the API."""
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def iter_batches(queryset, columns, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield lists of at most ``chunk_size`` row dicts in primary key order.
+
+    Each batch is a separate ``pk > last`` query, which keeps memory flat on
+    backends whose drivers buffer the whole result set of a single query.
+    """
+    queryset = queryset.prefetch_related(None).order_by("pk").values(*columns)
+    pk = columns[0]
+    last = None
+    while True:
+        batch_queryset = queryset if last is None else queryset.filter(pk__gt=last)
+        batch = list(batch_queryset[:chunk_size])
+        if not batch:
+            return
+        yield batch
+        if len(batch) < chunk_size:
+            return
+        last = batch[-1][pk]
+
+
+def ndjson_chunks(batches, columns):
+    for batch in batches:
+        yield "".join(
+            json.dumps(
+                {column: normalize(row[column]) for column in columns},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+            + "\n"
+            for row in batch
+        )
+
+
+class LineBuffer:
+    """File-like object that returns what is written, for ``csv.writer``."""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(batches, columns):
+    writer = csv.writer(LineBuffer())
+    # The header goes out before the first query runs
+    yield writer.writerow(columns)
+    for batch in batches:
+        yield "".join(
+            writer.writerow(
+                ["" if row[c] is None else normalize(row[c]) for c in columns]
+            )
+            for row in batch
+        )
+
+
+def stream_export(queryset, columns, export_format, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return an iterator of encoded text chunks for ``queryset``."""
+    encoders = {"ndjson": ndjson_chunks, "csv": csv_chunks}
+    batches = iter_batches(queryset, columns, chunk_size)
+    return encoders[export_format](batches, columns)
+
+
+def export_response(request, queryset, name):
+    """
+    Stream ``queryset`` as the ``name`` export in the requested format.
+
+    ``?export_format=`` wins; otherwise an ``Accept`` header that selected
+    an export renderer picks the format, and NDJSON is the default.
+    """
+    accepted = getattr(getattr(request, "accepted_renderer", None), "format", None)
+    default = accepted if accepted in CONTENT_TYPES else "ndjson"
+    export_format = request.query_params.get(FORMAT_PARAM, default)
+    if export_format not in CONTENT_TYPES:
+        raise ValidationError(
+            {FORMAT_PARAM: f"Must be one of: {', '.join(CONTENT_TYPES)}."}
+        )
+    try:
+        chunk_size = int(request.query_params.get(CHUNK_SIZE_PARAM, DEFAULT_CHUNK_SIZE))
+    except ValueError:
+        chunk_size = 0
+    if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+        raise ValidationError(
+            {CHUNK_SIZE_PARAM: f"Must be an integer between 1 and {MAX_CHUNK_SIZE}."}
+        )
+
+    columns = EXPORTS[name][1]
+    response = StreamingHttpResponse(
+        stream_export(queryset, columns, export_format, chunk_size),
+        content_type=CONTENT_TYPES[export_format],
+    )
+    response["Content-Disposition"] = f'attachment; filename="{name}.{export_format}"'
+    return response
@@ -0,0 +1,144 @@
+"""
+Facet counts for listing search.
+
+This module computes the per-value counts shown next to the search filters
+and the price distribution behind the price slider, each with a fixed
+number of grouped aggregate queries.
+"""
+
+import bisect
+import math
+from decimal import Decimal
+
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .models import Listing, ListingAmenity
+
+# (lower, upper) bounds of the price_per_night buckets; None is unbounded
+PRICE_BUCKETS = [(0, 50), (50, 100), (100, 200), (200, 500), (500, None)]
+
+
+def price_bucket_expression():
+    """Annotate each listing with the index of its price bucket."""
+    whens = []
+    for index, (lower, upper) in enumerate(PRICE_BUCKETS):
+        condition = {"price_per_night__gte": lower}
+        if upper is not None:
+            condition["price_per_night__lt"] = upper
+        whens.append(When(then=Value(index), **condition))
+    return Case(*whens, default=Value(None), output_field=IntegerField())
+
+
+def listing_facets(queryset):
+    """
+    Return facet counts for the listings matched by ``queryset``.
+
+    Runs four grouped queries: listing type, bedrooms, price bucket and
+    amenity.
+    """
+    queryset = queryset.order_by()
+    type_labels = dict(Listing.LISTING_TYPE_CHOICES)
+
+    types = [
+        {
+            "value": row["listing_type"],
+            "label": type_labels.get(row["listing_type"], row["listing_type"]),
+            "count": row["count"],
+        }
+        for row in queryset.values("listing_type")
+        .annotate(count=Count("pk"))
+        .order_by("listing_type")
+    ]
+
+    bedrooms = [
+        {"value": row["bedrooms"], "count": row["count"]}
+        for row in queryset.values("bedrooms")
+        .annotate(count=Count("pk"))
+        .order_by("bedrooms")
+    ]
+
+    bucket_counts = dict(
+        queryset.annotate(price_bucket=price_bucket_expression())
+        .values("price_bucket")
+        .annotate(count=Count("pk"))
+        .values_list("price_bucket", "count")
+    )
+    prices = [
+        {"min": lower, "max": upper, "count": bucket_counts.get(index, 0)}
+        for index, (lower, upper) in enumerate(PRICE_BUCKETS)
+    ]
+
+    amenities = [
+        {"id": row["amenity_id"], "name": row["amenity__name"], "count": row["count"]}
+        for row in ListingAmenity.objects.filter(listing__in=queryset.values("pk"))
+        .values("amenity_id", "amenity__name")
+        .annotate(count=Count("listing_id"))
+        .order_by("-count", "amenity__name")
+    ]
+
+    return {
+        "total": sum(item["count"] for item in types),
+        "listing_type": types,
+        "bedrooms": bedrooms,
+        "price": prices,
+        "amenities": amenities,
+    }
+
+
+PERCENTILES = (10, 25, 50, 75, 90)
+CENT = Decimal("0.01")
+
+
+def price_histogram(queryset, buckets):
+    """
+    Return the ``price_per_night`` distribution of ``queryset``.
+
+    A single query groups the matching listings by distinct price; the
+    equal-width buckets, bounds and nearest-rank percentiles are derived
+    from those ``(price, count)`` pairs, so the cost follows the number of
+    distinct prices rather than the number of listings.
+    """
+    rows = list(
+        queryset.order_by()
+        .values("price_per_night")
+        .annotate(count=Count("pk"))
+        .order_by("price_per_night")
+        .values_list("price_per_night", "count")
+    )
+    total = sum(count for _, count in rows)
+    if not total:
+        return {"count": 0, "min": None, "max": None, "buckets": [], "percentiles": {}}
+
+    low, high = rows[0][0], rows[-1][0]
+    if low == high:
+        buckets = 1
+    width = (high - low) / buckets or Decimal(1)
+    # Membership uses the rounded edges that are returned, so a price on a
+    # displayed edge always lands in the bucket that starts there
+    edges = [low.quantize(CENT)]
+    edges += [(low + width * i).quantize(CENT) for i in range(1, buckets)]
+    edges.append(high)
+    counts = [0] * buckets
+    for price, count in rows:
+        counts[bisect.bisect_right(edges, price, 1, buckets) - 1] += count
+
+    percentiles = {}
+    targets = iter((p, math.ceil(p / 100 * total)) for p in PERCENTILES)
+    percentile, rank = next(targets)
+    seen = 0
+    for price, count in rows:
+        seen += count
+        while rank is not None and seen >= rank:
+            percentiles[f"p{percentile}"] = str(price)
+            percentile, rank = next(targets, (None, None))
+
+    return {
+        "count": total,
+        "min": str(low),
+        "max": str(high),
+        "buckets": [
+            {"min": str(edges[i]), "max": str(edges[i + 1]), "count": count}
+            for i, count in enumerate(counts)
+        ],
+        "percentiles": percentiles,
+    }
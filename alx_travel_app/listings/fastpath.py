@@ -0,0 +1,247 @@
+"""
+Fast read path for list endpoints.
+
+This module contains a serializer-free way to render list pages. A
+``RowPlan`` is compiled once per request from the (already pruned)
+serializer: every rendered field becomes the ``values()`` column(s) it reads
+and a converter that reproduces the serializer's representation, so rows are
+built straight from ``values()`` dicts without instantiating models or
+running the serializer field machinery per row. Fields a plan cannot render
+exactly, such as many-valued relations and method fields, make the view fall
+back to the serializer.
+"""
+
+from operator import itemgetter
+
+from django.db.models import FileField
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.fields import empty
+from rest_framework.relations import PKOnlyObject, PrimaryKeyRelatedField
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .fieldsets import SparseFieldsetSerializerMixin, concrete_field
+from .renderers import FastJSONRenderer
+
+# to_representation() implementations that return database values unchanged
+IDENTITY_REPRESENTATIONS = {
+    serializers.BooleanField.to_representation,
+    serializers.CharField.to_representation,
+    serializers.IntegerField.to_representation,
+}
+
+
+class UnsupportedField(Exception):
+    """Raised when a field cannot be rendered from ``values()`` columns."""
+
+
+def is_identity(field):
+    """Whether ``field`` renders non-null database values unchanged."""
+    to_representation = type(field).to_representation
+    if to_representation in IDENTITY_REPRESENTATIONS:
+        return True
+    if to_representation is serializers.ChoiceField.to_representation:
+        return all(isinstance(key, str) for key in field.choices)
+    return False
+
+
+def compile_datetime(field):
+    """Resolve a DateTimeField's format and timezone once instead of per value."""
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    field_timezone = (
+        field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    )
+    if (
+        output_format is None
+        or output_format.lower() != ISO_8601
+        or field_timezone is None
+    ):
+        return field.to_representation
+
+    def to_representation(value):
+        if not timezone.is_aware(value):
+            return field.to_representation(value)
+        try:
+            value = value.astimezone(field_timezone).isoformat()
+        except OverflowError:
+            return field.to_representation(value)
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+
+    return to_representation
+
+
+def compile_representation(field):
+    """Return the field's to_representation, or ``None`` for the identity."""
+    if is_identity(field):
+        return None
+    if type(field).to_representation is serializers.DateTimeField.to_representation:
+        return compile_datetime(field)
+    return field.to_representation
+
+
+def represent(read, field, build=None):
+    """
+    Compose a row mapper: read a column, convert it to the attribute value the
+    serializer would see, then apply the field's representation.
+    """
+    to_representation = compile_representation(field)
+    if build is None and to_representation is None:
+        return read
+    if build is None:
+        build = to_representation
+    elif to_representation is not None:
+        convert = build
+
+        def build(value):
+            return to_representation(convert(value))
+
+    def mapper(row):
+        value = read(row)
+        return None if value is None else build(value)
+
+    return mapper
+
+
+class RowPlan:
+    """
+    Precompiled mapping from ``values()`` rows to a serializer's output.
+
+    ``columns`` are the ``values()`` lookups to select and ``mappers`` the
+    ``(name, mapper)`` pairs producing each rendered field, in serializer
+    field order. Serializers describe fields whose value is not a plain
+    column with ``field_columns`` plus a ``value_builders`` entry that turns
+    those column values into the attribute the serializer would read.
+    """
+
+    def __init__(self, serializer, annotations=(), prefix=""):
+        self.model = serializer.Meta.model
+        self.pk_column = prefix + self.model._meta.pk.name
+        self.columns = [self.pk_column]
+        self.mappers = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            mapper = self.compile_field(serializer, name, field, annotations, prefix)
+            if mapper is not None:
+                self.mappers.append((name, mapper))
+
+    def read(self, *columns):
+        self.columns.extend(columns)
+        return itemgetter(*columns)
+
+    def compile_field(self, serializer, name, field, annotations, prefix):
+        """Return the mapper for one field, or ``None`` if DRF would omit it."""
+        builders = getattr(serializer, "value_builders", {})
+        if name in builders:
+            columns = [prefix + column for column in serializer.field_columns[name]]
+            read = self.read(*columns)
+            build = builders[name]
+            if len(columns) == 1:
+                return represent(lambda row: build(read(row)), field)
+            return represent(lambda row: build(*read(row)), field)
+
+        if isinstance(field, serializers.ListSerializer) or isinstance(
+            field, serializers.SerializerMethodField
+        ):
+            raise UnsupportedField(name)
+        if len(field.source_attrs) != 1:
+            raise UnsupportedField(name)
+
+        model_field = concrete_field(self.model, field.source)
+        if isinstance(field, serializers.BaseSerializer):
+            if not isinstance(field, SparseFieldsetSerializerMixin) or (
+                model_field is None or not model_field.is_relation
+            ):
+                raise UnsupportedField(name)
+            nested = RowPlan(field, prefix=f"{prefix}{model_field.name}__")
+            self.columns.extend(nested.columns)
+            return nested.build_nested
+
+        if model_field is not None:
+            read = self.read(prefix + model_field.name)
+            if model_field.is_relation:
+                if not isinstance(field, PrimaryKeyRelatedField):
+                    raise UnsupportedField(name)
+                return represent(read, field, lambda pk: PKOnlyObject(pk=pk))
+            if isinstance(model_field, FileField):
+                # DRF renders the FieldFile, which is never None itself
+                attr_class = model_field.attr_class
+                to_representation = field.to_representation
+                return lambda row: to_representation(
+                    attr_class(None, model_field, read(row))
+                )
+            return represent(read, field)
+
+        if not prefix and field.source in annotations:
+            return represent(self.read(field.source), field)
+        if hasattr(self.model, field.source):
+            raise UnsupportedField(name)
+        # Mirror Field.get_attribute() for attributes the instance lacks
+        if field.default is not empty:
+            default = field.get_default()
+            return lambda row: default
+        if field.allow_null:
+            return lambda row: None
+        if not field.required:
+            return None
+        raise UnsupportedField(name)
+
+    def build(self, row):
+        return {name: mapper(row) for name, mapper in self.mappers}
+
+    def build_nested(self, row):
+        return None if row[self.pk_column] is None else self.build(row)
+
+    def render(self, rows):
+        return [self.build(row) for row in rows]
+
+    def values(self, queryset, extra_columns=()):
+        """Return ``queryset`` as a ``values()`` queryset of the plan's columns."""
+        columns = dict.fromkeys([*self.columns, *extra_columns])
+        return queryset.prefetch_related(None).values(*columns)
+
+
+class FastListMixin:
+    """
+    Render ``fast_actions`` through a ``RowPlan`` when the fields allow it.
+
+    Views call ``list_response(queryset)`` to paginate and render a list;
+    the output is identical to the serializer's, which is used whenever the
+    requested fields cannot be planned (e.g. ``?expand=images``).
+    """
+
+    fast_actions = ()
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get_row_plan(self, queryset):
+        if getattr(self, "action", None) not in self.fast_actions:
+            return None
+        try:
+            return RowPlan(self.get_serializer(), queryset.query.annotation_select)
+        except UnsupportedField:
+            return None
+
+    def list_response(self, queryset):
+        """Paginate and render ``queryset``, bypassing the serializer if possible."""
+        plan = self.get_row_plan(queryset)
+        if plan is not None:
+            # Cursor pagination reads its position from the ordering columns
+            queryset = plan.values(
+                queryset,
+                [
+                    *self.get_ordering_columns(queryset.model),
+                    *queryset.query.annotation_select,
+                ],
+            )
+
+        page = self.paginate_queryset(queryset)
+        rows = queryset if page is None else page
+        if plan is not None:
+            data = plan.render(rows)
+        else:
+            data = self.get_serializer(rows, many=True).data
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
@@ -0,0 +1,124 @@
+"""
+Featured listing ranking.
+
+This module scores available listings on ratings, recent booking volume
+and recency, and materializes the result in ``FeaturedListing`` so the
+``featured`` endpoint can serve it with a primary-key join.
+"""
+
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Booking, FeaturedListing, Listing
+
+# Rankings kept per listing type; the global top N is always a subset
+MAX_FEATURED = 50
+
+RATING_WEIGHT = 0.5
+BOOKING_WEIGHT = 0.35
+RECENCY_WEIGHT = 0.15
+
+# Reviews worth of the catalog-wide mean blended into each listing's rating
+RATING_PRIOR_WEIGHT = 5
+BOOKING_WINDOW_DAYS = 90
+RECENCY_HALF_LIFE_DAYS = 180
+
+
+def score_listing(
+    rating_avg, rating_count, prior_mean, bookings, max_bookings, age_days
+):
+    """
+    Return a 0-1 featured score.
+
+    - rating: Bayesian average pulled towards ``prior_mean`` for listings
+      with few reviews, scaled to 0-1
+    - bookings: log-scaled recent booking volume relative to the busiest
+      listing
+    - recency: exponential decay on the listing's age
+    """
+    rating = (RATING_PRIOR_WEIGHT * prior_mean + rating_count * rating_avg) / (
+        RATING_PRIOR_WEIGHT + rating_count
+    )
+    volume = math.log1p(bookings) / math.log1p(max_bookings) if max_bookings else 0
+    recency = 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+    return (
+        RATING_WEIGHT * rating / 5 + BOOKING_WEIGHT * volume + RECENCY_WEIGHT * recency
+    )
+
+
+def refresh_featured_listings():
+    """
+    Recompute the featured ranking in bulk and return the number of rows.
+
+    Uses one listing scan and one grouped booking count, then swaps the
+    table contents in a single transaction.
+    """
+    now = timezone.now()
+    listings = list(
+        Listing.objects.filter(is_available=True)
+        .order_by()
+        .values_list("pk", "listing_type", "rating_avg", "rating_count", "created_at")
+    )
+
+    # Mean rating over all reviews of the candidate listings
+    reviews = sum(n for _, _, _, n, _ in listings)
+    weighted = sum(float(avg) * n for _, _, avg, n, _ in listings)
+    prior_mean = weighted / reviews if reviews else 0.0
+
+    bookings = dict(
+        Booking.objects.filter(
+            created_at__gte=now - timedelta(days=BOOKING_WINDOW_DAYS),
+            status__in=("confirmed", "completed"),
+        )
+        .order_by()
+        .values("listing_id")
+        .annotate(total=Count("pk"))
+        .values_list("listing_id", "total")
+    )
+    max_bookings = max(bookings.values(), default=0)
+
+    scored = sorted(
+        (
+            (
+                score_listing(
+                    float(rating_avg),
+                    rating_count,
+                    prior_mean,
+                    bookings.get(pk, 0),
+                    max_bookings,
+                    (now - created_at).total_seconds() / 86400,
+                ),
+                pk,
+                listing_type,
+            )
+            for pk, listing_type, rating_avg, rating_count, created_at in listings
+        ),
+        key=lambda row: (-row[0], -row[1]),
+    )
+
+    rows = []
+    type_ranks = defaultdict(int)
+    for rank, (score, pk, listing_type) in enumerate(scored, start=1):
+        type_ranks[listing_type] += 1
+        if type_ranks[listing_type] > MAX_FEATURED:
+            continue
+        rows.append(
+            FeaturedListing(
+                listing_id=pk,
+                listing_type=listing_type,
+                score=score,
+                rank=rank,
+                type_rank=type_ranks[listing_type],
+                computed_at=now,
+            )
+        )
+
+    with transaction.atomic():
+        FeaturedListing.objects.all().delete()
+        FeaturedListing.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,170 @@
+"""
+Sparse fieldsets for the listings API.
+
+This module contains the serializer and viewset mixins behind the
+``?fields=`` and ``?expand=`` query parameters. Serializers drop the fields
+that were not requested and the viewsets shape their querysets to match,
+loading only the columns and relations that will actually be rendered.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = "fields"
+EXPAND_PARAM = "expand"
+
+
+def parse_list_param(request, name):
+    """Return the comma-separated values of a query parameter as a set."""
+    if request is None or name not in request.query_params:
+        return None
+    value = request.query_params.get(name, "")
+    return {item.strip() for item in value.split(",") if item.strip()}
+
+
+def concrete_field(model, name):
+    """Return the concrete model field called ``name``, or ``None``."""
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    return field if field.concrete else None
+
+
+class SparseFieldsetSerializerMixin:
+    """
+    Render only the requested fields.
+
+    - ``expandable_fields`` are relations rendered only when named in
+      ``?expand=`` (or in ``?fields=``); with no ``expand`` in the context,
+      everything is expanded.
+    - ``?fields=`` restricts the top-level serializer to the named fields.
+    - ``Meta.compact_fields``, when defined, is the default field list for
+      views that ask for the compact representation.
+    - ``Meta.detail_only_fields`` are never rendered in list views.
+    - ``expanded_fields`` maps fields to a factory for the fuller field
+      rendered in their place only when named in ``?expand=``.
+    - ``field_columns`` maps fields whose source is not a plain model column
+      to the columns they read; an empty list means "no column".
+    """
+
+    expandable_fields = ()
+    expanded_fields = {}
+    field_columns = {}
+
+    def is_root_serializer(self):
+        parent = self.parent
+        return parent is None or (
+            isinstance(parent, serializers.ListSerializer) and parent.parent is None
+        )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get("list_view"):
+            for name in getattr(self.Meta, "detail_only_fields", ()):
+                fields.pop(name, None)
+        requested = None
+        if self.is_root_serializer():
+            requested = self.context.get("fields")
+            if requested is None and self.context.get("compact"):
+                requested = getattr(self.Meta, "compact_fields", None)
+                if requested is not None:
+                    # Expanded relations are added to the compact default
+                    requested = set(requested) | set(self.context.get("expand") or ())
+
+        expand = self.context.get("expand")
+        for name, build in self.expanded_fields.items():
+            if expand and name in expand and name in fields:
+                fields[name] = build()
+
+        if expand is not None:
+            expand = set(expand) | set(requested or ())
+            for name in self.expandable_fields:
+                if name not in expand:
+                    fields.pop(name, None)
+
+        if requested is not None:
+            fields = {
+                name: field
+                for name, field in fields.items()
+                if name in requested or field.write_only
+            }
+        return fields
+
+    def get_only_fields(self, prefix=""):
+        """
+        Return the ``QuerySet.only()`` lookups needed to render this serializer.
+
+        Nested single-object serializers are followed through their foreign
+        key; many-valued relations are left to ``setup_eager_loading``.
+        """
+        model = self.Meta.model
+        columns = [prefix + model._meta.pk.name]
+        for name, field in self.fields.items():
+            if field.write_only or isinstance(field, serializers.ListSerializer):
+                continue
+            if name in self.field_columns:
+                columns.extend(prefix + column for column in self.field_columns[name])
+                continue
+            model_field = concrete_field(model, field.source)
+            if model_field is None:
+                continue
+            columns.append(prefix + model_field.name)
+            if isinstance(field, SparseFieldsetSerializerMixin):
+                columns.extend(
+                    field.get_only_fields(prefix=f"{prefix}{model_field.name}__")
+                )
+        return columns
+
+
+class SparseFieldsetViewMixin:
+    """
+    Pass ``?fields=``/``?expand=`` to the serializer and trim the queryset.
+
+    ``compact_actions`` are list views: nothing is expanded unless asked
+    for, the serializer's ``Meta.compact_fields`` apply when no ``?fields=``
+    is given and ``Meta.detail_only_fields`` are dropped.
+    """
+
+    compact_actions = ()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        fields = parse_list_param(self.request, FIELDS_PARAM)
+        expand = parse_list_param(self.request, EXPAND_PARAM)
+        compact = getattr(self, "action", None) in self.compact_actions
+        if expand is None and compact:
+            expand = set()
+        context.update(
+            {
+                "fields": fields,
+                "expand": expand,
+                "compact": compact and fields is None,
+                "list_view": compact,
+            }
+        )
+        return context
+
+    def get_ordering_columns(self, model):
+        """Columns read by ordering and cursor pagination."""
+        names = [name.lstrip("-") for name in model._meta.ordering]
+        paginator = getattr(self, "paginator", None)
+        names.extend(name.lstrip("-") for name in getattr(paginator, "ordering", ()))
+        ordering = self.request.query_params.get("ordering", "") if self.request else ""
+        names.extend(name.strip().lstrip("-") for name in ordering.split(","))
+        return [name for name in names if concrete_field(model, name) is not None]
+
+    def optimize_queryset(self, queryset):
+        """
+        Apply the serializer's eager loading, and on reads defer every column
+        the response will not render.
+        """
+        serializer = self.get_serializer()
+        queryset = serializer.setup_eager_loading(queryset)
+        if self.request is not None and self.request.method in SAFE_METHODS:
+            queryset = queryset.only(
+                *serializer.get_only_fields(),
+                *self.get_ordering_columns(queryset.model),
+            )
+        return queryset
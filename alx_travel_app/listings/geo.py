@@ -0,0 +1,227 @@
+"""
+Geospatial search for listings.
+
+This module contains a pure-Python geohash implementation and the filter
+backend behind the ``?near=`` / ``?bbox=`` listing filters. Listings store a
+full-precision geohash in an indexed column; a search box is covered with a
+handful of geohash cells whose prefix ranges become index range scans, and
+the exact haversine distance is only evaluated on those candidate rows.
+"""
+
+import math
+
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+
+# Annotation holding the distance in km from the ``?near=`` point.
+DISTANCE_ANNOTATION = "distance"
+
+# Upper bound on the number of geohash cells used to cover a search box.
+MAX_COVER_CELLS = 32
+MAX_RADIUS_KM = 1000
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Return the geohash of a point."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                value = (value << 1) | 1
+                lon_range[0] = mid
+            else:
+                value <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                value = (value << 1) | 1
+                lat_range[0] = mid
+            else:
+                value <<= 1
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """Return the ``(lat_degrees, lon_degrees)`` extent of a geohash cell."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    return 180.0 / 2**lat_bits, 360.0 / 2**lon_bits
+
+
+def split_antimeridian(min_lat, min_lon, max_lat, max_lon):
+    """Split a box crossing the antimeridian (``min_lon > max_lon``) in two."""
+    if min_lon <= max_lon:
+        return [(min_lat, min_lon, max_lat, max_lon)]
+    return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+
+
+def cover(boxes, max_cells=MAX_COVER_CELLS):
+    """
+    Return the geohash prefixes of the cells covering ``boxes``.
+
+    The finest precision whose cover stays within ``max_cells`` is used; an
+    empty list means the boxes are too large for a prefix filter to help.
+    """
+    best = []
+    for precision in range(1, PRECISION + 1):
+        lat_step, lon_step = cell_size(precision)
+        cells = set()
+        for min_lat, min_lon, max_lat, max_lon in boxes:
+            rows = range(
+                math.floor((min_lat + 90) / lat_step),
+                math.floor((max_lat + 90) / lat_step) + 1,
+            )
+            cols = range(
+                math.floor((min_lon + 180) / lon_step),
+                math.floor((max_lon + 180) / lon_step) + 1,
+            )
+            if len(cells) + len(rows) * len(cols) > max_cells:
+                return best
+            for row in rows:
+                lat = min(-90 + (row + 0.5) * lat_step, 90.0)
+                for col in cols:
+                    lon = min(-180 + (col + 0.5) * lon_step, 180.0)
+                    cells.add(encode(lat, lon, precision))
+        if len(cells) > max_cells:
+            return best
+        best = sorted(cells)
+    return best
+
+
+def prefix_filter(prefixes):
+    """Build an index-friendly range predicate matching any of ``prefixes``."""
+    query = Q()
+    for prefix in prefixes:
+        # "~" sorts after every geohash character
+        query |= Q(geohash__gte=prefix, geohash__lt=prefix + "~")
+    return query
+
+
+def radius_box(latitude, longitude, radius_km):
+    """Return the lat/lon bounding boxes enclosing a search circle."""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(latitude - lat_delta, -90.0)
+    max_lat = min(latitude + lat_delta, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+
+    ratio = math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude))
+    lon_delta = math.degrees(math.asin(min(ratio, 1.0)))
+    min_lon = longitude - lon_delta
+    max_lon = longitude + lon_delta
+    if lon_delta >= 180 or max_lon - min_lon >= 360:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return split_antimeridian(min_lat, min_lon, max_lat, max_lon)
+
+
+def box_filter(boxes):
+    """Filter rows whose coordinates fall inside any of ``boxes``."""
+    query = Q()
+    for min_lat, min_lon, max_lat, max_lon in boxes:
+        query |= Q(
+            latitude__gte=min_lat,
+            latitude__lte=max_lat,
+            longitude__gte=min_lon,
+            longitude__lte=max_lon,
+        )
+    return query
+
+
+def haversine(latitude, longitude):
+    """Return an expression for the distance in km from a point."""
+    lat1 = math.radians(latitude)
+    dlat = Radians(F("latitude")) - lat1
+    dlon = Radians(F("longitude")) - math.radians(longitude)
+    a = Power(Sin(dlat / 2), 2) + math.cos(lat1) * Cos(Radians(F("latitude"))) * Power(
+        Sin(dlon / 2), 2
+    )
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(a), output_field=FloatField())
+
+
+def parse_floats(value, count, name):
+    try:
+        numbers = [float(part) for part in value.split(",")]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count or not all(math.isfinite(n) for n in numbers):
+        raise ValidationError({name: f"Expected {count} comma-separated numbers."})
+    return numbers
+
+
+def validate_point(latitude, longitude, name):
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValidationError({name: "Coordinates are out of range."})
+
+
+class GeoFilter(filters.BaseFilterBackend):
+    """
+    Filter listings by ``?near=lat,lon&radius_km=`` or ``?bbox=``.
+
+    ``bbox`` is ``min_lon,min_lat,max_lon,max_lat``; a box with
+    ``min_lon > max_lon`` crosses the antimeridian. ``near`` results are
+    annotated with their ``distance`` in km, which the paginator orders by.
+    """
+
+    near_param = "near"
+    radius_param = "radius_km"
+    bbox_param = "bbox"
+    default_radius_km = 10
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        if params.get(self.bbox_param):
+            min_lon, min_lat, max_lon, max_lat = parse_floats(
+                params[self.bbox_param], 4, self.bbox_param
+            )
+            validate_point(min_lat, min_lon, self.bbox_param)
+            validate_point(max_lat, max_lon, self.bbox_param)
+            if min_lat > max_lat:
+                raise ValidationError({self.bbox_param: "min_lat exceeds max_lat."})
+            boxes = split_antimeridian(min_lat, min_lon, max_lat, max_lon)
+            queryset = queryset.filter(prefix_filter(cover(boxes)), box_filter(boxes))
+
+        if params.get(self.near_param):
+            latitude, longitude = parse_floats(
+                params[self.near_param], 2, self.near_param
+            )
+            validate_point(latitude, longitude, self.near_param)
+            radius_km = params.get(self.radius_param, self.default_radius_km)
+            try:
+                radius_km = float(radius_km)
+            except (TypeError, ValueError):
+                radius_km = -1
+            if not 0 < radius_km <= MAX_RADIUS_KM:
+                raise ValidationError(
+                    {self.radius_param: f"Must be between 0 and {MAX_RADIUS_KM}."}
+                )
+            boxes = radius_box(latitude, longitude, radius_km)
+            queryset = (
+                queryset.filter(prefix_filter(cover(boxes)), box_filter(boxes))
+                .annotate(**{DISTANCE_ANNOTATION: haversine(latitude, longitude)})
+                .filter(**{f"{DISTANCE_ANNOTATION}__lte": radius_km})
+            )
+        return queryset
@@ -0,0 +1,163 @@
+"""
+Idempotency keys for retried POSTs.
+
+This module contains the ``idempotent`` view decorator. A client sends a
+unique ``Idempotency-Key`` header with a POST; the first request with that
+key is handled normally and its response stored in ``IdempotencyKey``, and
+any retry with the same key replays the stored response with one lookup,
+without creating rows, calling the payment gateway or queueing tasks again.
+Keys are scoped to the user, expire after ``IDEMPOTENCY_KEY_TTL`` seconds
+and are purged by ``purge_expired_keys``; a key left without a response by
+a worker that died mid-request can be retried after
+``IDEMPOTENCY_LOCK_TIMEOUT`` seconds.
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field("key").max_length
+DEFAULT_PURGE_BATCH_SIZE = 1000
+
+
+class IdempotencyKeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A request with this Idempotency-Key is still being processed."
+    default_code = "idempotency_key_in_use"
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was already used for a different request."
+    default_code = "idempotency_key_reused"
+
+
+def key_ttl():
+    return timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", 86400))
+
+
+def lock_timeout():
+    return timedelta(seconds=getattr(settings, "IDEMPOTENCY_LOCK_TIMEOUT", 60))
+
+
+def fingerprint(request):
+    """Hash the method, path and parsed body of a request."""
+    data = request.data
+    if hasattr(data, "lists"):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    payload = f"{request.method}\n{request.path}\n{body}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim(user, key, digest):
+    """
+    Claim ``key`` for a new request.
+
+    Returns ``(record, None)`` when the caller should handle the request,
+    or ``(None, response)`` with the response to replay. A key whose
+    request stored no response within ``IDEMPOTENCY_LOCK_TIMEOUT`` seconds
+    is treated as abandoned by a dead worker and claimed again.
+    """
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is not None and record.expires_at <= now:
+        # Expired but not purged yet; free the key for reuse
+        IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).delete()
+        record = None
+    if record is None:
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user, key=key, fingerprint=digest, expires_at=now + key_ttl()
+                )
+            return record, None
+        except IntegrityError:
+            # A concurrent request claimed the key first
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is None:
+                raise IdempotencyKeyInUse()
+
+    if record.fingerprint != digest:
+        raise IdempotencyKeyReused()
+    if record.status_code is not None:
+        return None, Response(
+            record.response,
+            status=record.status_code,
+            headers={REPLAYED_HEADER: "true"},
+        )
+    if record.created_at > now - lock_timeout():
+        raise IdempotencyKeyInUse()
+    # Take over the lease, unless another retry got there first
+    reclaimed = IdempotencyKey.objects.filter(
+        pk=record.pk, status_code__isnull=True, created_at=record.created_at
+    ).update(created_at=now, expires_at=now + key_ttl())
+    if not reclaimed:
+        raise IdempotencyKeyInUse()
+    record.created_at = now
+    return record, None
+
+
+def idempotent(view_method):
+    """
+    Make a POST handler replay its first response for a repeated key.
+
+    Requests without the header are handled as usual. Every response the
+    handler returns is stored, server errors included, since the handler
+    may already have written rows or called the payment gateway. If the
+    handler raises instead, the key is released so the client can retry.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view_method(self, request, *args, **kwargs)
+        if not key.strip() or len(key) > MAX_KEY_LENGTH:
+            raise ValidationError(
+                {HEADER: f"Must be 1 to {MAX_KEY_LENGTH} characters long."}
+            )
+
+        record, response = claim(request.user, key, fingerprint(request))
+        if response is not None:
+            return response
+        # Scoped to this lease, so a request whose key was reclaimed after
+        # the lock timeout cannot overwrite or release the new holder's row
+        lease = IdempotencyKey.objects.filter(
+            pk=record.pk, created_at=record.created_at
+        )
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except BaseException:
+            lease.delete()
+            raise
+        lease.update(status_code=response.status_code, response=response.data)
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys(batch_size=DEFAULT_PURGE_BATCH_SIZE):
+    """Delete expired keys in batches; returns the number deleted."""
+    expired = IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+    purged = 0
+    while True:
+        pks = list(expired.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
+        if len(pks) < batch_size:
+            return purged
@@ -0,0 +1,177 @@
+"""
+Image derivatives for the listings app.
+
+This module contains the Pillow pipeline that turns an uploaded listing
+photo into resized WebP and JPEG variants at a few fixed widths. Variants
+are stored as blobs in the same content-addressed storage as the original
+and described by a JSON column on the owning row, which the serializers turn
+into URLs so list views never have to ship the original upload.
+"""
+
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import blobs, cache
+from .models import Listing, ListingImage
+from .storage import image_storage
+
+# Labels and target widths in pixels; images are never upscaled
+VARIANT_WIDTHS = {"small": 320, "medium": 768, "large": 1280}
+
+# Extension -> (Pillow format, encoder options)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def variant_name(name, label, extension):
+    root, _ = os.path.splitext(name)
+    return f"{root}_{label}.{extension}"
+
+
+def variant_files(variants):
+    """Return the storage names of every file described by ``variants``."""
+    return [
+        entry[extension]
+        for entry in (variants or {}).get("sizes", {}).values()
+        for extension in VARIANT_FORMATS
+        if extension in entry
+    ]
+
+
+def variants_stale(name, variants):
+    """Whether ``variants`` were not generated from the image called ``name``."""
+    return (variants or {}).get("source") != (name or None)
+
+
+def open_image(name, storage, max_width):
+    """Open and decode an image, upright and in RGB."""
+    with storage.open(name) as source:
+        image = Image.open(source)
+        # Let the JPEG decoder downscale while decoding when it can
+        image.draft("RGB", (max_width, max_width))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def render_variants(name, storage=image_storage):
+    """Generate and store the variants of ``name``; return their metadata."""
+    image = open_image(name, storage, max(VARIANT_WIDTHS.values()))
+    sizes = {}
+    # Widest first, so each variant is downscaled from the previous one
+    for label, width in sorted(VARIANT_WIDTHS.items(), key=lambda item: -item[1]):
+        width = min(width, image.width)
+        if width < image.width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize(
+                (width, height), Image.Resampling.LANCZOS, reducing_gap=3.0
+            )
+        entry = {"width": image.width, "height": image.height}
+        for extension, (image_format, options) in VARIANT_FORMATS.items():
+            buffer = BytesIO()
+            image.save(buffer, image_format, **options)
+            entry[extension] = storage.save(
+                variant_name(name, label, extension), ContentFile(buffer.getvalue())
+            )
+        sizes[label] = entry
+    return {"source": name, "sizes": sizes}
+
+
+def shared_variants(name):
+    """Return the variants already rendered for ``name`` by another row, if any."""
+    for model, (file_field, variants_field) in blobs.REFERENCE_FIELDS.items():
+        rows = model._default_manager.filter(**{file_field: name}).values_list(
+            variants_field, flat=True
+        )
+        for variants in rows[:10]:
+            if not variants_stale(name, variants):
+                return variants
+    return None
+
+
+def update_variants(queryset, file_field, variants_field, **changes):
+    """
+    Bring the variants of the single row in ``queryset`` up to date.
+
+    The row is only updated if its image did not change while the variants
+    were being rendered; otherwise the new blobs stay unreferenced and are
+    garbage collected. Returns whether the row was updated.
+    """
+    row = queryset.values(file_field, variants_field).first()
+    if row is None or not variants_stale(row[file_field], row[variants_field]):
+        return False
+    name, old = row[file_field], row[variants_field]
+    if not name:
+        variants = {}
+    else:
+        # Identical uploads share one blob, so their variants can be shared too
+        variants = shared_variants(name) or render_variants(name)
+    with transaction.atomic():
+        updated = queryset.filter(**{file_field: name}).update(
+            **{variants_field: variants}, **changes
+        )
+        if updated:
+            blobs.replace_references(variant_files(old), variant_files(variants))
+    return bool(updated)
+
+
+def generate_listing_image_variants(image_id):
+    """Generate variants for a ListingImage. Returns whether it was updated."""
+    listing_id = (
+        ListingImage.objects.filter(pk=image_id)
+        .values_list("listing_id", flat=True)
+        .first()
+    )
+    if listing_id is None:
+        return False
+    updated = update_variants(
+        ListingImage.objects.filter(pk=image_id), "image", "variants"
+    )
+    if updated:
+        # The variants are part of the listing payload
+        Listing.objects.filter(pk=listing_id).update(updated_at=timezone.now())
+        cache.invalidate_listing(listing_id)
+    return updated
+
+
+def generate_featured_image_variants(listing_id):
+    """Generate variants for a listing's featured_image."""
+    updated = update_variants(
+        Listing.objects.filter(pk=listing_id),
+        "featured_image",
+        "featured_image_variants",
+        updated_at=timezone.now(),
+    )
+    if updated:
+        cache.invalidate_listing(listing_id)
+    return updated
+
+
+def variant_urls(variants, request=None, storage=image_storage):
+    """Describe each stored variant with its size and per-format URLs."""
+    sizes = (variants or {}).get("sizes", {})
+    urls = {}
+    for label in VARIANT_WIDTHS:
+        if label not in sizes:
+            continue
+        entry = sizes[label]
+        urls[label] = {"width": entry["width"], "height": entry["height"]}
+        for extension in VARIANT_FORMATS:
+            if extension in entry:
+                url = storage.url(entry[extension])
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                urls[label][extension] = url
+    return urls
@@ -0,0 +1,256 @@
+"""
+Bulk import of listings.
+
+This module contains the batched import behind ``manage.py import_listings``.
+Rows are streamed from CSV or JSON Lines input, validated against the model
+fields and written with ``bulk_create`` in chunks, one transaction per
+chunk. Because ``bulk_create`` skips ``Listing.save()`` and signals, the
+importer derives slugs, geohashes and amenity masks itself and refreshes the
+search index and caches once the rows are committed.
+"""
+
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.utils.text import slugify
+
+from . import cache, geo, search
+from .amenities import amenity_keys, amenity_mask
+from .models import Listing, ListingAmenity
+
+FORMATS = ("csv", "jsonl")
+DEFAULT_BATCH_SIZE = 1000
+# Skipped rows whose errors are kept for the report
+MAX_REPORTED_ERRORS = 20
+
+# Input columns copied onto Listing; "slug" and "amenities" are optional extras
+IMPORT_FIELDS = (
+    "title",
+    "description",
+    "listing_type",
+    "price_per_night",
+    "weekend_multiplier",
+    "location",
+    "address",
+    "latitude",
+    "longitude",
+    "max_guests",
+    "bedrooms",
+    "bathrooms",
+    "is_available",
+)
+
+# Spellings of booleans accepted in CSV input, on top of Django's own
+BOOLEAN_STRINGS = {
+    "true": True,
+    "yes": True,
+    "y": True,
+    "false": False,
+    "no": False,
+    "n": False,
+}
+
+
+class RowError(Exception):
+    """An input row that cannot be imported."""
+
+    def __init__(self, line, message):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def read_rows(stream, input_format):
+    """
+    Yield ``(line_number, record)`` for every record of ``stream``.
+
+    CSV records are dicts; JSON Lines records are the raw lines, decoded by
+    ``decode_row`` so a malformed line is an ordinary row error.
+    """
+    if input_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if line.strip():
+            yield line_number, line
+
+
+def decode_row(line, record):
+    if not isinstance(record, str):
+        return record
+    try:
+        row = json.loads(record)
+    except ValueError as exc:
+        raise RowError(line, f"Invalid JSON: {exc}") from None
+    if not isinstance(row, dict):
+        raise RowError(line, "Expected a JSON object.")
+    return row
+
+
+class SlugAllocator:
+    """
+    Hand out unique listing slugs without a query per listing.
+
+    Existing slugs are loaded once; collisions get a ``-2``, ``-3``...
+    suffix, continuing from the last suffix used for the same base.
+    """
+
+    max_length = Listing._meta.get_field("slug").max_length
+
+    def __init__(self, taken=None):
+        if taken is None:
+            taken = Listing.objects.values_list("slug", flat=True).iterator(
+                chunk_size=10000
+            )
+        self.taken = set(taken)
+        self.next_suffix = {}
+
+    def allocate(self, text):
+        base = slugify(text)[: self.max_length - 10].strip("-") or "listing"
+        slug = base
+        suffix = self.next_suffix.get(base, 2)
+        while slug in self.taken:
+            slug = f"{base}-{suffix}"
+            suffix += 1
+        self.next_suffix[base] = suffix
+        self.taken.add(slug)
+        return slug
+
+
+def clean_value(field, raw):
+    """Convert an input value with the model field's own validation."""
+    if raw is None or raw == "":
+        if field.has_default():
+            return field.get_default()
+        if field.null:
+            return None
+        if not field.blank:
+            raise ValidationError("This field is required.")
+        raw = ""
+    if isinstance(field, models.BooleanField) and isinstance(raw, str):
+        raw = BOOLEAN_STRINGS.get(raw.strip().lower(), raw)
+    return field.clean(raw, None)
+
+
+def parse_amenities(raw):
+    if raw is None or raw == "":
+        return []
+    if isinstance(raw, str):
+        return [token.strip() for token in raw.split(",") if token.strip()]
+    if isinstance(raw, list):
+        return [str(token).strip() for token in raw if str(token).strip()]
+    raise ValueError("amenities must be a list or a comma-separated string.")
+
+
+class ListingImporter:
+    """
+    Build and write listings in batches.
+
+    ``progress`` is called after every committed batch with the running
+    totals of imported and skipped rows. With ``skip_invalid`` invalid rows
+    are counted and skipped; otherwise the first one raises ``RowError``,
+    leaving the batches already committed in place.
+    """
+
+    def __init__(
+        self, batch_size=DEFAULT_BATCH_SIZE, skip_invalid=False, progress=None
+    ):
+        self.batch_size = batch_size
+        self.skip_invalid = skip_invalid
+        self.progress = progress
+        self.fields = [Listing._meta.get_field(name) for name in IMPORT_FIELDS]
+        self.amenities = amenity_keys()
+        self.slugs = SlugAllocator()
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+
+    def build(self, line, record):
+        """Return the unsaved listing and amenity ids for an input record."""
+        row = decode_row(line, record)
+        values, errors = {}, []
+        for field in self.fields:
+            try:
+                values[field.name] = clean_value(field, row.get(field.name))
+            except ValidationError as exc:
+                errors.append(f"{field.name}: {' '.join(exc.messages)}")
+
+        try:
+            tokens = parse_amenities(row.get("amenities"))
+        except ValueError as exc:
+            errors.append(str(exc))
+            tokens = []
+        matches = [self.amenities.get(slugify(token)) for token in tokens]
+        unknown = [token for token, match in zip(tokens, matches) if match is None]
+        if unknown:
+            errors.append(f"Unknown amenities: {', '.join(unknown)}.")
+        if errors:
+            raise RowError(line, "; ".join(errors))
+
+        listing = Listing(**values)
+        listing.slug = self.slugs.allocate(row.get("slug") or listing.title)
+        if listing.latitude is not None and listing.longitude is not None:
+            listing.geohash = geo.encode(listing.latitude, listing.longitude)
+        listing.amenity_mask = amenity_mask(bit for _, bit in matches)
+        return listing, {pk for pk, _ in matches}
+
+    def write(self, batch):
+        """Insert one batch of ``(listing, amenity_ids)`` in a transaction."""
+        listings = [listing for listing, _ in batch]
+        with transaction.atomic():
+            Listing.objects.bulk_create(listings, batch_size=self.batch_size)
+            if any(listing.pk is None for listing in listings):
+                # Backends such as MySQL do not return the new primary keys
+                pks = dict(
+                    Listing.objects.filter(
+                        slug__in=[listing.slug for listing in listings]
+                    ).values_list("slug", "pk")
+                )
+                for listing in listings:
+                    listing.pk = pks[listing.slug]
+            ListingAmenity.objects.bulk_create(
+                [
+                    ListingAmenity(listing_id=listing.pk, amenity_id=amenity_id)
+                    for listing, amenity_ids in batch
+                    for amenity_id in amenity_ids
+                ],
+                batch_size=self.batch_size,
+            )
+            transaction.on_commit(lambda: self.index(listings))
+        self.imported += len(listings)
+
+    def index(self, listings):
+        for listing in listings:
+            search.index_listing(listing)
+
+    def run(self, rows):
+        """Import ``read_rows`` output; returns the number of rows imported."""
+        batch = []
+        for line, record in rows:
+            try:
+                batch.append(self.build(line, record))
+            except RowError as exc:
+                if not self.skip_invalid:
+                    raise
+                self.skipped += 1
+                if len(self.errors) < MAX_REPORTED_ERRORS:
+                    self.errors.append(str(exc))
+                continue
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+        if self.imported:
+            # The rows bypassed the signals that keep cached payloads fresh
+            cache.invalidate_all()
+        return self.imported
+
+    def flush(self, batch):
+        self.write(batch)
+        if self.progress is not None:
+            self.progress(self.imported, self.skipped)
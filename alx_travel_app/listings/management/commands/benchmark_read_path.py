@@ -0,0 +1,133 @@
+"""
+Management command to benchmark the fast list read path.
+
+This command renders the listing, booking and review list endpoints through
+the serializer with the stock JSON renderer and through the ``values()``
+fast path, reports rows per second for both and checks that they produce the
+same bytes. Benchmark rows are created in a transaction that is rolled back.
+"""
+
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+from listings.models import Booking, Listing, Review
+from listings.views import BookingViewSet, ListingViewSet, ReviewViewSet
+
+ENDPOINTS = [
+    ("listings", ListingViewSet, "list", "/api/listings/?page_size=100"),
+    ("my_bookings", BookingViewSet, "my_bookings", "/api/bookings/my_bookings/"),
+    ("reviews", ReviewViewSet, "list", "/api/reviews/"),
+]
+
+
+class Command(BaseCommand):
+    help = "Compares rows/sec of the serializer and fast list read paths"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=500,
+            help="Number of listings, bookings and reviews to create (default: 500)",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Requests timed per endpoint and path (default: 20)",
+        )
+
+    def handle(self, *args, **options):
+        if options["rows"] < 1 or options["repeat"] < 1:
+            raise CommandError("--rows and --repeat must be positive")
+
+        with transaction.atomic():
+            user = self.create_rows(options["rows"])
+            for name, viewset, action, url in ENDPOINTS:
+                slow = viewset.as_view(
+                    {"get": action}, fast_actions=(), renderer_classes=[JSONRenderer]
+                )
+                fast = viewset.as_view({"get": action})
+                slow_content, slow_rate = self.measure(
+                    slow, url, user, options["repeat"]
+                )
+                fast_content, fast_rate = self.measure(
+                    fast, url, user, options["repeat"]
+                )
+                identical = "identical" if slow_content == fast_content else "DIFFERENT"
+                self.stdout.write(
+                    f"{name:<12} serializer {slow_rate:>10,.0f} rows/s  "
+                    f"fast {fast_rate:>10,.0f} rows/s  "
+                    f"({fast_rate / slow_rate:.1f}x, output {identical})"
+                )
+            transaction.set_rollback(True)
+
+    def create_rows(self, count):
+        user = User.objects.create(username="benchmark-read-path")
+        listings = Listing.objects.bulk_create(
+            Listing(
+                title=f"Benchmark listing {i}",
+                slug=f"benchmark-listing-{i}",
+                description="A place to stay.",
+                listing_type="apartment",
+                price_per_night=Decimal("100.00") + i,
+                location="Addis Ababa",
+                address="Bole Road",
+                latitude=9.0 + i / 1000,
+                longitude=38.7,
+                max_guests=4,
+                bedrooms=2,
+                bathrooms=1,
+                featured_image=f"listings/{i}.jpg",
+            )
+            for i in range(count)
+        )
+        if any(listing.pk is None for listing in listings):
+            # Backends such as MySQL do not return the new primary keys
+            listings = Listing.objects.filter(
+                slug__in=[listing.slug for listing in listings]
+            ).only("pk")
+        Booking.objects.bulk_create(
+            Booking(
+                user=user,
+                listing_id=listing.pk,
+                check_in_date=date.today(),
+                check_out_date=date.today() + timedelta(days=2),
+                num_guests=2,
+                total_price=Decimal("200.00"),
+            )
+            for listing in listings
+        )
+        bookings = Booking.objects.filter(user=user).values_list("pk", "listing_id")
+        Review.objects.bulk_create(
+            Review(
+                user=user,
+                listing_id=listing_id,
+                booking_id=booking_id,
+                rating=5,
+                comment="Great stay.",
+            )
+            for booking_id, listing_id in bookings
+        )
+        return user
+
+    def measure(self, view, url, user, repeat):
+        """Return the rendered content and the rows rendered per second."""
+        factory = APIRequestFactory()
+        rows = 0
+        started = time.perf_counter()
+        for _ in range(repeat):
+            request = factory.get(url)
+            force_authenticate(request, user=user)
+            response = view(request)
+            response.render()
+            data = response.data
+            rows += len(data["results"] if isinstance(data, dict) else data)
+        elapsed = time.perf_counter() - started
+        return response.content, rows / elapsed
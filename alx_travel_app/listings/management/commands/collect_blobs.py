@@ -0,0 +1,43 @@
+"""
+Management command to garbage collect listing image blobs.
+
+This command deletes content-addressed image files that no listing or
+listing image has referenced for the grace period, optionally recomputing
+every reference count from the image columns first.
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from listings import blobs
+
+
+class Command(BaseCommand):
+    help = "Deletes unreferenced listing image blobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-seconds",
+            type=int,
+            help="Keep blobs released more recently than this "
+            "(default: LISTING_BLOB_GRACE_PERIOD)",
+        )
+        parser.add_argument(
+            "--recount",
+            action="store_true",
+            help="Recompute reference counts before collecting",
+        )
+
+    def handle(self, *args, **options):
+        grace = options["grace_seconds"]
+        if grace is not None and grace < 0:
+            raise CommandError("--grace-seconds must not be negative")
+
+        if options["recount"]:
+            total = blobs.recount()
+            self.stdout.write(f"Recounted references of {total} blobs")
+
+        deleted = blobs.collect_garbage(
+            None if grace is None else timedelta(seconds=grace)
+        )
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} unreferenced blobs"))
@@ -0,0 +1,57 @@
+"""
+Management command to export listings, bookings or reviews.
+
+This command streams a full table as NDJSON or CSV to stdout or a file using
+the same batched export as the API, so memory use does not grow with the
+table size.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from listings.export import CONTENT_TYPES, DEFAULT_CHUNK_SIZE, EXPORTS, stream_export
+
+
+class Command(BaseCommand):
+    help = "Exports listings, bookings or reviews as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", choices=sorted(EXPORTS))
+        parser.add_argument(
+            "--format",
+            dest="export_format",
+            choices=sorted(CONTENT_TYPES),
+            default="ndjson",
+            help="Output format (default: ndjson)",
+        )
+        parser.add_argument(
+            "--output",
+            help="File to write to (default: stdout)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f"Number of rows fetched per query (default: {DEFAULT_CHUNK_SIZE})",
+        )
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        model, columns = EXPORTS[options["dataset"]]
+        chunks = stream_export(
+            model.objects.all(),
+            columns,
+            options["export_format"],
+            options["chunk_size"],
+        )
+        if options["output"] is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+
+        with open(options["output"], "w", newline="", encoding="utf-8") as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(
+            self.style.SUCCESS(f"Exported {options['dataset']} to {options['output']}")
+        )
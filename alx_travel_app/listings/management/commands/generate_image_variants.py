@@ -0,0 +1,49 @@
+"""
+Management command to backfill listing image variants.
+
+This command finds listing images and featured images whose resized variants
+are missing or out of date and queues their generation on Celery, or renders
+them in-process with ``--sync``.
+"""
+
+from django.core.management.base import BaseCommand
+from listings import images, tasks
+from listings.models import Listing, ListingImage
+
+
+class Command(BaseCommand):
+    help = "Generates missing resized variants of listing images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            help="Render variants in this process instead of queueing tasks",
+        )
+
+    def handle(self, *args, **options):
+        jobs = [
+            (
+                ListingImage.objects.values_list("pk", "image", "variants"),
+                tasks.generate_listing_image_variants,
+            ),
+            (
+                Listing.objects.values_list(
+                    "pk", "featured_image", "featured_image_variants"
+                ),
+                tasks.generate_featured_image_variants,
+            ),
+        ]
+        total = 0
+        for rows, task in jobs:
+            for pk, name, variants in rows.order_by("pk").iterator(chunk_size=1000):
+                if not images.variants_stale(name, variants):
+                    continue
+                if options["sync"]:
+                    task(pk)
+                else:
+                    task.delay(pk)
+                total += 1
+
+        action = "Generated" if options["sync"] else "Queued"
+        self.stdout.write(self.style.SUCCESS(f"{action} variants for {total} images"))
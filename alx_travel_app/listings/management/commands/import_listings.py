@@ -0,0 +1,101 @@
+"""
+Management command to bulk import listings.
+
+This command streams listings from a CSV or JSON Lines file (or stdin) and
+inserts them in batches with ``bulk_create``, reporting progress and the
+import rate as it goes.
+"""
+
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from listings.importer import (
+    DEFAULT_BATCH_SIZE,
+    FORMATS,
+    ListingImporter,
+    RowError,
+    read_rows,
+)
+
+
+class Command(BaseCommand):
+    help = "Imports listings from a CSV or JSON Lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or - for stdin")
+        parser.add_argument(
+            "--format",
+            dest="input_format",
+            choices=FORMATS,
+            help="Input format (default: from the file extension)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f"Number of listings per transaction (default: {DEFAULT_BATCH_SIZE})",
+        )
+        parser.add_argument(
+            "--skip-invalid",
+            action="store_true",
+            help="Skip invalid rows instead of stopping at the first one",
+        )
+
+    def get_format(self, path, input_format):
+        if input_format:
+            return input_format
+        extension = os.path.splitext(path)[1].lower().lstrip(".")
+        if extension in ("jsonl", "ndjson"):
+            return "jsonl"
+        if extension == "csv":
+            return "csv"
+        raise CommandError("Cannot tell the input format, pass --format")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        path = options["path"]
+        input_format = self.get_format(path, options["input_format"])
+
+        started = time.monotonic()
+
+        def report(imported, skipped):
+            rate = imported / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(
+                f"Imported {imported} listings, skipped {skipped} ({rate:.0f} rows/s)"
+            )
+
+        importer = ListingImporter(
+            batch_size=options["batch_size"],
+            skip_invalid=options["skip_invalid"],
+            progress=report,
+        )
+        if path == "-":
+            stream = sys.stdin
+        else:
+            try:
+                stream = open(path, newline="", encoding="utf-8-sig")
+            except OSError as exc:
+                raise CommandError(str(exc))
+        try:
+            importer.run(read_rows(stream, input_format))
+        except RowError as exc:
+            raise CommandError(
+                f"{exc} ({importer.imported} listings were already imported)"
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in importer.errors:
+            self.stderr.write(error)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {importer.imported} listings in {elapsed:.1f}s "
+                f"({importer.imported / max(elapsed, 1e-6):.0f} rows/s), "
+                f"skipped {importer.skipped}"
+            )
+        )
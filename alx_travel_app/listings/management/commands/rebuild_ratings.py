@@ -0,0 +1,66 @@
+"""
+Management command to rebuild listing rating aggregates.
+
+This command recomputes the denormalized rating average, count and star
+histogram of every listing from the reviews table in bulk.
+"""
+
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from listings.cache import invalidate_all
+from listings.models import Listing, Review
+from listings.ratings import AGGREGATE_FIELDS, set_aggregates
+
+
+class Command(BaseCommand):
+    help = "Rebuilds rating_avg, rating_count and the star histogram on listings"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of listings updated per query (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        histograms = defaultdict(dict)
+        rows = (
+            Review.objects.order_by()
+            .values_list("listing_id", "rating")
+            .annotate(total=Count("id"))
+        )
+        for listing_id, rating, total in rows:
+            histograms[listing_id][rating] = total
+
+        # updated_at drives the ETag and Last-Modified validators
+        fields = [*AGGREGATE_FIELDS, "updated_at"]
+        now = timezone.now()
+        updated = 0
+        batch = []
+        listings = Listing.objects.only("pk", *AGGREGATE_FIELDS).order_by("pk")
+        with transaction.atomic():
+            for listing in listings.iterator(chunk_size=batch_size):
+                set_aggregates(listing, histograms.get(listing.pk, {}))
+                listing.updated_at = now
+                batch.append(listing)
+                if len(batch) >= batch_size:
+                    Listing.objects.bulk_update(batch, fields)
+                    updated += len(batch)
+                    batch = []
+            if batch:
+                Listing.objects.bulk_update(batch, fields)
+                updated += len(batch)
+
+        # bulk_update bypasses the signals that invalidate cached details
+        invalidate_all()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt rating aggregates for {updated} listings")
+        )
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0003_payment'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='listing',
+            options={'ordering': ['-created_at', '-id'], 'verbose_name': 'Listing', 'verbose_name_plural': 'Listings'},
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['-created_at', '-id'], name='listing_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# FULLTEXT index backing listings.search.FullTextSearchFilter on MySQL.
+
+from django.db import migrations
+
+INDEX_NAME = "listing_fulltext_idx"
+COLUMNS = ("title", "location", "address", "description")
+
+
+def create_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "mysql":
+        return
+    quote = schema_editor.quote_name
+    table = apps.get_model("listings", "Listing")._meta.db_table
+    schema_editor.execute(
+        "CREATE FULLTEXT INDEX %s ON %s (%s)"
+        % (quote(INDEX_NAME), quote(table), ", ".join(quote(c) for c in COLUMNS))
+    )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "mysql":
+        return
+    quote = schema_editor.quote_name
+    table = apps.get_model("listings", "Listing")._meta.db_table
+    schema_editor.execute("DROP INDEX %s ON %s" % (quote(INDEX_NAME), quote(table)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0004_listing_created_id_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
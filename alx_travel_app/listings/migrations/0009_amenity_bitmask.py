@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:29
+
+from django.db import migrations, models
+
+
+def backfill_amenity_masks(apps, schema_editor):
+    Amenity = apps.get_model('listings', 'Amenity')
+    Listing = apps.get_model('listings', 'Listing')
+    ListingAmenity = apps.get_model('listings', 'ListingAmenity')
+    for bit, amenity in enumerate(Amenity.objects.order_by('pk')[:63]):
+        amenity.bit = bit
+        amenity.save(update_fields=['bit'])
+    masks = {}
+    rows = ListingAmenity.objects.filter(amenity__bit__isnull=False).values_list(
+        'listing_id', 'amenity__bit'
+    )
+    for listing_id, bit in rows:
+        masks[listing_id] = masks.get(listing_id, 0) | (1 << bit)
+    for listing_id, mask in masks.items():
+        Listing.objects.filter(pk=listing_id).update(amenity_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0008_booking_listing_dates_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='amenity',
+            name='bit',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='amenity_mask',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_amenity_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0009_amenity_bitmask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeaturedListing',
+            fields=[
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='featured_rank', serialize=False, to='listings.listing')),
+                ('listing_type', models.CharField(choices=[('hotel', 'Hotel'), ('apartment', 'Apartment'), ('villa', 'Villa'), ('resort', 'Resort'), ('hostel', 'Hostel')], max_length=20)),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveIntegerField(db_index=True)),
+                ('type_rank', models.PositiveIntegerField()),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Featured Listing',
+                'verbose_name_plural': 'Featured Listings',
+                'ordering': ['rank'],
+                'indexes': [models.Index(fields=['listing_type', 'type_rank'], name='featured_type_rank_idx')],
+            },
+        ),
+    ]
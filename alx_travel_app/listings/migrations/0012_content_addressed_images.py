@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:48
+
+import django.utils.timezone
+import listings.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0011_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='listing',
+            name='featured_image',
+            field=models.ImageField(blank=True, null=True, storage=listings.storage.ContentAddressedStorage(), upload_to='listings/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='listingimage',
+            name='image',
+            field=models.ImageField(storage=listings.storage.ContentAddressedStorage(), upload_to='listings/%Y/%m/%d/'),
+        ),
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.IntegerField(default=0)),
+                ('touched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Stored Blob',
+                'verbose_name_plural': 'Stored Blobs',
+                'indexes': [models.Index(fields=['refcount', 'touched_at'], name='blob_gc_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:58
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0012_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='weekend_multiplier',
+            field=models.DecimalField(decimal_places=2, default=Decimal('1.00'), max_digits=4, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))]),
+        ),
+        migrations.CreateModel(
+            name='RateOverride',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('price_per_night', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('label', models.CharField(blank=True, max_length=100)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rate_overrides', to='listings.listing')),
+            ],
+            options={
+                'verbose_name': 'Rate Override',
+                'verbose_name_plural': 'Rate Overrides',
+                'ordering': ['start_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StayDiscount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_nights', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(2)])),
+                ('percent', models.DecimalField(decimal_places=2, max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stay_discounts', to='listings.listing')),
+            ],
+            options={
+                'verbose_name': 'Stay Discount',
+                'verbose_name_plural': 'Stay Discounts',
+                'ordering': ['min_nights'],
+                'unique_together': {('listing', 'min_nights')},
+            },
+        ),
+    ]
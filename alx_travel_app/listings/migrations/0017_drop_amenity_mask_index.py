@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 05:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0016_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='listing',
+            name='amenity_mask',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -4,10 +4,19 @@ Models for the listings app.
 This module contains the database models for travel listings and related entities.
 """
 
-from django.db import models
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 from django.utils.text import slugify
 from django.contrib.auth.models import User
 
+from . import geo
+from .storage import image_storage
+
 
 class Listing(models.Model):
     """
@@ -27,32 +36,180 @@ class Listing(models.Model):
     description = models.TextField()
     listing_type = models.CharField(max_length=20, choices=LISTING_TYPE_CHOICES)
     price_per_night = models.DecimalField(max_digits=10, decimal_places=2)
+    # Applied to Friday and Saturday nights by listings.pricing
+    weekend_multiplier = models.DecimalField(
+        max_digits=4,
+        decimal_places=2,
+        default=Decimal("1.00"),
+        validators=[MinValueValidator(Decimal("0.01"))],
+    )
     location = models.CharField(max_length=200)
     address = models.CharField(max_length=255)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # Derived from latitude/longitude on save; indexed for prefix range scans
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     max_guests = models.PositiveIntegerField()
     bedrooms = models.PositiveIntegerField()
     bathrooms = models.PositiveIntegerField()
     featured_image = models.ImageField(
-        upload_to="listings/%Y/%m/%d/", blank=True, null=True
+        upload_to="listings/%Y/%m/%d/", storage=image_storage, blank=True, null=True
     )
+    # Resized copies of featured_image, maintained by listings.images
+    featured_image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_available = models.BooleanField(default=True)
+    # OR of the Amenity.bit of every linked amenity, maintained by signals
+    amenity_mask = models.PositiveBigIntegerField(default=0, editable=False)
+    # Review aggregates, maintained by listings.ratings
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        ordering = ["-created_at"]
+        ordering = ["-created_at", "-id"]
         verbose_name = "Listing"
         verbose_name_plural = "Listings"
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="listing_created_id_idx"),
+        ]
 
     def __str__(self):
         return self.title
 
+    @property
+    def rating_histogram(self):
+        """Number of reviews per star rating, keyed 1-5."""
+        return {stars: getattr(self, f"rating_{stars}_count") for stars in range(1, 6)}
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geo.encode(self.latitude, self.longitude)
+        else:
+            self.geohash = ""
         super().save(*args, **kwargs)
 
 
+class RateOverride(models.Model):
+    """
+    Nightly price of a listing over a date range, such as a season.
+
+    Where overrides overlap, the shortest range applies.
+    """
+
+    listing = models.ForeignKey(
+        Listing, related_name="rate_overrides", on_delete=models.CASCADE
+    )
+    start_date = models.DateField()
+    # Last night charged at this rate
+    end_date = models.DateField()
+    price_per_night = models.DecimalField(max_digits=10, decimal_places=2)
+    label = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        ordering = ["start_date"]
+        verbose_name = "Rate Override"
+        verbose_name_plural = "Rate Overrides"
+
+    def __str__(self):
+        return f"{self.listing.title}: {self.start_date} to {self.end_date}"
+
+    def clean(self):
+        if self.start_date and self.end_date and self.end_date < self.start_date:
+            raise ValidationError({"end_date": "Must not be before the start date."})
+
+
+class StayDiscount(models.Model):
+    """
+    Percentage off a listing's stays of at least ``min_nights`` nights.
+
+    Only the largest applicable discount is used.
+    """
+
+    listing = models.ForeignKey(
+        Listing, related_name="stay_discounts", on_delete=models.CASCADE
+    )
+    min_nights = models.PositiveIntegerField(validators=[MinValueValidator(2)])
+    percent = models.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        validators=[MinValueValidator(0), MaxValueValidator(100)],
+    )
+
+    class Meta:
+        ordering = ["min_nights"]
+        unique_together = ("listing", "min_nights")
+        verbose_name = "Stay Discount"
+        verbose_name_plural = "Stay Discounts"
+
+    def __str__(self):
+        return f"{self.percent}% off {self.min_nights}+ nights at {self.listing.title}"
+
+
+class FeaturedListing(models.Model):
+    """
+    Materialized featured ranking, recomputed by a periodic Celery task.
+    """
+
+    listing = models.OneToOneField(
+        Listing,
+        primary_key=True,
+        related_name="featured_rank",
+        on_delete=models.CASCADE,
+    )
+    listing_type = models.CharField(max_length=20, choices=Listing.LISTING_TYPE_CHOICES)
+    score = models.FloatField()
+    rank = models.PositiveIntegerField(db_index=True)
+    type_rank = models.PositiveIntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["rank"]
+        verbose_name = "Featured Listing"
+        verbose_name_plural = "Featured Listings"
+        indexes = [
+            models.Index(
+                fields=["listing_type", "type_rank"], name="featured_type_rank_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"#{self.rank} {self.listing.title}"
+
+
+class StoredBlob(models.Model):
+    """
+    A content-addressed image file shared by every row that references it.
+
+    ``refcount`` counts references from listing image fields and their
+    variants; unreferenced blobs are deleted by listings.blobs after a grace
+    period.
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.IntegerField(default=0)
+    # Last upload of this content or release of a reference
+    touched_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Stored Blob"
+        verbose_name_plural = "Stored Blobs"
+        indexes = [
+            models.Index(fields=["refcount", "touched_at"], name="blob_gc_idx"),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
 class ListingImage(models.Model):
     """
     Model for additional images associated with a listing.
@@ -61,7 +218,9 @@ class ListingImage(models.Model):
     listing = models.ForeignKey(
         Listing, related_name="images", on_delete=models.CASCADE
     )
-    image = models.ImageField(upload_to="listings/%Y/%m/%d/")
+    image = models.ImageField(upload_to="listings/%Y/%m/%d/", storage=image_storage)
+    # Resized copies of image, maintained by listings.images
+    variants = models.JSONField(default=dict, blank=True, editable=False)
     caption = models.CharField(max_length=100, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -83,6 +242,15 @@ class Amenity(models.Model):
     icon = models.CharField(
         max_length=100, blank=True, help_text="Font awesome icon name"
     )
+    # Position in Listing.amenity_mask; null once all bits are taken
+    bit = models.PositiveSmallIntegerField(
+        unique=True, null=True, blank=True, editable=False
+    )
+
+    # Number of amenities that can be represented in Listing.amenity_mask
+    MAX_BITS = 63
+    # Bits tried before giving up when concurrent saves keep taking them
+    BIT_ALLOCATION_ATTEMPTS = 5
 
     class Meta:
         verbose_name = "Amenity"
@@ -91,6 +259,26 @@ class Amenity(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def mask(self):
+        return 0 if self.bit is None else 1 << self.bit
+
+    def save(self, *args, **kwargs):
+        if self.bit is not None:
+            return super().save(*args, **kwargs)
+        for attempt in range(self.BIT_ALLOCATION_ATTEMPTS):
+            last = Amenity.objects.aggregate(models.Max("bit"))["bit__max"]
+            # Skip past bits a concurrent save took since ``last`` was read
+            next_bit = (-1 if last is None else last) + 1 + attempt
+            self.bit = next_bit if next_bit < self.MAX_BITS else None
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if self.bit is None or attempt + 1 == self.BIT_ALLOCATION_ATTEMPTS:
+                    self.bit = None
+                    raise
+
 
 class ListingAmenity(models.Model):
     """
@@ -121,7 +309,11 @@ class Booking(models.Model):
         ("confirmed", "Confirmed"),
         ("cancelled", "Cancelled"),
         ("completed", "Completed"),
+        # Pending bookings whose hold lapsed without payment
+        ("expired", "Expired"),
     )
+    # Statuses that hold the listing's nights
+    ACTIVE_STATUSES = ("pending", "confirmed")
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bookings")
     listing = models.ForeignKey(
@@ -139,6 +331,23 @@ class Booking(models.Model):
         ordering = ["-created_at"]
         verbose_name = "Booking"
         verbose_name_plural = "Bookings"
+        indexes = [
+            models.Index(
+                fields=["listing", "check_in_date", "check_out_date", "status"],
+                name="booking_listing_dates_idx",
+            ),
+            models.Index(
+                fields=["user", "-created_at", "-id"], name="booking_user_created_idx"
+            ),
+            models.Index(
+                fields=["user", "status", "check_in_date"],
+                name="booking_user_upcoming_idx",
+            ),
+            # Scanned by the expiry sweep for lapsed pending holds
+            models.Index(
+                fields=["status", "created_at"], name="booking_status_created_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"Booking by {self.user.username} for {self.listing.title}"
@@ -172,6 +381,11 @@ class Review(models.Model):
         verbose_name = "Review"
         verbose_name_plural = "Reviews"
         unique_together = ("user", "listing")  # One review per user per listing
+        indexes = [
+            models.Index(
+                fields=["user", "-created_at", "-id"], name="review_user_created_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"Review by {self.user.username} for {self.listing.title} - {self.rating} stars"
@@ -189,3 +403,36 @@ class Payment(models.Model):
 
     def __str__(self):
         return f"Payment for {self.booking.id} - {self.status}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The stored outcome of a POST sent with an ``Idempotency-Key`` header.
+
+    ``status_code`` is null while the first request is still being handled.
+    Rows are purged by listings.idempotency once they expire.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # SHA-256 of the method, path and body the key was first used with
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Idempotency Key"
+        verbose_name_plural = "Idempotency Keys"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="unique_user_idempotency_key"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["expires_at"], name="idempotency_expiry_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.user_id})"
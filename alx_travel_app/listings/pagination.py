@@ -0,0 +1,68 @@
+"""
+Pagination classes for the listings app.
+
+This module contains the keyset (cursor) paginators used by the API viewsets.
+"""
+
+from rest_framework.pagination import CursorPagination
+
+from .geo import DISTANCE_ANNOTATION
+from .search import RANK_ANNOTATION
+
+
+class CreatedCursorPagination(CursorPagination):
+    """
+    Keyset pagination over ``(-created_at, -id)``.
+
+    Each page is fetched with a ``WHERE created_at < <cursor>`` range scan on
+    a composite index instead of an ``OFFSET``, and no ``COUNT(*)`` is run,
+    so deep pages cost the same as the first one.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("-created_at", "-id")
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Append an ``id`` tiebreaker to orderings without one, such as
+        ``?ordering=-rating_avg``, so rows sharing a value keep a stable
+        order from page to page.
+        """
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip("-") in ("id", "pk") for field in ordering):
+            ordering += ("-id" if ordering[-1].startswith("-") else "id",)
+        return ordering
+
+
+class ListingCursorPagination(CreatedCursorPagination):
+    """Listing pages, served by the ``(-created_at, -id)`` listing index."""
+
+    # Annotations that take precedence over the default ordering when present
+    annotation_orderings = (DISTANCE_ANNOTATION, f"-{RANK_ANNOTATION}")
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Order by distance or relevance unless ``?ordering=`` is given.
+        """
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering != tuple(self.ordering):
+            return ordering
+        for field in self.annotation_orderings:
+            if field.lstrip("-") in queryset.query.annotations:
+                return (field,) + ordering
+        return ordering
+
+
+class UpcomingCursorPagination(CreatedCursorPagination):
+    """Upcoming bookings, soonest first, along ``(user, status, check_in_date)``."""
+
+    ordering = ("check_in_date", "id")
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Always soonest first; the view's ``?ordering=`` fields and default
+        ordering would page along an order the index cannot serve.
+        """
+        return self.ordering
@@ -0,0 +1,168 @@
+"""
+Stay pricing for listings.
+
+This module prices stays from a listing's nightly rate calendar: the base
+``price_per_night``, date-range ``RateOverride`` prices, the
+``weekend_multiplier`` for Friday and Saturday nights and the best
+``StayDiscount`` for the stay's length. Overrides and discounts are compiled
+into a ``RateCalendar`` that is cached per listing, so pricing a stay (or
+many stays) needs no queries once the calendar is warm.
+"""
+
+from bisect import bisect_right
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from . import cache
+from .models import RateOverride, StayDiscount
+
+# date.weekday() of the nights charged at the weekend rate
+WEEKEND_NIGHTS = (4, 5)
+CENT = Decimal("0.01")
+
+STAYS_PARAM = "stays"
+MAX_QUOTE_STAYS = 50
+MAX_STAY_NIGHTS = 365
+
+
+def paint(segments, start, end, price):
+    """Overlay ``[start, end)`` at ``price`` on sorted, disjoint segments."""
+    painted = []
+    for seg_start, seg_end, seg_price in segments:
+        if seg_end <= start or seg_start >= end:
+            painted.append((seg_start, seg_end, seg_price))
+            continue
+        if seg_start < start:
+            painted.append((seg_start, start, seg_price))
+        if seg_end > end:
+            painted.append((end, seg_end, seg_price))
+    painted.append((start, end, price))
+    painted.sort()
+    return painted
+
+
+class RateCalendar:
+    """
+    A listing's rate overrides and stay discounts, compiled for lookups.
+
+    Overrides are flattened into disjoint ``[start, end)`` segments, the
+    shortest override winning where they overlap. The base price and
+    weekend multiplier are read from the listing at pricing time, so edits
+    to the listing row never leave a stale calendar behind.
+    """
+
+    def __init__(self, overrides=(), discounts=()):
+        segments = []
+        # Longest first, so shorter (more specific) ranges are painted over them
+        for start, last_night, price in sorted(
+            overrides, key=lambda override: override[1] - override[0], reverse=True
+        ):
+            segments = paint(segments, start, last_night + timedelta(days=1), price)
+        self.starts = [start for start, _, _ in segments]
+        self.segments = segments
+        # Largest minimum first
+        self.discounts = sorted(discounts, reverse=True)
+
+    @classmethod
+    def compile(cls, listing_id):
+        overrides = RateOverride.objects.filter(listing_id=listing_id).values_list(
+            "start_date", "end_date", "price_per_night"
+        )
+        discounts = StayDiscount.objects.filter(listing_id=listing_id).values_list(
+            "min_nights", "percent"
+        )
+        return cls(list(overrides), list(discounts))
+
+    def discount_percent(self, nights):
+        for min_nights, percent in self.discounts:
+            if nights >= min_nights:
+                return percent
+        return Decimal("0")
+
+    def nightly_rates(self, listing, check_in, check_out):
+        """Yield the price of every night from ``check_in`` to ``check_out``."""
+        index = bisect_right(self.starts, check_in) - 1
+        night = check_in
+        while night < check_out:
+            while (
+                index + 1 < len(self.segments) and self.segments[index + 1][0] <= night
+            ):
+                index += 1
+            rate = listing.price_per_night
+            if index >= 0:
+                start, end, price = self.segments[index]
+                if start <= night < end:
+                    rate = price
+            if night.weekday() in WEEKEND_NIGHTS:
+                rate *= listing.weekend_multiplier
+            yield rate
+            night += timedelta(days=1)
+
+    def quote(self, listing, check_in, check_out):
+        """Price a stay; returns the subtotal, discount and total."""
+        nights = (check_out - check_in).days
+        subtotal = sum(
+            self.nightly_rates(listing, check_in, check_out), Decimal("0")
+        ).quantize(CENT, ROUND_HALF_UP)
+        discount = (subtotal * self.discount_percent(nights) / 100).quantize(
+            CENT, ROUND_HALF_UP
+        )
+        return {
+            "check_in": check_in,
+            "check_out": check_out,
+            "nights": nights,
+            "subtotal": subtotal,
+            "discount": discount,
+            "total_price": subtotal - discount,
+        }
+
+
+def get_calendar(listing_id):
+    """Return the listing's rate calendar, compiling it on a cache miss."""
+    calendar, version = cache.get_rate_calendar(listing_id)
+    if calendar is None:
+        calendar = RateCalendar.compile(listing_id)
+        cache.set_rate_calendar(listing_id, version, calendar)
+    return calendar
+
+
+def stay_price(listing, check_in, check_out):
+    """Total price of a stay at ``listing``."""
+    return get_calendar(listing.pk).quote(listing, check_in, check_out)["total_price"]
+
+
+def parse_stays(value):
+    """
+    Parse ``?stays=`` as comma-separated ``check_in/check_out`` ISO dates.
+
+    Raises ``ValidationError`` for malformed or out-of-range stays.
+    """
+    stays = []
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        check_in, _, check_out = item.strip().partition("/")
+        try:
+            check_in, check_out = parse_date(check_in), parse_date(check_out)
+        except ValueError:
+            check_in = check_out = None
+        if check_in is None or check_out is None:
+            raise ValidationError(
+                {STAYS_PARAM: f"Expected YYYY-MM-DD/YYYY-MM-DD, got {item!r}."}
+            )
+        if not 0 < (check_out - check_in).days <= MAX_STAY_NIGHTS:
+            raise ValidationError(
+                {
+                    STAYS_PARAM: f"Stays must be 1 to {MAX_STAY_NIGHTS} nights "
+                    f"long, got {item!r}."
+                }
+            )
+        stays.append((check_in, check_out))
+    if not 1 <= len(stays) <= MAX_QUOTE_STAYS:
+        raise ValidationError(
+            {STAYS_PARAM: f"Give between 1 and {MAX_QUOTE_STAYS} stays."}
+        )
+    return stays
@@ -0,0 +1,54 @@
+"""
+Rating aggregates for listings.
+
+This module maintains the denormalized review statistics stored on
+``Listing`` (average, count and 1-5 star histogram).
+"""
+
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import Listing
+
+HISTOGRAM_FIELDS = [f"rating_{stars}_count" for stars in range(1, 6)]
+AGGREGATE_FIELDS = ["rating_avg", "rating_count"] + HISTOGRAM_FIELDS
+
+
+def compute_average(histogram):
+    """Return the mean rating for a ``{stars: count}`` histogram."""
+    count = sum(histogram.values())
+    if not count:
+        return Decimal("0.00")
+    total = sum(stars * n for stars, n in histogram.items())
+    return (Decimal(total) / count).quantize(Decimal("0.01"))
+
+
+def set_aggregates(listing, histogram):
+    """Store ``histogram`` and its derived average and count on ``listing``."""
+    for stars in range(1, 6):
+        setattr(listing, f"rating_{stars}_count", histogram.get(stars, 0))
+    listing.rating_count = sum(histogram.values())
+    listing.rating_avg = compute_average(histogram)
+
+
+def apply_rating_change(listing_id, added=None, removed=None):
+    """
+    Incrementally update a listing's aggregates for one review change.
+
+    ``added`` is the rating being counted and ``removed`` the rating being
+    discounted; an edited review passes both. The listing row is locked so
+    concurrent review writes cannot lose updates. A listing that no longer
+    exists is skipped, since there are no aggregates left to maintain.
+    """
+    with transaction.atomic():
+        listing = Listing.objects.select_for_update().filter(pk=listing_id).first()
+        if listing is None:
+            return
+        histogram = listing.rating_histogram
+        if removed is not None:
+            histogram[removed] = max(histogram[removed] - 1, 0)
+        if added is not None:
+            histogram[added] += 1
+        set_aggregates(listing, histogram)
+        listing.save(update_fields=AGGREGATE_FIELDS + ["updated_at"])
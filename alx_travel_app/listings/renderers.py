@@ -0,0 +1,100 @@
+"""
+Renderers for the listings API.
+
+This module contains a JSON renderer that encodes with orjson when it is
+installed and can reproduce the stock ``JSONRenderer`` output byte for byte,
+and defers to the stock encoder otherwise, plus the renderers that let the
+``export`` actions accept their NDJSON and CSV media types.
+"""
+
+import re
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# orjson writes exponents as "1e-7"/"1e16" and small floats positionally
+# ("0.00001") where Python writes "1e-07"/"1e+16"/"1e-05"; output that may
+# contain such a float is re-encoded with the stock encoder.
+FLOAT_MISMATCH = re.compile(rb"\d[eE]|\b0\.0000")
+JSON_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+
+
+def has_mismatched_float(encoded):
+    """Whether orjson output may hold a float the stock encoder writes differently."""
+    if FLOAT_MISMATCH.search(encoded) is None:
+        return False
+    # Only number tokens count: "Suite 1E" must not force the slow path
+    return FLOAT_MISMATCH.search(JSON_STRING.sub(b'""', encoded)) is not None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Drop-in ``JSONRenderer`` backed by orjson.
+
+    Only the default compact, unicode, non-indented output is accelerated.
+    Types orjson does not encode exactly like DRF's encoder (datetimes,
+    dataclasses, lazy strings, ...) make it raise, which also falls back.
+    """
+
+    options = (
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if orjson is not None
+        else 0
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, option=self.options)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if has_mismatched_float(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer for compatibility with JavaScript
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
+
+
+class ExportRenderer(JSONRenderer):
+    """
+    Accept an export media type during content negotiation.
+
+    Exports stream their own ``StreamingHttpResponse``, so only error
+    responses (bad parameters, permissions) are rendered here, as JSON.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get("response")
+        if response is not None:
+            response["Content-Type"] = "application/json"
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class NDJSONExportRenderer(ExportRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+
+class CSVExportRenderer(ExportRenderer):
+    media_type = "text/csv"
+    format = "csv"
+
+
+EXPORT_RENDERER_CLASSES = [
+    *api_settings.DEFAULT_RENDERER_CLASSES,
+    NDJSONExportRenderer,
+    CSVExportRenderer,
+]
@@ -0,0 +1,126 @@
+"""
+Booking reservations for listings.
+
+This module contains the write path that turns a requested stay into a
+booking without double-booking a listing. The listing row is locked with
+``SELECT ... FOR UPDATE`` for the rest of the transaction, so bookings of
+the same listing are checked and inserted one at a time while bookings of
+other listings proceed in parallel. The overlap check is a single ``EXISTS``
+served by the ``(listing, check_in_date, check_out_date, status)`` index.
+
+Pending bookings only hold their nights for ``BOOKING_HOLD_TTL`` seconds,
+counted from the booking or from its latest payment initiation;
+``expire_lapsed_holds`` releases the ones that were never paid.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from . import cache
+from .availability import overlapping_bookings
+from .models import Booking, Listing, Payment
+
+DEFAULT_EXPIRY_BATCH_SIZE = 500
+
+
+class BookingConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The listing is already booked for some of these nights."
+    default_code = "booking_conflict"
+
+
+def reserve_stay(listing_id, check_in, check_out, num_guests, exclude=None):
+    """
+    Lock a listing and check that the stay can be booked.
+
+    Must be called inside ``transaction.atomic()``; the booking should be
+    saved in the same transaction. ``exclude`` is the id of a booking being
+    changed, which never conflicts with itself. Returns the locked listing.
+    """
+    listing = Listing.objects.select_for_update().filter(pk=listing_id).first()
+    if listing is None:
+        raise ValidationError({"listing_id": "Listing not found."})
+    if not listing.is_available:
+        raise ValidationError({"listing_id": "This listing cannot be booked."})
+    if num_guests > listing.max_guests:
+        raise ValidationError(
+            {"num_guests": f"This listing hosts at most {listing.max_guests} guests."}
+        )
+
+    conflicts = overlapping_bookings(check_in, check_out).filter(listing=listing)
+    if exclude is not None:
+        conflicts = conflicts.exclude(pk=exclude)
+    if conflicts.exists():
+        raise BookingConflict()
+    return listing
+
+
+def stay_changed(booking, data):
+    """Whether an update moves, resizes or reactivates an active stay."""
+    if data.get("status", booking.status) not in Booking.ACTIVE_STATUSES:
+        return False
+    if booking.status not in Booking.ACTIVE_STATUSES:
+        return True
+    fields = ("listing_id", "check_in_date", "check_out_date", "num_guests")
+    return any(name in data and data[name] != getattr(booking, name) for name in fields)
+
+
+def hold_ttl():
+    return timedelta(seconds=getattr(settings, "BOOKING_HOLD_TTL", 3600))
+
+
+def expire_lapsed_holds(batch_size=DEFAULT_EXPIRY_BATCH_SIZE, ttl=None, notify=None):
+    """
+    Expire pending bookings created more than ``ttl`` ago, in batches.
+
+    A booking whose payment was initiated less than ``ttl`` ago is kept.
+
+    Each batch is one transaction: the oldest lapsed bookings are locked
+    (skipping rows another transaction is confirming), then expired and
+    their pending payments cancelled with one ``UPDATE`` each.
+    ``notify(booking_ids)`` is called for every batch once it commits.
+    Returns the number of bookings expired.
+    """
+    cutoff = timezone.now() - (hold_ttl() if ttl is None else ttl)
+    # Initiating a payment extends the hold, so a guest still in checkout
+    # is not charged for a booking that has just expired
+    checkout = Payment.objects.filter(
+        booking=OuterRef("pk"), status="pending", created_at__gte=cutoff
+    )
+    lapsed = Booking.objects.filter(status="pending", created_at__lt=cutoff).exclude(
+        Exists(checkout)
+    )
+    expired = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                lapsed.select_for_update(skip_locked=True)
+                .order_by("created_at", "id")
+                .values_list("pk", "listing_id")[:batch_size]
+            )
+            if not rows:
+                return expired
+            booking_ids = [pk for pk, _ in rows]
+            listing_ids = {listing_id for _, listing_id in rows}
+            now = timezone.now()
+            Booking.objects.filter(pk__in=booking_ids).update(
+                status="expired", updated_at=now
+            )
+            Payment.objects.filter(booking_id__in=booking_ids, status="pending").update(
+                status="cancelled", updated_at=now
+            )
+            # The UPDATEs bypass the signals that refresh cached calendars
+            transaction.on_commit(
+                lambda ids=listing_ids: cache.invalidate_availability(*ids)
+            )
+            if notify is not None:
+                transaction.on_commit(lambda ids=booking_ids: notify(ids))
+        expired += len(booking_ids)
+        if len(booking_ids) < batch_size:
+            return expired
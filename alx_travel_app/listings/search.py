@@ -0,0 +1,263 @@
+"""
+Full-text search for listings.
+
+This module contains the search filter backend used by ``ListingViewSet``.
+On MySQL it queries a FULLTEXT index with ``MATCH ... AGAINST``; on other
+databases (SQLite in development and tests) it falls back to an in-process
+inverted index, updated by signals for local writes and re-synced with the
+listings table before each search.
+"""
+
+import math
+import re
+import threading
+import heapq
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.db import connections
+from django.template import loader
+from django.db.models import Case, Count, FloatField, Max, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+# Relative weight of a token found in each searchable field, used to rank
+# fallback index results. The keys are also the columns of the MySQL
+# FULLTEXT index (migration 0005); MATCH ... AGAINST ranks with its own
+# relevance over all of them and does not apply these weights.
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "location": 2.0,
+    "address": 1.0,
+    "description": 1.0,
+}
+
+# Annotation holding the relevance score of each matching listing.
+RANK_ANNOTATION = "search_rank"
+
+# Best-scoring fallback index matches kept per search, bounding the
+# ``IN (...)`` list and ``CASE`` built for them
+MAX_INDEX_MATCHES = 500
+
+TOKEN_RE = re.compile(r"\w+")
+BOOLEAN_OPERATORS_RE = re.compile(r'[+\-<>()~*"@]+')
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens."""
+    return TOKEN_RE.findall((text or "").lower())
+
+
+class InvertedIndex:
+    """
+    In-memory inverted index over the searchable listing fields.
+
+    Postings map each token to ``{listing_id: weight}``. Query terms match
+    tokens by prefix, all terms must match (like DRF's ``SearchFilter``),
+    and results are scored with a field-weighted tf-idf.
+    """
+
+    def __init__(self):
+        # Latest Listing.updated_at seen when the index was last synced
+        self.latest = None
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)
+        self._doc_tokens = {}
+        self._vocabulary = None
+
+    def __len__(self):
+        return len(self._doc_tokens)
+
+    def add(self, doc_id, fields):
+        """Index (or re-index) a document given its ``{field: text}`` values."""
+        weights = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(fields.get(field)):
+                weights[token] += weight
+
+        with self._lock:
+            self._remove(doc_id)
+            for token, weight in weights.items():
+                if token not in self._postings:
+                    self._vocabulary = None
+                self._postings[token][doc_id] = weight
+            self._doc_tokens[doc_id] = tuple(weights)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        for token in self._doc_tokens.pop(doc_id, ()):
+            postings = self._postings[token]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary = None
+
+    def _expand(self, term):
+        """Return the indexed tokens starting with ``term``."""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        vocabulary = self._vocabulary
+        start = bisect_left(vocabulary, term)
+        matches = []
+        for token in vocabulary[start:]:
+            if not token.startswith(term):
+                break
+            matches.append(token)
+        return matches
+
+    def search(self, query):
+        """Return ``{doc_id: score}`` for documents matching every query term."""
+        terms = tokenize(query)
+        if not terms:
+            return {}
+
+        with self._lock:
+            total = len(self._doc_tokens) or 1
+            scores = None
+            for term in terms:
+                term_scores = defaultdict(float)
+                for token in self._expand(term):
+                    postings = self._postings[token]
+                    idf = math.log(1 + total / len(postings))
+                    for doc_id, weight in postings.items():
+                        term_scores[doc_id] += weight * idf
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        doc_id: score + term_scores[doc_id]
+                        for doc_id, score in scores.items()
+                        if doc_id in term_scores
+                    }
+                if not scores:
+                    return {}
+            return dict(scores)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _build_index(latest):
+    from .models import Listing
+
+    index = InvertedIndex()
+    for row in Listing.objects.values("pk", *FIELD_WEIGHTS).iterator():
+        index.add(row.pop("pk"), row)
+    index.latest = latest
+    return index
+
+
+def get_index():
+    """
+    Return the process-wide listing index, synced with the listings table.
+
+    Signals only reach the process that wrote a listing, so each call
+    compares the index with the table's row count and latest
+    ``updated_at``: listings written elsewhere (imports, other workers,
+    Celery) are re-indexed, and a count mismatch left by deletes elsewhere
+    rebuilds the index.
+    """
+    global _index
+    from .models import Listing
+
+    with _index_lock:
+        stamp = Listing.objects.aggregate(count=Count("pk"), latest=Max("updated_at"))
+        index = _index
+        if index is not None and stamp["latest"] is not None:
+            if index.latest is None or stamp["latest"] > index.latest:
+                changed = Listing.objects.values("pk", *FIELD_WEIGHTS)
+                if index.latest is not None:
+                    changed = changed.filter(updated_at__gte=index.latest)
+                for row in changed.iterator():
+                    index.add(row.pop("pk"), row)
+                index.latest = stamp["latest"]
+        if index is None or len(index) != stamp["count"]:
+            index = _index = _build_index(stamp["latest"])
+    return index
+
+
+def index_listing(listing):
+    """Update the fallback index after a listing is saved."""
+    if _index is not None:
+        _index.add(
+            listing.pk,
+            {field: getattr(listing, field) for field in FIELD_WEIGHTS},
+        )
+
+
+def unindex_listing(listing_id):
+    """Drop a deleted listing from the fallback index."""
+    if _index is not None:
+        _index.remove(listing_id)
+
+
+def reset_index():
+    """Discard the fallback index so it is rebuilt on the next search."""
+    global _index
+    _index = None
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    Search backend that keeps the ``?search=`` contract of ``SearchFilter``.
+
+    Matching rows are annotated with ``search_rank`` so the paginator can
+    order results by relevance. The searched fields are ``FIELD_WEIGHTS``,
+    not the view's ``search_fields``. On the fallback index only the
+    ``MAX_INDEX_MATCHES`` most relevant listings are returned.
+    """
+
+    def to_html(self, request, queryset, view):
+        # SearchFilter only renders the form for views with search_fields
+        terms = self.get_search_terms(request)
+        context = {"param": self.search_param, "term": terms[0] if terms else ""}
+        return loader.get_template(self.template).render(context)
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        if connections[queryset.db].vendor == "mysql":
+            return self.mysql_search(queryset, search_terms)
+        return self.index_search(queryset, search_terms)
+
+    def mysql_search(self, queryset, search_terms):
+        terms = []
+        for term in search_terms:
+            term = BOOLEAN_OPERATORS_RE.sub(" ", term).strip()
+            terms.extend(f"+{word}*" for word in term.split())
+        if not terms:
+            return queryset
+
+        table = queryset.model._meta.db_table
+        quote = connections[queryset.db].ops.quote_name
+        columns = ", ".join(f"{quote(table)}.{quote(field)}" for field in FIELD_WEIGHTS)
+        rank = RawSQL(
+            f"MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)",
+            [" ".join(terms)],
+            output_field=FloatField(),
+        )
+        return queryset.annotate(**{RANK_ANNOTATION: rank}).filter(
+            **{f"{RANK_ANNOTATION}__gt": 0}
+        )
+
+    def index_search(self, queryset, search_terms):
+        scores = get_index().search(" ".join(search_terms))
+        if not scores:
+            return queryset.none()
+        if len(scores) > MAX_INDEX_MATCHES:
+            scores = dict(
+                heapq.nlargest(MAX_INDEX_MATCHES, scores.items(), key=lambda i: i[1])
+            )
+
+        rank = Case(
+            *[When(pk=pk, then=Value(score)) for pk, score in scores.items()],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=list(scores)).annotate(**{RANK_ANNOTATION: rank})
@@ -4,6 +4,7 @@ Serializers for the listings app.
 This module contains the DRF serializers for travel listings and amenities.
 """
 
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import (
     Listing,
@@ -15,23 +16,66 @@ from .models import (
     Payment,
 )
 from django.contrib.auth.models import User
+from .fieldsets import SparseFieldsetSerializerMixin
+from .images import variant_urls
+from .ratings import HISTOGRAM_FIELDS
 
 
 class AmenitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Amenity
-        fields = "__all__"
+        fields = ["id", "name", "icon"]
+
+
+class ImageVariantsField(serializers.Field):
+    """Render stored image variants as sizes and absolute URLs per format."""
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return variant_urls(value, self.context.get("request"))
+
+
+class ImageThumbnailField(ImageVariantsField):
+    """Render only the smallest stored variant of an image, or ``None``."""
+
+    def to_representation(self, value):
+        return super().to_representation(value).get("small")
+
 
+class ListingImageSerializer(
+    SparseFieldsetSerializerMixin, serializers.ModelSerializer
+):
+    variants = ImageVariantsField()
 
-class ListingImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ListingImage
-        fields = ["id", "image", "caption"]
+        fields = ["id", "image", "caption", "variants"]
+        detail_only_fields = ["image"]
 
 
-class ListingSerializer(serializers.ModelSerializer):
+class ListingSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    expandable_fields = ("images", "amenities")
+    field_columns = {
+        "rating_histogram": HISTOGRAM_FIELDS,
+        "distance_km": [],
+        "amenities": [],
+    }
+    # Attribute values built from field_columns by the fast list path
+    value_builders = {
+        "rating_histogram": lambda *counts: dict(enumerate(counts, start=1)),
+    }
+
     images = ListingImageSerializer(many=True, read_only=True)
     amenities = serializers.SerializerMethodField()
+    featured_image_variants = ImageVariantsField()
+    # Only present when the queryset is annotated by the ``?near=`` filter
+    distance_km = serializers.FloatField(source="distance", read_only=True)
+    rating_histogram = serializers.DictField(
+        child=serializers.IntegerField(), read_only=True
+    )
 
     class Meta:
         model = Listing
@@ -44,27 +88,89 @@ class ListingSerializer(serializers.ModelSerializer):
             "price_per_night",
             "location",
             "address",
+            "latitude",
+            "longitude",
+            "distance_km",
             "max_guests",
             "bedrooms",
             "bathrooms",
             "featured_image",
+            "featured_image_variants",
             "is_available",
+            "rating_avg",
+            "rating_count",
+            "rating_histogram",
             "created_at",
             "updated_at",
             "images",
             "amenities",
         ]
+        read_only_fields = ["rating_avg", "rating_count"]
+        # Default for list pages; images and amenities need ?expand=
+        compact_fields = [
+            "id",
+            "title",
+            "slug",
+            "listing_type",
+            "price_per_night",
+            "location",
+            "distance_km",
+            "featured_image_variants",
+            "is_available",
+            "rating_avg",
+            "rating_count",
+        ]
+        # Original uploads are never sent to list views
+        detail_only_fields = ["featured_image"]
 
     def get_amenities(self, obj):
-        amenity_items = ListingAmenity.objects.filter(listing=obj)
+        # Iterate the related manager so a prefetched cache is reused
+        amenity_items = obj.listing_amenities.all()
         return AmenitySerializer(
             [item.amenity for item in amenity_items], many=True
         ).data
 
+    def setup_eager_loading(self, queryset, prefix=""):
+        """
+        Prefetch the relations rendered by this serializer.
+
+        ``prefix`` is the lookup path to the listing when the serializer is
+        nested, e.g. ``"listing__"`` for bookings and reviews.
+        """
+        if "images" in self.fields:
+            queryset = queryset.prefetch_related(f"{prefix}images")
+        if "amenities" in self.fields:
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    f"{prefix}listing_amenities",
+                    queryset=ListingAmenity.objects.select_related("amenity"),
+                )
+            )
+        return queryset
+
+
+class ListingSummarySerializer(
+    SparseFieldsetSerializerMixin, serializers.ModelSerializer
+):
+    """The listing embedded in bookings and reviews unless ?expand=listing."""
+
+    thumbnail = ImageThumbnailField(source="featured_image_variants")
+
+    class Meta:
+        model = Listing
+        fields = ["id", "slug", "title", "thumbnail", "price_per_night"]
+
+    def setup_eager_loading(self, queryset, prefix=""):
+        return queryset
+
+
+class BookingSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    field_columns = {"user": ["user", "user__username"]}
+    value_builders = {"user": lambda user_id, username: username}
+    expanded_fields = {"listing": lambda: ListingSerializer(read_only=True)}
 
-class BookingSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
-    listing = ListingSerializer(read_only=True)
+    listing = ListingSummarySerializer(read_only=True)
     listing_id = serializers.IntegerField(write_only=True)
 
     class Meta:
@@ -84,10 +190,43 @@ class BookingSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["id", "user", "total_price", "created_at", "updated_at"]
 
+    def validate_num_guests(self, value):
+        if value < 1:
+            raise serializers.ValidationError("At least one guest is required.")
+        return value
+
+    def validate(self, attrs):
+        check_in = attrs.get(
+            "check_in_date", getattr(self.instance, "check_in_date", None)
+        )
+        check_out = attrs.get(
+            "check_out_date", getattr(self.instance, "check_out_date", None)
+        )
+        if check_in and check_out and check_out <= check_in:
+            raise serializers.ValidationError(
+                {"check_out_date": "Must be after the check-in date."}
+            )
+        return attrs
+
+    def setup_eager_loading(self, queryset):
+        """Join the user and listing and prefetch the nested listing relations."""
+        if "user" in self.fields:
+            queryset = queryset.select_related("user")
+        if "listing" in self.fields:
+            queryset = queryset.select_related("listing")
+            queryset = self.fields["listing"].setup_eager_loading(
+                queryset, prefix="listing__"
+            )
+        return queryset
+
+
+class ReviewSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    field_columns = {"user": ["user", "user__username"]}
+    value_builders = {"user": lambda user_id, username: username}
+    expanded_fields = {"listing": lambda: ListingSerializer(read_only=True)}
 
-class ReviewSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
-    listing = ListingSerializer(read_only=True)
+    listing = ListingSummarySerializer(read_only=True)
     listing_id = serializers.IntegerField(write_only=True)
 
     class Meta:
@@ -105,8 +244,33 @@ class ReviewSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["id", "user", "created_at", "updated_at"]
 
+    def validate_listing_id(self, value):
+        if not Listing.objects.filter(pk=value).exists():
+            raise serializers.ValidationError("Listing does not exist.")
+        return value
+
+    def setup_eager_loading(self, queryset):
+        """Join the user and listing and prefetch the nested listing relations."""
+        if "user" in self.fields:
+            queryset = queryset.select_related("user")
+        if "listing" in self.fields:
+            queryset = queryset.select_related("listing")
+            queryset = self.fields["listing"].setup_eager_loading(
+                queryset, prefix="listing__"
+            )
+        return queryset
+
 
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = "__all__"
+
+
+class StayQuoteSerializer(serializers.Serializer):
+    check_in = serializers.DateField()
+    check_out = serializers.DateField()
+    nights = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    discount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2)
@@ -0,0 +1,127 @@
+"""
+Signal handlers for the listings app.
+
+This module keeps derived data (search index, caches, aggregates, image
+blob reference counts, rate and availability calendars) in sync with writes to the listings models.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import blobs, cache, images, search, tasks
+from .amenities import refresh_amenity_mask
+from .ratings import apply_rating_change
+from .models import (
+    Amenity,
+    Booking,
+    Listing,
+    ListingAmenity,
+    ListingImage,
+    RateOverride,
+    Review,
+    StayDiscount,
+)
+
+
+@receiver(post_save, sender=Listing)
+def listing_saved(sender, instance, **kwargs):
+    listing_id, slug = instance.pk, instance.slug
+    transaction.on_commit(lambda: search.index_listing(instance))
+    transaction.on_commit(lambda: cache.invalidate_listing(listing_id, slug))
+    if images.variants_stale(
+        instance.featured_image.name, instance.featured_image_variants
+    ):
+        transaction.on_commit(
+            lambda: tasks.generate_featured_image_variants.delay(listing_id)
+        )
+
+
+@receiver(post_delete, sender=Listing)
+def listing_deleted(sender, instance, **kwargs):
+    listing_id, slug = instance.pk, instance.slug
+    transaction.on_commit(lambda: search.unindex_listing(listing_id))
+    transaction.on_commit(lambda: cache.invalidate_listing(listing_id, slug))
+
+
+@receiver(post_save, sender=ListingImage)
+@receiver(post_delete, sender=ListingImage)
+def listing_image_changed(sender, instance, **kwargs):
+    listing_id = instance.listing_id
+    # Touch the listing so its ETag/Last-Modified validators change too
+    Listing.objects.filter(pk=listing_id).update(updated_at=timezone.now())
+    transaction.on_commit(lambda: cache.invalidate_listing(listing_id))
+
+
+@receiver(post_save, sender=ListingImage)
+def listing_image_saved(sender, instance, **kwargs):
+    if images.variants_stale(instance.image.name, instance.variants):
+        image_id = instance.pk
+        transaction.on_commit(
+            lambda: tasks.generate_listing_image_variants.delay(image_id)
+        )
+
+
+@receiver(pre_save, sender=Listing)
+@receiver(pre_save, sender=ListingImage)
+@receiver(pre_delete, sender=Listing)
+@receiver(pre_delete, sender=ListingImage)
+def snapshot_image_files(sender, instance, **kwargs):
+    # The stored files, before the write, for the reference diff below
+    instance._stored_files = blobs.stored_files(instance)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_save, sender=ListingImage)
+def image_files_saved(sender, instance, **kwargs):
+    blobs.replace_references(
+        instance.__dict__.pop("_stored_files", set()), blobs.instance_files(instance)
+    )
+
+
+@receiver(post_delete, sender=Listing)
+@receiver(post_delete, sender=ListingImage)
+def image_files_deleted(sender, instance, **kwargs):
+    blobs.change_references(removed=instance.__dict__.pop("_stored_files", set()))
+
+
+@receiver(post_save, sender=ListingAmenity)
+@receiver(post_delete, sender=ListingAmenity)
+def listing_amenity_changed(sender, instance, **kwargs):
+    listing_id = instance.listing_id
+    # Also touches updated_at, like listing_image_changed
+    refresh_amenity_mask(listing_id)
+    transaction.on_commit(lambda: cache.invalidate_listing(listing_id))
+
+
+@receiver(post_save, sender=Amenity)
+@receiver(post_delete, sender=Amenity)
+def amenity_changed(sender, instance, **kwargs):
+    # Renames show in every linked listing's payload and validators
+    Listing.objects.filter(listing_amenities__amenity_id=instance.pk).update(
+        updated_at=timezone.now()
+    )
+    transaction.on_commit(cache.invalidate_all)
+
+
+@receiver(post_save, sender=RateOverride)
+@receiver(post_delete, sender=RateOverride)
+@receiver(post_save, sender=StayDiscount)
+@receiver(post_delete, sender=StayDiscount)
+def listing_rates_changed(sender, instance, **kwargs):
+    listing_id = instance.listing_id
+    transaction.on_commit(lambda: cache.invalidate_rate_calendar(listing_id))
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def booking_changed(sender, instance, **kwargs):
+    listing_id = instance.listing_id
+    transaction.on_commit(lambda: cache.invalidate_availability(listing_id))
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    # Also runs for reviews removed by a booking, user or listing cascade
+    apply_rating_change(instance.listing_id, removed=instance.rating)
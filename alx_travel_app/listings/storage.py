@@ -0,0 +1,91 @@
+"""
+Content-addressed file storage for listing images.
+
+This module contains a filesystem storage that names every file after the
+SHA-256 of its content. Uploads are hashed while they are streamed to a
+temporary file in chunks and then moved into place, so identical photos
+uploaded to many listings are stored once and shared. Each stored file has
+a ``StoredBlob`` row whose reference count is maintained by listings.blobs;
+files are only removed by its garbage collector, never by ``delete()``.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+BLOB_DIRECTORY = "blobs"
+
+
+def blob_name(digest, extension):
+    """Return the storage name of a blob, fanned out over two directory levels."""
+    return f"{BLOB_DIRECTORY}/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that de-duplicates files by content.
+
+    The name passed to ``save()`` only contributes its extension; the stored
+    name is derived from the content hash, and saving content that already
+    exists returns the existing name without writing anything.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Names are content-derived, so an existing name is the same file
+        return name
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        os.makedirs(self.location, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        handle, temp_path = tempfile.mkstemp(dir=self.location, suffix=".upload")
+        try:
+            with os.fdopen(handle, "wb") as temp_file:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+                    size += len(chunk)
+
+            extension = os.path.splitext(name)[1].lower()
+            name = blob_name(digest.hexdigest(), extension)
+            path = self.path(name)
+            with transaction.atomic():
+                # The row lock serializes this against the garbage collector
+                blob, _ = StoredBlob.objects.get_or_create(
+                    name=name, defaults={"size": size}
+                )
+                blob = StoredBlob.objects.select_for_update().get(pk=blob.pk)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(path, self.file_permissions_mode)
+                blob.touched_at = timezone.now()
+                blob.save(update_fields=["touched_at"])
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return name
+
+    def delete(self, name):
+        """
+        Do nothing: blobs may be shared, so they are only removed by
+        ``listings.blobs.collect_garbage`` once unreferenced.
+        """
+
+    def remove(self, name):
+        """Really delete a file; only for the garbage collector."""
+        super().delete(name)
+
+
+image_storage = ContentAddressedStorage()
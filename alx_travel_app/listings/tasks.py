@@ -5,9 +5,11 @@ This module contains background tasks for email notifications and other async op
 """
 
 from celery import shared_task
-from django.core.mail import send_mail
+from django.core.mail import send_mail, send_mass_mail
 from django.conf import settings
 from .models import Payment, Booking
+from .featured import refresh_featured_listings
+from . import blobs, idempotency, images, reservations
 
 
 @shared_task
@@ -107,3 +109,113 @@ def send_booking_confirmation_email(booking_id):
         return f"Booking with ID {booking_id} not found"
     except Exception as e:
         return f"Error sending booking confirmation email: {str(e)}"
+
+
+@shared_task
+def refresh_featured_rankings():
+    """
+    Recompute the materialized featured listing ranking.
+
+    Scheduled periodically through CELERY_BEAT_SCHEDULE.
+    """
+    count = refresh_featured_listings()
+    return f"Ranked {count} featured listings"
+
+
+@shared_task
+def generate_listing_image_variants(image_id):
+    """
+    Generate the resized variants of a ListingImage.
+
+    Queued by the post_save signal whenever the uploaded image changes.
+    """
+    if images.generate_listing_image_variants(image_id):
+        return f"Generated variants for listing image {image_id}"
+    return f"Listing image {image_id} is missing or already up to date"
+
+
+@shared_task
+def generate_featured_image_variants(listing_id):
+    """
+    Generate the resized variants of a listing's featured_image.
+
+    Queued by the post_save signal whenever the featured image changes.
+    """
+    if images.generate_featured_image_variants(listing_id):
+        return f"Generated featured image variants for listing {listing_id}"
+    return f"Listing {listing_id} is missing or already up to date"
+
+
+@shared_task
+def collect_image_blobs():
+    """
+    Delete image blobs that are no longer referenced by any listing.
+
+    Scheduled periodically through CELERY_BEAT_SCHEDULE.
+    """
+    count = blobs.collect_garbage()
+    return f"Deleted {count} unreferenced image blobs"
+
+
+@shared_task
+def expire_pending_bookings():
+    """
+    Expire pending bookings whose payment hold has lapsed.
+
+    Scheduled periodically through CELERY_BEAT_SCHEDULE; guests are notified
+    with one email task per batch.
+    """
+    count = reservations.expire_lapsed_holds(
+        notify=lambda booking_ids: send_booking_expiry_emails.delay(booking_ids)
+    )
+    return f"Expired {count} pending bookings"
+
+
+@shared_task
+def send_booking_expiry_emails(booking_ids):
+    """
+    Tell guests that their unpaid bookings have expired.
+
+    Args:
+        booking_ids: The IDs of the expired bookings, sent over one connection
+    """
+    bookings = Booking.objects.filter(pk__in=booking_ids).select_related(
+        "user", "listing"
+    )
+    messages = [
+        (
+            f"Booking Expired - {booking.listing.title}",
+            f"""
+        Dear {booking.user.first_name} {booking.user.last_name},
+
+        Your booking #{booking.id} for {booking.listing.title}
+        ({booking.check_in_date} to {booking.check_out_date}) was not paid in
+        time and has expired. The dates have been released.
+
+        You are welcome to book again if they are still available.
+
+        Best regards,
+        ALX Travel Team
+        """,
+            settings.DEFAULT_FROM_EMAIL,
+            [booking.user.email],
+        )
+        for booking in bookings
+        if booking.user.email
+    ]
+    try:
+        sent = send_mass_mail(messages, fail_silently=False)
+    except Exception as e:
+        return f"Error sending booking expiry emails: {str(e)}"
+    return f"Sent {sent} booking expiry emails"
+
+
+@shared_task
+def purge_idempotency_keys():
+    """
+    Delete expired idempotency keys and their stored responses.
+
+    Scheduled periodically through CELERY_BEAT_SCHEDULE.
+    """
+    count = idempotency.purge_expired_keys()
+    return f"Purged {count} expired idempotency keys"
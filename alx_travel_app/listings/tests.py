@@ -1,3 +1,2079 @@
-from django.test import TestCase
+"""
+Tests for the listings app.
+"""
 
-# Create your tests here.
+import base64
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache as django_cache
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import (
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import cache as listing_cache
+from . import blobs, geo, images, reservations, search, tasks
+from .models import (
+    Amenity,
+    Booking,
+    IdempotencyKey,
+    Listing,
+    ListingAmenity,
+    ListingImage,
+    Payment,
+    RateOverride,
+    Review,
+    StayDiscount,
+    StoredBlob,
+)
+from .renderers import FastJSONRenderer
+from .reservations import reserve_stay
+from .storage import image_storage
+from .serializers import (
+    BookingSerializer,
+    ListingSerializer,
+    ListingSummarySerializer,
+    ReviewSerializer,
+)
+from .views import BookingViewSet, ListingViewSet, ReviewViewSet
+
+
+def make_listing(**overrides):
+    """Create a listing with sensible defaults for tests."""
+    data = {
+        "title": "Test Listing",
+        "description": "A place to stay.",
+        "listing_type": "apartment",
+        "price_per_night": Decimal("100.00"),
+        "location": "Addis Ababa",
+        "address": "Bole Road",
+        "max_guests": 4,
+        "bedrooms": 2,
+        "bathrooms": 1,
+    }
+    data.update(overrides)
+    return Listing.objects.create(**data)
+
+
+class ListingPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(5):
+            make_listing(title=f"Listing {i}")
+
+    def test_list_is_cursor_paginated(self):
+        response = self.client.get("/api/listings/", {"page_size": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("count", response.data)
+        self.assertEqual(len(response.data["results"]), 2)
+
+        seen = [item["id"] for item in response.data["results"]]
+        next_url = response.data["next"]
+        while next_url:
+            response = self.client.get(next_url)
+            seen.extend(item["id"] for item in response.data["results"])
+            next_url = response.data["next"]
+
+        expected = list(Listing.objects.values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_user_ordering_gets_an_id_tiebreaker(self):
+        # Every listing shares rating_avg = 0
+        for ordering, ids in (("-rating_avg", "-id"), ("price_per_night", "id")):
+            seen, params = [], {"page_size": 2, "ordering": ordering}
+            response = self.client.get("/api/listings/", params)
+            while True:
+                seen.extend(item["id"] for item in response.data["results"])
+                if not response.data["next"]:
+                    break
+                response = self.client.get(response.data["next"])
+            expected = Listing.objects.order_by(ordering, ids)
+            self.assertEqual(seen, list(expected.values_list("id", flat=True)))
+
+
+class ListingQueryCountTests(TestCase):
+    """Nested listing data must cost a constant number of queries per page."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("guest", password="pass12345")
+        self.client.force_authenticate(self.user)
+        self.amenities = [Amenity.objects.create(name=f"Amenity {i}") for i in range(3)]
+
+    def create_listings(self, count):
+        for i in range(count):
+            listing = make_listing(title=f"Listing {Listing.objects.count()}")
+            ListingImage.objects.create(listing=listing, image="listings/a.jpg")
+            ListingImage.objects.create(listing=listing, image="listings/b.jpg")
+            for amenity in self.amenities:
+                ListingAmenity.objects.create(listing=listing, amenity=amenity)
+            Booking.objects.create(
+                user=self.user,
+                listing=listing,
+                check_in_date=date.today() + timedelta(days=1),
+                check_out_date=date.today() + timedelta(days=3),
+                num_guests=2,
+                total_price=Decimal("200.00"),
+            )
+            Review.objects.create(
+                user=self.user, listing=listing, rating=5, comment="Great"
+            )
+
+    def assert_constant_queries(self, url, num, params=None):
+        params = {"page_size": 100, **(params or {})}
+        self.create_listings(2)
+        with self.assertNumQueries(num):
+            small = self.client.get(url, params)
+        self.create_listings(8)
+        with self.assertNumQueries(num):
+            large = self.client.get(url, params)
+        return small, large
+
+    def test_listing_list(self):
+        # listings + aggregate for the ETag + images + amenities
+        small, large = self.assert_constant_queries(
+            "/api/listings/", 4, {"expand": "images,amenities"}
+        )
+        self.assertEqual(len(large.data["results"]), 10)
+        self.assertEqual(len(large.data["results"][0]["amenities"]), 3)
+        self.assertEqual(len(large.data["results"][0]["images"]), 2)
+
+    def test_compact_listing_list(self):
+        small, large = self.assert_constant_queries("/api/listings/", 2)
+        self.assertNotIn("images", large.data["results"][0])
+
+    def test_booking_list(self):
+        small, large = self.assert_constant_queries(
+            "/api/bookings/", 3, {"expand": "listing,images,amenities"}
+        )
+        self.assertEqual(len(large.data), 10)
+
+    def test_my_bookings(self):
+        self.assert_constant_queries("/api/bookings/my_bookings/", 1)
+
+    def test_review_list(self):
+        small, large = self.assert_constant_queries(
+            "/api/reviews/", 4, {"expand": "listing,images,amenities"}
+        )
+        self.assertEqual(len(large.data[0]["listing"]["amenities"]), 3)
+
+    def test_compact_booking_and_review_lists(self):
+        small, large = self.assert_constant_queries("/api/bookings/", 1)
+        self.assertEqual(
+            set(large.data[0]["listing"]),
+            {"id", "slug", "title", "thumbnail", "price_per_night"},
+        )
+        # Reviews also run the ETag aggregate
+        self.assert_constant_queries("/api/reviews/", 2)
+
+
+class ListingSearchTests(TestCase):
+    def setUp(self):
+        search.reset_index()
+        self.addCleanup(search.reset_index)
+        self.client = APIClient()
+        self.villa = make_listing(
+            title="Beachfront Villa", description="Private beach access."
+        )
+        self.flat = make_listing(
+            title="City Flat", description="Walk to the beach in ten minutes."
+        )
+        make_listing(title="Mountain Cabin", location="Aspen")
+
+    def search(self, query):
+        response = self.client.get("/api/listings/", {"search": query})
+        self.assertEqual(response.status_code, 200)
+        return [item["id"] for item in response.data["results"]]
+
+    def test_results_are_ordered_by_relevance(self):
+        self.assertEqual(self.search("beach"), [self.villa.id, self.flat.id])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search("beach city"), [self.flat.id])
+        self.assertEqual(self.search("beach aspen"), [])
+
+    def test_index_follows_listing_writes(self):
+        self.search("beach")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flat.title = "Aspen Loft"
+            self.flat.save()
+        self.assertEqual(search.get_index().search("city"), {})
+        self.assertIn(self.flat.id, self.search("aspen"))
+
+    def test_index_follows_writes_from_other_processes(self):
+        self.search("beach")
+        # Writes whose signals ran elsewhere: no on_commit callbacks here
+        Listing.objects.filter(pk=self.flat.pk).update(
+            title="Harbour Loft", updated_at=timezone.now()
+        )
+        hut = make_listing(title="Beach Hut")
+        search.unindex_listing(hut.pk)
+        self.assertEqual(self.search("harbour"), [self.flat.id])
+        self.assertEqual(
+            set(self.search("beach")), {self.villa.id, self.flat.id, hut.id}
+        )
+
+        Listing.objects.filter(pk=self.villa.pk).delete()
+        self.assertEqual(set(self.search("beach")), {self.flat.id, hut.id})
+        self.assertNotIn(self.villa.id, search.get_index().search("beach"))
+
+    def test_index_matches_are_capped(self):
+        with mock.patch.object(search, "MAX_INDEX_MATCHES", 1):
+            self.assertEqual(self.search("beach"), [self.villa.id])
+
+    def test_inverted_index_prefix_and_removal(self):
+        index = search.InvertedIndex()
+        index.add(1, {"title": "Lakeside lodge"})
+        index.add(2, {"title": "Lake house", "description": "lakeside"})
+        self.assertEqual(set(index.search("lake")), {1, 2})
+        index.remove(2)
+        self.assertEqual(set(index.search("lake")), {1})
+        self.assertEqual(index.search("house"), {})
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.listing = make_listing()
+        self.users = [
+            User.objects.create_user(f"reviewer{i}", password="pass12345")
+            for i in range(3)
+        ]
+
+    def post_review(self, user, rating):
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            "/api/reviews/",
+            {"listing_id": self.listing.id, "rating": rating, "comment": "Nice"},
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def assert_aggregates(self, avg, count, histogram):
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.rating_avg, Decimal(avg))
+        self.assertEqual(self.listing.rating_count, count)
+        self.assertEqual(list(self.listing.rating_histogram.values()), histogram)
+
+    def test_create_update_delete_keep_aggregates_in_sync(self):
+        self.post_review(self.users[0], 5)
+        review_id = self.post_review(self.users[1], 4)
+        self.post_review(self.users[2], 1)
+        self.assert_aggregates("3.33", 3, [1, 0, 0, 1, 1])
+
+        self.client.force_authenticate(self.users[1])
+        response = self.client.patch(f"/api/reviews/{review_id}/", {"rating": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assert_aggregates("2.67", 3, [1, 1, 0, 0, 1])
+
+        response = self.client.delete(f"/api/reviews/{review_id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assert_aggregates("3.00", 2, [1, 0, 0, 0, 1])
+
+    def test_cascade_deletes_keep_aggregates_in_sync(self):
+        self.post_review(self.users[0], 5)
+        self.post_review(self.users[1], 3)
+        self.users[0].delete()
+        self.assert_aggregates("3.00", 1, [0, 0, 1, 0, 0])
+
+        self.listing.delete()
+        self.assertFalse(Review.objects.exists())
+
+    def test_unknown_listing_is_rejected(self):
+        self.client.force_authenticate(self.users[0])
+        response = self.client.post(
+            "/api/reviews/", {"listing_id": 0, "rating": 5, "comment": "Nice"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("listing_id", response.data)
+
+    def test_rebuild_command(self):
+        Review.objects.create(
+            user=self.users[0], listing=self.listing, rating=3, comment="Ok"
+        )
+        Review.objects.create(
+            user=self.users[1], listing=self.listing, rating=4, comment="Good"
+        )
+        before = Listing.objects.get(pk=self.listing.pk).updated_at
+        call_command("rebuild_ratings", stdout=StringIO())
+        self.assert_aggregates("3.50", 2, [0, 0, 1, 1, 0])
+        # Conditional GETs must see the new aggregates
+        self.assertGreater(Listing.objects.get(pk=self.listing.pk).updated_at, before)
+
+    def test_listing_exposes_and_orders_by_rating(self):
+        better = make_listing(title="Better")
+        better.rating_avg = Decimal("4.50")
+        better.save()
+        response = self.client.get(
+            "/api/listings/",
+            {"ordering": "-rating_avg", "fields": "id,rating_histogram"},
+        )
+        first = response.data["results"][0]
+        self.assertEqual(first["id"], better.id)
+        self.assertEqual(first["rating_histogram"], dict.fromkeys("12345", 0))
+
+
+class ListingDetailCacheTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.client = APIClient()
+        self.listing = make_listing(title="Cached Villa")
+        self.amenity = Amenity.objects.create(name="WiFi")
+        self.url = f"/api/listings/{self.listing.slug}/"
+
+    def test_cached_read_skips_database(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data["title"], "Cached Villa")
+        self.assertEqual(listing_cache.get_stats(), {"hits": 1, "misses": 1})
+
+    def test_listing_change_invalidates(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.title = "Renamed Villa"
+            self.listing.save()
+        self.assertEqual(self.client.get(self.url).data["title"], "Renamed Villa")
+
+    def test_amenity_and_image_changes_invalidate(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            ListingAmenity.objects.create(listing=self.listing, amenity=self.amenity)
+        self.assertEqual(len(self.client.get(self.url).data["amenities"]), 1)
+
+        with mock.patch.object(
+            tasks.generate_listing_image_variants, "delay"
+        ), self.captureOnCommitCallbacks(execute=True):
+            ListingImage.objects.create(listing=self.listing, image="listings/a.jpg")
+        self.assertEqual(len(self.client.get(self.url).data["images"]), 1)
+
+    def test_amenity_rename_invalidates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ListingAmenity.objects.create(listing=self.listing, amenity=self.amenity)
+        etag = self.client.get(self.url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.amenity.name = "Fast WiFi"
+            self.amenity.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["amenities"][0]["name"], "Fast WiFi")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.amenity.delete()
+        self.assertEqual(self.client.get(self.url).data["amenities"], [])
+
+    def test_slug_change_invalidates_old_slug(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.slug = "new-slug"
+            self.listing.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_payload_rendered_before_invalidation_is_not_served(self):
+        host = "http://testserver"
+        entry, tokens = listing_cache.get_listing_detail(self.listing.slug, host)
+        self.assertIsNone(entry)
+        stale = {"id": self.listing.pk, "title": "Stale"}
+        listing_cache.invalidate_listing(self.listing.pk, self.listing.slug)
+        listing_cache.set_listing_detail(self.listing.slug, host, tokens, stale)
+        self.assertEqual(self.client.get(self.url).data["title"], "Cached Villa")
+
+    def test_query_params_bypass_the_cache(self):
+        self.listing.latitude, self.listing.longitude = 9.0, 38.7
+        self.listing.geohash = geo.encode(9.0, 38.7)
+        self.listing.save()
+        near = self.client.get(self.url, {"near": "9.0,38.7"})
+        self.assertIn("distance_km", near.data)
+        self.assertNotIn("distance_km", self.client.get(self.url).data)
+
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        response = self.client.get(self.url, {"listing_type": "villa"})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(listing_cache.get_stats(), {"hits": 1, "misses": 1})
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.client = APIClient()
+        self.listing = make_listing(title="Etag Villa")
+        self.detail_url = f"/api/listings/{self.listing.slug}/"
+
+    def test_list_returns_304_after_single_query(self):
+        response = self.client.get("/api/listings/")
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/listings/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        make_listing(title="Another")
+        response = self.client.get("/api/listings/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_etag_depends_on_query(self):
+        etag = self.client.get("/api/listings/")["ETag"]
+        response = self.client.get(
+            "/api/listings/", {"listing_type": "villa"}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_304_from_cache_and_database(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        django_cache.clear()
+        with self.assertNumQueries(1):
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_amenity_change_changes_detail_etag(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            ListingAmenity.objects.create(
+                listing=self.listing, amenity=Amenity.objects.create(name="Pool")
+            )
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_review_list_tracks_listing_changes(self):
+        user = User.objects.create_user("critic", password="pass12345")
+        Review.objects.create(user=user, listing=self.listing, rating=4, comment="Ok")
+        etag = self.client.get("/api/reviews/")["ETag"]
+        self.listing.title = "Renamed"
+        self.listing.save()
+        response = self.client.get("/api/reviews/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class GeoSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.bole = make_listing(title="Bole", latitude=8.9950, longitude=38.7890)
+        self.piazza = make_listing(title="Piazza", latitude=9.0340, longitude=38.7520)
+        self.adama = make_listing(title="Adama", latitude=8.5400, longitude=39.2700)
+        self.fiji = make_listing(title="Fiji", latitude=-17.80, longitude=179.90)
+        make_listing(title="Unmapped")
+
+    def get_ids(self, params):
+        response = self.client.get("/api/listings/", params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [item["id"] for item in response.data["results"]]
+
+    def test_geohash_encoding(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertTrue(self.bole.geohash.startswith("sc"))
+
+    def test_near_filters_by_radius_and_orders_by_distance(self):
+        params = {"near": "9.0300,38.7400", "radius_km": 20}
+        self.assertEqual(self.get_ids(params), [self.piazza.id, self.bole.id])
+
+        results = self.client.get("/api/listings/", params).data["results"]
+        self.assertLess(results[0]["distance_km"], results[1]["distance_km"])
+
+        params["radius_km"] = 100
+        self.assertEqual(
+            self.get_ids(params), [self.piazza.id, self.bole.id, self.adama.id]
+        )
+
+    def test_near_across_antimeridian(self):
+        params = {"near": "-17.80,-179.95", "radius_km": 50}
+        self.assertEqual(self.get_ids(params), [self.fiji.id])
+
+    def test_bbox(self):
+        ids = self.get_ids({"bbox": "38.70,8.90,38.80,9.10"})
+        self.assertEqual(set(ids), {self.bole.id, self.piazza.id})
+        self.assertEqual(self.get_ids({"bbox": "179.0,-18,-179.0,-17"}), [self.fiji.id])
+
+    def test_invalid_parameters(self):
+        for params in ({"near": "abc"}, {"near": "9,38", "radius_km": 0}):
+            response = self.client.get("/api/listings/", params)
+            self.assertEqual(response.status_code, 400)
+
+
+class AvailabilitySearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("booker", password="pass12345")
+        self.free = make_listing(title="Free", max_guests=4)
+        self.booked = make_listing(title="Booked", max_guests=4)
+        self.small = make_listing(title="Small", max_guests=1)
+        self.start = date.today() + timedelta(days=10)
+        self.book(self.booked, 2, 5, "confirmed")
+
+    def book(self, listing, start, end, status):
+        return Booking.objects.create(
+            user=self.user,
+            listing=listing,
+            check_in_date=self.start + timedelta(days=start),
+            check_out_date=self.start + timedelta(days=end),
+            num_guests=1,
+            total_price=Decimal("100.00"),
+            status=status,
+        )
+
+    def search(self, start, end, guests=None):
+        params = {
+            "check_in": (self.start + timedelta(days=start)).isoformat(),
+            "check_out": (self.start + timedelta(days=end)).isoformat(),
+        }
+        if guests:
+            params["guests"] = guests
+        response = self.client.get("/api/listings/", params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return {item["id"] for item in response.data["results"]}
+
+    def test_overlapping_bookings_exclude_listing(self):
+        self.assertEqual(self.search(0, 3), {self.free.id, self.small.id})
+        self.assertEqual(self.search(4, 6), {self.free.id, self.small.id})
+
+    def test_adjacent_stays_are_free(self):
+        self.assertIn(self.booked.id, self.search(0, 2))
+        self.assertIn(self.booked.id, self.search(5, 7))
+
+    def test_cancelled_bookings_do_not_block(self):
+        self.book(self.free, 0, 3, "cancelled")
+        self.assertIn(self.free.id, self.search(0, 3))
+
+    def test_guests_filter_without_extra_queries(self):
+        with self.assertNumQueries(2):
+            ids = self.search(0, 3, guests=2)
+        self.assertEqual(ids, {self.free.id})
+
+    def test_invalid_range(self):
+        response = self.client.get(
+            "/api/listings/", {"check_in": "2030-01-05", "check_out": "2030-01-01"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.client = APIClient()
+        wifi = Amenity.objects.create(name="WiFi")
+        pool = Amenity.objects.create(name="Pool")
+        hotel = make_listing(listing_type="hotel", price_per_night=Decimal("40"))
+        villa = make_listing(
+            title="Villa", listing_type="villa", price_per_night=Decimal("600")
+        )
+        make_listing(title="Flat", bedrooms=3, price_per_night=Decimal("120"))
+        for listing in (hotel, villa):
+            ListingAmenity.objects.create(listing=listing, amenity=wifi)
+        ListingAmenity.objects.create(listing=villa, amenity=pool)
+
+    def test_counts(self):
+        with self.assertNumQueries(4):
+            data = self.client.get("/api/listings/facets/").data
+        self.assertEqual(data["total"], 3)
+        self.assertEqual(
+            [(t["value"], t["count"]) for t in data["listing_type"]],
+            [("apartment", 1), ("hotel", 1), ("villa", 1)],
+        )
+        self.assertEqual([b["count"] for b in data["bedrooms"]], [2, 1])
+        self.assertEqual([p["count"] for p in data["price"]], [1, 0, 1, 0, 1])
+        self.assertEqual(
+            [(a["name"], a["count"]) for a in data["amenities"]],
+            [("WiFi", 2), ("Pool", 1)],
+        )
+
+    def test_filters_apply_and_results_are_cached(self):
+        data = self.client.get(
+            "/api/listings/facets/", {"listing_type": "villa", "ordering": "-bedrooms"}
+        ).data
+        self.assertEqual(data["total"], 1)
+        with self.assertNumQueries(0):
+            cached = self.client.get(
+                "/api/listings/facets/", {"listing_type": "villa"}
+            ).data
+        self.assertEqual(cached, data)
+
+    def test_search_filter_applies(self):
+        search.reset_index()
+        self.addCleanup(search.reset_index)
+        data = self.client.get("/api/listings/facets/", {"search": "villa"}).data
+        self.assertEqual(data["total"], 1)
+
+
+class AmenityFilterTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.wifi = Amenity.objects.create(name="WiFi")
+        self.pool = Amenity.objects.create(name="Swimming Pool")
+        self.both = make_listing(title="Both")
+        self.wifi_only = make_listing(title="WiFi only")
+        make_listing(title="None")
+        for amenity in (self.wifi, self.pool):
+            ListingAmenity.objects.create(listing=self.both, amenity=amenity)
+        ListingAmenity.objects.create(listing=self.wifi_only, amenity=self.wifi)
+
+    def get_ids(self, amenities):
+        response = self.client.get("/api/listings/", {"amenities": amenities})
+        self.assertEqual(response.status_code, 200, response.data)
+        return {item["id"] for item in response.data["results"]}
+
+    def test_bits_are_assigned_and_masks_maintained(self):
+        self.assertEqual((self.wifi.bit, self.pool.bit), (0, 1))
+        self.both.refresh_from_db()
+        self.assertEqual(self.both.amenity_mask, 0b11)
+
+        ListingAmenity.objects.filter(listing=self.both, amenity=self.wifi).delete()
+        self.both.refresh_from_db()
+        self.assertEqual(self.both.amenity_mask, 0b10)
+
+    def test_filter_requires_all_amenities(self):
+        self.assertEqual(self.get_ids("wifi"), {self.both.id, self.wifi_only.id})
+        self.assertEqual(self.get_ids("wifi,swimming-pool"), {self.both.id})
+        self.assertEqual(self.get_ids(f"{self.pool.id}"), {self.both.id})
+
+    def test_unknown_amenity(self):
+        response = self.client.get("/api/listings/", {"amenities": "sauna"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bit_allocation_retries_after_a_concurrent_save(self):
+        # Both saves read the same Max("bit"), as concurrent requests would
+        stale = {"bit__max": self.pool.bit}
+        with mock.patch.object(Amenity.objects, "aggregate", return_value=stale):
+            first = Amenity.objects.create(name="Sauna")
+            second = Amenity.objects.create(name="Gym")
+        self.assertEqual((first.bit, second.bit), (2, 3))
+
+    def test_bit_is_not_exposed(self):
+        response = self.client.get(f"/api/amenities/{self.wifi.pk}/")
+        self.assertEqual(set(response.data), {"id", "name", "icon"})
+        listing = self.client.get(
+            f"/api/listings/{self.both.slug}/", {"expand": "amenities"}
+        ).data
+        self.assertNotIn("bit", listing["amenities"][0])
+
+    def test_amenities_without_bit_use_join(self):
+        sauna = Amenity.objects.create(name="Sauna")
+        Amenity.objects.filter(pk=sauna.pk).update(bit=None)
+        ListingAmenity.objects.create(listing=self.wifi_only, amenity=sauna)
+        self.assertEqual(self.get_ids("wifi,sauna"), {self.wifi_only.id})
+
+
+class PriceHistogramTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for i, price in enumerate([10, 20, 20, 30, 50, 100]):
+            make_listing(title=f"Priced {i}", price_per_night=Decimal(price))
+
+    def test_histogram(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/listings/price_histogram/", {"buckets": 3})
+        data = response.data
+        self.assertEqual(data["count"], 6)
+        self.assertEqual((data["min"], data["max"]), ("10.00", "100.00"))
+        self.assertEqual([b["count"] for b in data["buckets"]], [4, 1, 1])
+        self.assertEqual(
+            data["buckets"][0], {"min": "10.00", "max": "40.00", "count": 4}
+        )
+        self.assertEqual(data["buckets"][-1]["max"], "100.00")
+        self.assertEqual(data["percentiles"]["p50"], "20.00")
+        self.assertEqual(data["percentiles"]["p90"], "100.00")
+
+    def test_price_on_rounded_edge(self):
+        Listing.objects.all().delete()
+        for i, price in enumerate(["10.00", "13.33", "20.00"]):
+            make_listing(title=f"Edge {i}", price_per_night=Decimal(price))
+        data = self.client.get("/api/listings/price_histogram/", {"buckets": 3}).data
+        # The unrounded edge is 13.333..., but 13.33 is shown as bucket 2's min
+        self.assertEqual(data["buckets"][1]["min"], "13.33")
+        self.assertEqual([b["count"] for b in data["buckets"]], [1, 1, 1])
+
+    def test_filters_apply(self):
+        data = self.client.get(
+            "/api/listings/price_histogram/", {"listing_type": "villa"}
+        ).data
+        self.assertEqual(data["count"], 0)
+        self.assertEqual(data["buckets"], [])
+
+    def test_invalid_bucket_count(self):
+        response = self.client.get("/api/listings/price_histogram/", {"buckets": 0})
+        self.assertEqual(response.status_code, 400)
+
+
+class FeaturedRankingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("traveller", password="pass12345")
+        self.plain = make_listing(title="Plain")
+        self.loved = make_listing(
+            title="Loved", rating_avg=Decimal("4.90"), rating_count=40
+        )
+        self.villa = make_listing(
+            title="Busy Villa", listing_type="villa", rating_avg=Decimal("4.00")
+        )
+        self.villa.rating_count = 3
+        self.villa.save()
+        for _ in range(3):
+            Booking.objects.create(
+                user=self.user,
+                listing=self.villa,
+                check_in_date=date.today(),
+                check_out_date=date.today() + timedelta(days=1),
+                num_guests=1,
+                total_price=Decimal("100.00"),
+                status="confirmed",
+            )
+        make_listing(title="Hidden", is_available=False)
+
+    def featured_titles(self, params=None):
+        response = self.client.get("/api/listings/featured/", params or {})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [item["title"] for item in response.data]
+
+    def test_falls_back_before_first_refresh(self):
+        self.assertEqual(self.featured_titles({"limit": 2}), ["Busy Villa", "Loved"])
+
+    def test_serves_materialized_ranking(self):
+        self.assertEqual(
+            tasks.refresh_featured_rankings(), "Ranked 3 featured listings"
+        )
+        with self.assertNumQueries(1):
+            titles = self.featured_titles()
+        # Recent bookings outweigh Loved's slightly better rating
+        self.assertEqual(titles, ["Busy Villa", "Loved", "Plain"])
+        self.assertEqual(self.featured_titles({"limit": 1}), ["Busy Villa"])
+        self.assertEqual(
+            self.featured_titles({"listing_type": "apartment"}), ["Loved", "Plain"]
+        )
+
+    def test_invalid_parameters(self):
+        for params in ({"limit": 0}, {"listing_type": "castle"}):
+            response = self.client.get("/api/listings/featured/", params)
+            self.assertEqual(response.status_code, 400)
+
+
+class UserHistoryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("history", password="pass12345")
+        self.other = User.objects.create_user("other", password="pass12345")
+        self.client.force_authenticate(self.user)
+        today = date.today()
+        # Check-in order differs from creation order
+        for i, days in enumerate((6, 10, 12, 4, 8)):
+            listing = make_listing(title=f"Stay {i}")
+            for user in (self.user, self.other):
+                Booking.objects.create(
+                    user=user,
+                    listing=listing,
+                    check_in_date=today + timedelta(days=days),
+                    check_out_date=today + timedelta(days=days + 1),
+                    num_guests=1,
+                    total_price=Decimal("100.00"),
+                    status="cancelled" if i == 1 else "pending",
+                )
+                Review.objects.create(
+                    user=user, listing=listing, rating=4, comment="Good"
+                )
+        # One stay in the past
+        Booking.objects.filter(user=self.user, listing__title="Stay 4").update(
+            check_in_date=today - timedelta(days=3)
+        )
+
+    def walk(self, url, params=None):
+        pages = []
+        response = self.client.get(url, {"page_size": 2, **(params or {})})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data["results"])
+            if not response.data["next"]:
+                return pages
+            response = self.client.get(response.data["next"])
+
+    def test_my_bookings_pages_newest_first(self):
+        pages = self.walk("/api/bookings/my_bookings/")
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        ids = [item["id"] for page in pages for item in page]
+        expected = Booking.objects.filter(user=self.user).order_by("-created_at", "-id")
+        self.assertEqual(ids, list(expected.values_list("id", flat=True)))
+
+        pages = self.walk("/api/bookings/my_bookings/", {"status": "cancelled"})
+        self.assertEqual([item["status"] for item in pages[0]], ["cancelled"])
+
+    def test_upcoming_pages_soonest_first(self):
+        pages = self.walk("/api/bookings/upcoming/")
+        titles = [item["listing"]["title"] for page in pages for item in page]
+        self.assertEqual(titles, ["Stay 3", "Stay 0", "Stay 2"])
+
+        # ?ordering= cannot override the order the cursor pages along
+        pages = self.walk("/api/bookings/upcoming/", {"ordering": "-created_at"})
+        titles = [item["listing"]["title"] for page in pages for item in page]
+        self.assertEqual(titles, ["Stay 3", "Stay 0", "Stay 2"])
+
+    def test_my_reviews(self):
+        pages = self.walk("/api/reviews/my_reviews/", {"rating": 4})
+        reviews = [item for page in pages for item in page]
+        self.assertEqual(len(reviews), 5)
+        self.assertEqual({item["user"] for item in reviews}, {"history"})
+
+    def test_pages_use_user_indexes(self):
+        plans = [
+            Booking.objects.filter(user=self.user)
+            .order_by("-created_at", "-id")[:20]
+            .explain(),
+            Booking.objects.filter(
+                user=self.user,
+                status__in=Booking.ACTIVE_STATUSES,
+                check_in_date__gte=date.today(),
+            )
+            .order_by("check_in_date", "id")[:20]
+            .explain(),
+            Review.objects.filter(user=self.user)
+            .order_by("-created_at", "-id")[:20]
+            .explain(),
+        ]
+        for plan, index in zip(
+            plans,
+            [
+                "booking_user_created_idx",
+                "booking_user_upcoming_idx",
+                "review_user_created_idx",
+            ],
+        ):
+            self.assertIn(index, plan)
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user("sparse", password="pass12345")
+        self.listing = make_listing(title="Sparse Villa")
+        ListingImage.objects.create(listing=self.listing, image="listings/a.jpg")
+        Booking.objects.create(
+            user=self.user,
+            listing=self.listing,
+            check_in_date=date.today(),
+            check_out_date=date.today() + timedelta(days=2),
+            num_guests=1,
+            total_price=Decimal("200.00"),
+        )
+
+    def capture_sql(self, url, params=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, " ".join(query["sql"] for query in captured)
+
+    def test_list_is_compact_by_default(self):
+        response, sql = self.capture_sql("/api/listings/")
+        item = response.data["results"][0]
+        self.assertEqual(item["title"], "Sparse Villa")
+        self.assertNotIn("description", item)
+        self.assertNotIn("images", item)
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn("listingimage", sql)
+
+    def test_fields_and_expand(self):
+        response, sql = self.capture_sql(
+            "/api/listings/", {"fields": "id,title,images"}
+        )
+        item = response.data["results"][0]
+        self.assertEqual(set(item), {"id", "title", "images"})
+        self.assertEqual(len(item["images"]), 1)
+        self.assertNotIn("listingamenity", sql)
+
+        response, _ = self.capture_sql("/api/listings/", {"expand": "amenities"})
+        self.assertIn("amenities", response.data["results"][0])
+        self.assertIn("price_per_night", response.data["results"][0])
+
+    def test_detail_is_full_unless_restricted(self):
+        url = f"/api/listings/{self.listing.slug}/"
+        response, _ = self.capture_sql(url)
+        self.assertIn("description", response.data)
+        self.assertIn("images", response.data)
+
+        response, _ = self.capture_sql(url, {"fields": "id,slug"})
+        self.assertEqual(set(response.data), {"id", "slug"})
+        # The restricted variant is not served from or stored in the cache
+        self.assertIn("images", self.client.get(url).data)
+
+    def test_nested_listing_follows_expand(self):
+        self.client.force_authenticate(self.user)
+        response, sql = self.capture_sql("/api/bookings/", {"fields": "id,listing"})
+        item = response.data[0]
+        self.assertEqual(set(item), {"id", "listing"})
+        self.assertNotIn("images", item["listing"])
+        self.assertNotIn('"check_in_date"', sql)
+
+    def test_bookings_embed_a_listing_summary(self):
+        self.client.force_authenticate(self.user)
+        booking = Booking.objects.get()
+        url = f"/api/bookings/{booking.pk}/"
+        response, sql = self.capture_sql(url)
+        self.assertEqual(
+            response.data["listing"],
+            {
+                "id": self.listing.pk,
+                "slug": self.listing.slug,
+                "title": "Sparse Villa",
+                "thumbnail": None,
+                "price_per_night": "100.00",
+            },
+        )
+        self.assertNotIn('"description"', sql)
+        compact_size = len(response.content)
+
+        response, _ = self.capture_sql(url, {"expand": "listing,images"})
+        self.assertEqual(response.data["listing"]["description"], "A place to stay.")
+        self.assertEqual(len(response.data["listing"]["images"]), 1)
+        self.assertGreater(len(response.content), 2 * compact_size)
+
+
+class FastReadPathTests(TestCase):
+    """The values() read path must render exactly what the serializers do."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("fast", password="pass12345")
+        self.client.force_authenticate(self.user)
+        amenity = Amenity.objects.create(name="Wifi")
+        self.listings = [
+            make_listing(
+                title="Line\u2028break Villa",
+                latitude=0.00001,
+                longitude=38.7890,
+                featured_image="listings/villa.jpg",
+                rating_avg=Decimal("4.50"),
+                rating_count=2,
+                rating_4_count=1,
+                rating_5_count=1,
+            ),
+            make_listing(title="Café Loft", latitude=0.0002, longitude=38.79),
+            make_listing(title="Unmapped Hut", price_per_night=Decimal("9.99")),
+        ]
+        for listing in self.listings:
+            ListingImage.objects.create(listing=listing, image="listings/a.jpg")
+            ListingAmenity.objects.create(listing=listing, amenity=amenity)
+            booking = Booking.objects.create(
+                user=self.user,
+                listing=listing,
+                check_in_date=date.today(),
+                check_out_date=date.today() + timedelta(days=2),
+                num_guests=2,
+                total_price=Decimal("200.00"),
+            )
+            Review.objects.create(
+                user=self.user, listing=listing, booking=booking, rating=4, comment="ok"
+            )
+
+    def assert_identical(self, viewset, serializer, url, params=None):
+        with mock.patch.object(
+            serializer, "to_representation", side_effect=AssertionError
+        ):
+            fast = self.client.get(url, params)
+        with mock.patch.object(viewset, "fast_actions", ()), mock.patch.object(
+            viewset, "renderer_classes", [JSONRenderer]
+        ):
+            slow = self.client.get(url, params)
+        self.assertEqual(slow.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_listing_list(self):
+        url = "/api/listings/"
+        response = self.assert_identical(ListingViewSet, ListingSerializer, url)
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assert_identical(
+            ListingViewSet,
+            ListingSerializer,
+            url,
+            {"fields": "id,title,featured_image,rating_histogram,latitude"},
+        )
+        self.assert_identical(
+            ListingViewSet, ListingSerializer, url, {"near": "0,38.79", "radius_km": 5}
+        )
+        self.assert_identical(
+            ListingViewSet, ListingSerializer, url, {"search": "villa"}
+        )
+
+    def test_listing_list_pages(self):
+        params = {"page_size": 1, "ordering": "price_per_night"}
+        response = self.assert_identical(
+            ListingViewSet, ListingSerializer, "/api/listings/", params
+        )
+        next_url = response.data["next"]
+        self.assertIsNotNone(next_url)
+        self.assert_identical(ListingViewSet, ListingSerializer, next_url)
+
+    def test_unplannable_fields_use_the_serializer(self):
+        fast = self.client.get("/api/listings/", {"expand": "images"})
+        with mock.patch.object(ListingViewSet, "fast_actions", ()):
+            slow = self.client.get("/api/listings/", {"expand": "images"})
+        self.assertEqual(fast.content, slow.content)
+        self.assertEqual(len(fast.data["results"][0]["images"]), 1)
+
+    def test_my_bookings(self):
+        self.assert_identical(
+            BookingViewSet, BookingSerializer, "/api/bookings/my_bookings/"
+        )
+
+    def test_review_list(self):
+        response = self.assert_identical(
+            ReviewViewSet, ReviewSerializer, "/api/reviews/"
+        )
+        self.assertEqual(response.data[0]["user"], "fast")
+        self.assertEqual(response.data[0]["listing"]["title"], "Unmapped Hut")
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            "floats": [1e-05, 0.0002, 1e16, 1.5, -0.0],
+            "text": "caf\u00e9 \u2028 \u2029 \x7f \x00",
+            "when": timezone.now(),
+            "price": Decimal("10.50"),
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render({"a": [1, "b"]}),
+            JSONRenderer().render({"a": [1, "b"]}),
+        )
+
+    def test_string_content_does_not_force_the_stock_encoder(self):
+        data = {"address": 'Suite 1E, "2e floor"', "note": "0.00001", "n": 0.5}
+        with mock.patch.object(
+            JSONRenderer, "render", side_effect=AssertionError
+        ) as stock:
+            rendered = FastJSONRenderer().render(data)
+        stock.assert_not_called()
+        self.assertEqual(rendered, JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render({"address": "1E", "n": 1e-07}),
+            JSONRenderer().render({"address": "1E", "n": 1e-07}),
+        )
+
+
+class BookingReservationTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(tasks.send_booking_confirmation_email, "delay")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("guest", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.listing = make_listing(title="Lake House", max_guests=4)
+        self.first = self.book("2030-05-10", "2030-05-13").data
+
+    def book(self, check_in, check_out, num_guests=2, listing=None):
+        return self.client.post(
+            "/api/bookings/",
+            {
+                "listing_id": (listing or self.listing).pk,
+                "check_in_date": check_in,
+                "check_out_date": check_out,
+                "num_guests": num_guests,
+            },
+        )
+
+    def test_stay_is_priced_and_overlaps_are_rejected(self):
+        self.assertEqual(self.first["total_price"], "300.00")
+        self.assertEqual(self.book("2030-05-12", "2030-05-14").status_code, 409)
+        self.assertEqual(self.book("2030-05-01", "2030-05-20").status_code, 409)
+        # Check-out day is free for the next check-in
+        self.assertEqual(self.book("2030-05-13", "2030-05-15").status_code, 201)
+        self.assertEqual(self.book("2030-05-08", "2030-05-10").status_code, 201)
+        # Other listings are unaffected
+        other = make_listing(title="Other")
+        self.assertEqual(
+            self.book("2030-05-10", "2030-05-13", listing=other).status_code, 201
+        )
+
+    def test_inactive_bookings_do_not_block(self):
+        Booking.objects.filter(pk=self.first["id"]).update(status="cancelled")
+        self.assertEqual(self.book("2030-05-10", "2030-05-13").status_code, 201)
+
+    def test_invalid_stays(self):
+        self.assertEqual(self.book("2030-06-02", "2030-06-02").status_code, 400)
+        self.assertEqual(
+            self.book("2030-06-01", "2030-06-02", num_guests=5).status_code, 400
+        )
+        self.assertEqual(
+            self.book("2030-06-01", "2030-06-02", num_guests=0).status_code, 400
+        )
+        Listing.objects.filter(pk=self.listing.pk).update(is_available=False)
+        self.assertEqual(self.book("2030-06-01", "2030-06-02").status_code, 400)
+
+    def test_updates_are_checked_too(self):
+        second = self.book("2030-05-20", "2030-05-22").data
+        url = f"/api/bookings/{second['id']}/"
+        response = self.client.patch(url, {"check_in_date": "2030-05-12"})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.patch(url, {"check_out_date": "2030-05-24"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["total_price"], "400.00")
+
+        Booking.objects.filter(pk=self.first["id"]).update(status="cancelled")
+        self.client.patch(url, {"check_in_date": "2030-05-12"})
+        first_url = f"/api/bookings/{self.first['id']}/"
+        self.assertEqual(
+            self.client.patch(first_url, {"status": "pending"}).status_code, 409
+        )
+
+    def test_conflict_check_is_constant_queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.book("2030-05-11", "2030-05-12").status_code, 409)
+        statements = [q["sql"] for q in captured if "SAVEPOINT" not in q["sql"]]
+        # Lock the listing, then one EXISTS for the overlap
+        self.assertEqual(len(statements), 2)
+        self.assertIn("listings_listing", statements[0])
+
+
+class BookingExpiryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            "late", email="late@example.com", password="pass12345"
+        )
+        self.listing = make_listing(title="Hold House")
+        self.old = timezone.now() - timedelta(hours=2)
+        self.lapsed = [
+            self.booking(date(2030, 8, i), created_at=self.old) for i in (1, 3, 5)
+        ]
+        self.fresh = self.booking(date(2030, 8, 7))
+        self.paid = self.booking(
+            date(2030, 8, 9), status="confirmed", created_at=self.old
+        )
+        self.payment = Payment.objects.create(
+            booking=self.lapsed[0], amount=Decimal("100.00"), transaction_id="tx-1"
+        )
+        Payment.objects.filter(pk=self.payment.pk).update(created_at=self.old)
+
+    def booking(self, check_in, status="pending", created_at=None):
+        booking = Booking.objects.create(
+            user=self.user,
+            listing=self.listing,
+            check_in_date=check_in,
+            check_out_date=check_in + timedelta(days=1),
+            num_guests=1,
+            total_price=Decimal("100.00"),
+            status=status,
+        )
+        if created_at is not None:
+            Booking.objects.filter(pk=booking.pk).update(created_at=created_at)
+        return booking
+
+    def test_lapsed_holds_expire_in_batches(self):
+        batches = []
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as captured:
+                count = reservations.expire_lapsed_holds(
+                    batch_size=2, notify=batches.append
+                )
+        self.assertEqual(count, 3)
+        self.assertEqual(
+            batches, [[b.pk for b in self.lapsed[:2]], [self.lapsed[2].pk]]
+        )
+        statements = [q for q in captured if "SAVEPOINT" not in q["sql"]]
+        # Select, expire bookings, cancel payments: per batch, never per row
+        self.assertEqual(len(statements), 6)
+
+        statuses = dict(Booking.objects.values_list("pk", "status"))
+        self.assertEqual(
+            [statuses[b.pk] for b in [*self.lapsed, self.fresh, self.paid]],
+            ["expired", "expired", "expired", "pending", "confirmed"],
+        )
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "cancelled")
+        self.assertEqual(reservations.expire_lapsed_holds(), 0)
+
+    def test_task_notifies_once_per_batch(self):
+        with mock.patch.object(tasks.send_booking_expiry_emails, "delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(
+                    tasks.expire_pending_bookings(), "Expired 3 pending bookings"
+                )
+        delay.assert_called_once_with([b.pk for b in self.lapsed])
+
+        tasks.send_booking_expiry_emails([b.pk for b in self.lapsed])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ["late@example.com"])
+
+    def test_expired_nights_are_released(self):
+        reservations.expire_lapsed_holds()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(f"/api/bookings/{self.lapsed[0].pk}/pay/")
+        self.assertEqual(response.status_code, 400)
+        with mock.patch.object(tasks.send_booking_confirmation_email, "delay"):
+            response = client.post(
+                "/api/bookings/",
+                {
+                    "listing_id": self.listing.pk,
+                    "check_in_date": "2030-08-01",
+                    "check_out_date": "2030-08-02",
+                    "num_guests": 1,
+                },
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def verify(self):
+        with mock.patch("listings.views.Chapa") as chapa:
+            chapa.return_value.verify.return_value = {"status": "success"}
+            client = APIClient()
+            client.force_authenticate(self.user)
+            return client.get("/api/payments/verify/", {"tx_ref": "tx-1"})
+
+    def test_verify_confirms_only_pending_bookings(self):
+        with mock.patch.object(tasks.send_payment_confirmation_email, "delay") as delay:
+            # Expired between the checkout and the verify callback
+            Booking.objects.filter(pk=self.lapsed[0].pk).update(status="expired")
+            self.assertEqual(self.verify().status_code, 409)
+            self.lapsed[0].refresh_from_db()
+            self.payment.refresh_from_db()
+            self.assertEqual(self.lapsed[0].status, "expired")
+            self.assertEqual(self.payment.status, "pending")
+
+            Booking.objects.filter(pk=self.lapsed[0].pk).update(status="pending")
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.verify().status_code, 200)
+                # A repeated callback does not notify again
+                self.assertEqual(self.verify().status_code, 200)
+        delay.assert_called_once_with(self.payment.pk)
+        self.lapsed[0].refresh_from_db()
+        self.assertEqual(self.lapsed[0].status, "confirmed")
+        self.assertEqual(reservations.expire_lapsed_holds(), 2)
+        self.lapsed[0].refresh_from_db()
+        self.assertEqual(self.lapsed[0].status, "confirmed")
+
+    def test_initiated_payment_extends_the_hold(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch("listings.views.Chapa") as chapa:
+            chapa.return_value.initialize.return_value = {
+                "status": "success",
+                "data": {"checkout_url": "https://checkout.example.com/2"},
+            }
+            response = client.post(f"/api/bookings/{self.lapsed[1].pk}/pay/")
+        self.assertEqual(response.status_code, 200)
+        payment = Payment.objects.get(booking=self.lapsed[1])
+
+        self.assertEqual(reservations.expire_lapsed_holds(), 2)
+        self.lapsed[1].refresh_from_db()
+        self.assertEqual(self.lapsed[1].status, "pending")
+
+        with mock.patch("listings.views.Chapa") as chapa, mock.patch.object(
+            tasks.send_payment_confirmation_email, "delay"
+        ):
+            chapa.return_value.verify.return_value = {"status": "success"}
+            response = client.get(
+                "/api/payments/verify/", {"tx_ref": payment.transaction_id}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.lapsed[1].refresh_from_db()
+        self.assertEqual(self.lapsed[1].status, "confirmed")
+
+        # Once the payment is older than the hold, the booking lapses again
+        Payment.objects.filter(pk=payment.pk).update(
+            status="pending", created_at=self.old
+        )
+        Booking.objects.filter(pk=self.lapsed[1].pk).update(status="pending")
+        self.assertEqual(reservations.expire_lapsed_holds(), 1)
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class BookingConcurrencyTests(TransactionTestCase):
+    """
+    Parallel bookings against a real row-locking database.
+
+    Skipped on SQLite, where ``select_for_update`` is a no-op and writers
+    are serialized by the database-wide lock instead.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(tasks.send_booking_confirmation_email, "delay")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("guest", password="pass12345")
+        self.busy = make_listing(title="Busy", slug="busy")
+        self.quiet = make_listing(title="Quiet", slug="quiet")
+
+    def book(self, listing, check_in, check_out):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            return client.post(
+                "/api/bookings/",
+                {
+                    "listing_id": listing.pk,
+                    "check_in_date": check_in,
+                    "check_out_date": check_out,
+                    "num_guests": 1,
+                },
+            ).status_code
+        finally:
+            connection.close()
+
+    def test_parallel_burst_books_each_night_once(self):
+        stays = [
+            (date(2030, 1, 1) + timedelta(days=i), date(2030, 1, 4) + timedelta(days=i))
+            for i in range(12)
+        ]
+        with ThreadPoolExecutor(max_workers=12) as executor:
+            codes = list(
+                executor.map(
+                    lambda stay: self.book(self.busy, str(stay[0]), str(stay[1])),
+                    stays,
+                )
+            )
+        self.assertEqual(set(codes), {201, 409})
+
+        booked = sorted(
+            Booking.objects.filter(listing=self.busy).values_list(
+                "check_in_date", "check_out_date"
+            )
+        )
+        self.assertEqual(len(booked), codes.count(201))
+        for (_, previous_out), (next_in, _) in zip(booked, booked[1:]):
+            self.assertLessEqual(previous_out, next_in)
+
+    def test_locks_do_not_serialize_other_listings(self):
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_busy_listing():
+            try:
+                with transaction.atomic():
+                    reserve_stay(self.busy.pk, date(2030, 2, 1), date(2030, 2, 2), 1)
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            holder = executor.submit(hold_busy_listing)
+            self.assertTrue(locked.wait(10))
+            waiting = executor.submit(self.book, self.busy, "2030-03-01", "2030-03-02")
+            quiet = executor.submit(self.book, self.quiet, "2030-02-01", "2030-02-02")
+            self.assertEqual(quiet.result(timeout=5), 201)
+            self.assertFalse(waiting.done())
+            release.set()
+            holder.result(timeout=10)
+            self.assertEqual(waiting.result(timeout=10), 201)
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.addCleanup(django_cache.clear)
+        self.client = APIClient()
+        self.listing = make_listing(
+            title="Seasonal", weekend_multiplier=Decimal("1.50")
+        )
+        RateOverride.objects.create(
+            listing=self.listing,
+            start_date=date(2030, 6, 1),
+            end_date=date(2030, 6, 30),
+            price_per_night=Decimal("200.00"),
+            label="Summer",
+        )
+        RateOverride.objects.create(
+            listing=self.listing,
+            start_date=date(2030, 6, 10),
+            end_date=date(2030, 6, 11),
+            price_per_night=Decimal("300.00"),
+            label="Festival",
+        )
+        StayDiscount.objects.create(
+            listing=self.listing, min_nights=7, percent=Decimal("10")
+        )
+
+    def quote(self, stays):
+        response = self.client.get(
+            f"/api/listings/{self.listing.slug}/quote/", {"stays": stays}
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        return {
+            f"{q['check_in']}/{q['check_out']}": q["total_price"]
+            for q in response.data["quotes"]
+        }
+
+    def test_rate_calendar(self):
+        quotes = self.quote(
+            "2030-05-27/2030-05-30,"  # base rate on weekdays
+            "2030-05-30/2030-06-02,"  # into the season, Friday and Saturday
+            "2030-06-06/2030-06-09,"  # season weekend
+            "2030-06-08/2030-06-15"  # festival nights, 7-night discount
+        )
+        self.assertEqual(
+            quotes,
+            {
+                "2030-05-27/2030-05-30": "300.00",
+                "2030-05-30/2030-06-02": "550.00",
+                "2030-06-06/2030-06-09": "800.00",
+                "2030-06-08/2030-06-15": "1620.00",
+            },
+        )
+
+    def test_calendar_is_cached_until_rates_change(self):
+        stay = "2030-07-01/2030-07-03"
+        self.quote(stay)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.quote(stay), {stay: "200.00"})
+        self.assertEqual(len(captured), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RateOverride.objects.create(
+                listing=self.listing,
+                start_date=date(2030, 7, 1),
+                end_date=date(2030, 7, 31),
+                price_per_night=Decimal("150.00"),
+            )
+        self.assertEqual(self.quote(stay), {stay: "300.00"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            StayDiscount.objects.create(
+                listing=self.listing, min_nights=2, percent=Decimal("50")
+            )
+        self.assertEqual(self.quote(stay), {stay: "150.00"})
+
+    def test_invalid_stays(self):
+        url = f"/api/listings/{self.listing.slug}/quote/"
+        for stays in ["", "2030-07-01", "2030-07-03/2030-07-01", "x/y"]:
+            response = self.client.get(url, {"stays": stays})
+            self.assertEqual(response.status_code, 400, stays)
+
+    def test_bookings_are_priced_by_the_engine(self):
+        user = User.objects.create_user("guest", password="pass12345")
+        self.client.force_authenticate(user)
+        with mock.patch.object(tasks.send_booking_confirmation_email, "delay"):
+            response = self.client.post(
+                "/api/bookings/",
+                {
+                    "listing_id": self.listing.pk,
+                    "check_in_date": "2030-06-06",
+                    "check_out_date": "2030-06-09",
+                    "num_guests": 2,
+                },
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["total_price"], "800.00")
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = User.objects.create_user(
+            "exporter", password="pass12345", is_staff=True
+        )
+        self.client.force_authenticate(self.staff)
+        self.listings = [
+            make_listing(
+                title=f"Export {i}", listing_type="villa" if i % 2 else "hotel"
+            )
+            for i in range(5)
+        ]
+        Booking.objects.create(
+            user=self.staff,
+            listing=self.listings[0],
+            check_in_date=date(2030, 1, 1),
+            check_out_date=date(2030, 1, 3),
+            num_guests=2,
+            total_price=Decimal("200.00"),
+        )
+
+    def export(self, url, params=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            content = b"".join(response.streaming_content).decode()
+        return response, content, len(captured)
+
+    def test_ndjson_in_keyset_batches(self):
+        response, content, queries = self.export(
+            "/api/listings/export/", {"chunk_size": 2}
+        )
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row["id"] for row in rows], [l.id for l in self.listings])
+        self.assertEqual(rows[0]["price_per_night"], "100.00")
+        self.assertIsNone(rows[0]["latitude"])
+        # Three pk > last batches of at most two rows
+        self.assertEqual(queries, 3)
+
+    def test_csv_with_filters(self):
+        response, content, _ = self.export(
+            "/api/listings/export/", {"export_format": "csv", "listing_type": "villa"}
+        )
+        self.assertIn('filename="listings.csv"', response["Content-Disposition"])
+        header, *rows = list(csv.reader(content.splitlines()))
+        self.assertEqual(header[:3], ["id", "title", "slug"])
+        self.assertEqual([row[1] for row in rows], ["Export 1", "Export 3"])
+        self.assertEqual(rows[0][header.index("latitude")], "")
+
+    def test_accept_header_selects_format(self):
+        response = self.client.get("/api/listings/export/", HTTP_ACCEPT="text/csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        header = b"".join(response.streaming_content).decode().splitlines()[0]
+        self.assertTrue(header.startswith("id,title,slug"))
+
+        response = self.client.get(
+            "/api/bookings/export/",
+            {"export_format": "csv"},
+            HTTP_ACCEPT="application/x-ndjson",
+        )
+        self.assertEqual(response["Content-Type"], "text/csv")
+        response = self.client.get(
+            "/api/reviews/export/", {"chunk_size": "0"}, HTTP_ACCEPT="text/csv"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("chunk_size", response.json())
+
+    def test_bookings_and_reviews(self):
+        _, content, _ = self.export("/api/bookings/export/")
+        row = json.loads(content)
+        self.assertEqual(row["check_in_date"], "2030-01-01")
+        self.assertEqual(row["user_id"], self.staff.id)
+        _, content, _ = self.export("/api/reviews/export/")
+        self.assertEqual(content, "")
+
+    def test_requires_staff_and_valid_params(self):
+        response = self.client.get("/api/listings/export/", {"export_format": "xml"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/listings/export/", {"chunk_size": "0"})
+        self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(User.objects.create_user("guest2"))
+        self.assertEqual(self.client.get("/api/bookings/export/").status_code, 403)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("export_data", "listings", "--format", "csv", stdout=out)
+        rows = list(csv.reader(out.getvalue().splitlines()))
+        self.assertEqual(len(rows), 6)
+
+        out = StringIO()
+        call_command("export_data", "bookings", "--chunk-size", "1", stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["num_guests"], 2)
+
+
+class ImportListingsTests(TestCase):
+    CSV_HEADER = (
+        "title,description,listing_type,price_per_night,location,address,"
+        "latitude,longitude,max_guests,bedrooms,bathrooms,is_available,amenities\n"
+    )
+
+    def setUp(self):
+        search.reset_index()
+        self.addCleanup(search.reset_index)
+        self.wifi = Amenity.objects.create(name="WiFi")
+        self.pool = Amenity.objects.create(name="Swimming Pool")
+        make_listing(title="Sea View")
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.directory = directory
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("import_listings", path, *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def test_csv_import_in_batches(self):
+        search.get_index()
+        path = self.write(
+            "feed.csv",
+            self.CSV_HEADER
+            + 'Sea View,Nice.,villa,250.50,Lamu,Shela,-2.27,40.9,6,3,2,,"WiFi, swimming-pool"\n'
+            + "Sea View,Also nice.,villa,199,Lamu,Shela,,,4,2,1,false,\n"
+            + "Sea View!,Quiet.,hotel,80,Lamu,Town,,,2,1,1,true,wifi\n"
+            + "Hill Hut,Cosy.,hostel,20,Moshi,Kibo,,,1,1,1,1,\n"
+            + "Hill Hut,Cosy.,hostel,20,Moshi,Kibo,,,1,1,1,1,\n",
+        )
+        with CaptureQueriesContext(connection) as captured:
+            output = self.run_import(path, "--batch-size", "2")
+        # Existing slugs + amenities, then two inserts per batch
+        self.assertLessEqual(len(captured), 2 + 3 * 4)
+        self.assertEqual(output.count("rows/s"), 4)
+        self.assertIn("Imported 5 listings", output)
+
+        slugs = list(
+            Listing.objects.filter(location__in=["Lamu", "Moshi"])
+            .order_by("pk")
+            .values_list("slug", flat=True)
+        )
+        self.assertEqual(
+            slugs, ["sea-view-2", "sea-view-3", "sea-view-4", "hill-hut", "hill-hut-2"]
+        )
+
+        listing = Listing.objects.get(slug="sea-view-2")
+        self.assertEqual(listing.price_per_night, Decimal("250.50"))
+        self.assertTrue(listing.is_available)
+        self.assertEqual(listing.geohash, geo.encode(-2.27, 40.9))
+        self.assertEqual(listing.amenity_mask, self.wifi.mask | self.pool.mask)
+        self.assertEqual(listing.listing_amenities.count(), 2)
+        self.assertFalse(Listing.objects.get(slug="sea-view-3").is_available)
+        self.assertEqual(Listing.objects.get(slug="sea-view-3").geohash, "")
+        self.assertIn(listing.pk, search.get_index().search("shela"))
+
+    def test_invalid_rows(self):
+        path = self.write(
+            "feed.jsonl",
+            json.dumps(
+                {
+                    "title": "Good",
+                    "description": "Fine.",
+                    "listing_type": "villa",
+                    "price_per_night": "90",
+                    "location": "Nairobi",
+                    "address": "Karen",
+                    "max_guests": 2,
+                    "bedrooms": 1,
+                    "bathrooms": 1,
+                    "amenities": ["WiFi"],
+                }
+            )
+            + "\n"
+            + '{"title": "Castle", "listing_type": "castle", "amenities": ["Moat"]}\n'
+            + "not json\n",
+        )
+        with self.assertRaisesMessage(CommandError, "Line 2: description: This"):
+            self.run_import(path)
+        # The first row was still waiting for its batch
+        self.assertFalse(Listing.objects.filter(slug="good").exists())
+
+        output = self.run_import(path, "--skip-invalid")
+        self.assertIn("Unknown amenities: Moat.", output)
+        self.assertIn("Line 3: Invalid JSON", output)
+        self.assertIn("skipped 2", output)
+        self.assertTrue(Listing.objects.filter(slug="good").exists())
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.listing = make_listing(title="Photo Villa")
+
+    def upload(self, name, size=(2000, 1000), color=(200, 80, 40)):
+        buffer = BytesIO()
+        Image.new("RGB", size, color).save(buffer, "JPEG")
+        return image_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def test_upload_queues_and_generates_variants(self):
+        name = self.upload("listings/photo.jpg")
+        with mock.patch.object(
+            tasks.generate_listing_image_variants, "delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            image = ListingImage.objects.create(listing=self.listing, image=name)
+        delay.assert_called_once_with(image.pk)
+
+        before = Listing.objects.get(pk=self.listing.pk).updated_at
+        tasks.generate_listing_image_variants(image.pk)
+        image.refresh_from_db()
+        sizes = image.variants["sizes"]
+        self.assertEqual(image.variants["source"], name)
+        self.assertEqual(
+            [(sizes[label]["width"], sizes[label]["height"]) for label in sizes],
+            [(1280, 640), (768, 384), (320, 160)],
+        )
+        with image_storage.open(sizes["small"]["webp"]) as variant:
+            self.assertEqual(Image.open(variant).format, "WEBP")
+        self.assertGreater(Listing.objects.get(pk=self.listing.pk).updated_at, before)
+        # Up to date variants are not regenerated
+        self.assertFalse(images.generate_listing_image_variants(image.pk))
+
+    def test_small_images_are_not_upscaled(self):
+        name = self.upload("listings/tiny.jpg", (200, 100))
+        Listing.objects.filter(pk=self.listing.pk).update(featured_image=name)
+        tasks.generate_featured_image_variants(self.listing.pk)
+        variants = Listing.objects.get(pk=self.listing.pk).featured_image_variants
+        self.assertEqual(
+            {entry["width"] for entry in variants["sizes"].values()}, {200}
+        )
+
+    def test_list_views_never_send_originals(self):
+        name = self.upload("listings/featured.jpg")
+        Listing.objects.filter(pk=self.listing.pk).update(featured_image=name)
+        images.generate_featured_image_variants(self.listing.pk)
+        ListingImage.objects.create(listing=self.listing, image=name)
+
+        item = self.client.get("/api/listings/", {"expand": "images"}).data["results"][
+            0
+        ]
+        self.assertNotIn("featured_image", item)
+        self.assertTrue(
+            item["featured_image_variants"]["medium"]["webp"].startswith(
+                "http://testserver/media/blobs/"
+            )
+        )
+        self.assertNotIn("image", item["images"][0])
+        self.assertIn("variants", item["images"][0])
+
+        detail = self.client.get(f"/api/listings/{self.listing.slug}/").data
+        self.assertTrue(detail["featured_image"].endswith(name))
+        self.assertEqual(
+            detail["featured_image_variants"], item["featured_image_variants"]
+        )
+
+        listing = Listing.objects.get(pk=self.listing.pk)
+        thumbnail = ListingSummarySerializer(listing).data["thumbnail"]
+        self.assertEqual(set(thumbnail), {"width", "height", "webp", "jpeg"})
+        self.assertEqual(thumbnail["width"], images.VARIANT_WIDTHS["small"])
+
+    def test_replaced_and_deleted_images_release_blobs(self):
+        image = ListingImage.objects.create(
+            listing=self.listing, image=self.upload("listings/one.jpg")
+        )
+        images.generate_listing_image_variants(image.pk)
+        image.refresh_from_db()
+        old_files = blobs.referenced_files(image.image.name, image.variants)
+
+        image.image = self.upload("listings/two.jpg", color=(0, 0, 255))
+        image.save()
+        images.generate_listing_image_variants(image.pk)
+        image.refresh_from_db()
+        new_files = blobs.referenced_files(image.image.name, image.variants)
+        self.assertFalse(old_files & new_files)
+
+        self.assertEqual(blobs.collect_garbage(), 0)  # still in the grace period
+        self.assertEqual(blobs.collect_garbage(timedelta(0)), len(old_files))
+        self.assertFalse(any(image_storage.exists(f) for f in old_files))
+        self.assertTrue(all(image_storage.exists(f) for f in new_files))
+
+        image.delete()
+        blobs.collect_garbage(timedelta(0))
+        self.assertFalse(any(image_storage.exists(f) for f in new_files))
+
+    def test_backfill_command(self):
+        ListingImage.objects.create(
+            listing=self.listing, image=self.upload("listings/old.jpg")
+        )
+        out = StringIO()
+        call_command("generate_image_variants", "--sync", stdout=out)
+        self.assertIn("Generated variants for 1 images", out.getvalue())
+        self.assertTrue(ListingImage.objects.get().variants["sizes"])
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.listing = make_listing(title="Shared Photos")
+
+    def refcount(self, name):
+        return StoredBlob.objects.get(name=name).refcount
+
+    def test_identical_uploads_are_stored_once(self):
+        first = image_storage.save("listings/a.JPG", ContentFile(b"same bytes"))
+        second = image_storage.save("listings/b.jpg", ContentFile(b"same bytes"))
+        other = image_storage.save("listings/c.jpg", ContentFile(b"other bytes"))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r"^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+        self.assertEqual(StoredBlob.objects.count(), 2)
+        with image_storage.open(first) as stored:
+            self.assertEqual(stored.read(), b"same bytes")
+        # Leftover temporary files would end in .upload
+        self.assertEqual(
+            [n for n in os.listdir(image_storage.location) if n.endswith(".upload")],
+            [],
+        )
+
+    def test_shared_blob_survives_until_last_reference_goes(self):
+        image = ContentFile(b"photo", name="photo.jpg")
+        first = ListingImage.objects.create(listing=self.listing, image=image)
+        second = ListingImage.objects.create(
+            listing=self.listing, image=ContentFile(b"photo", name="copy.jpg")
+        )
+        self.listing.featured_image = first.image.name
+        self.listing.save()
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(self.refcount(name), 3)
+
+        first.delete()
+        image_storage.delete(name)  # never removes a blob directly
+        self.assertEqual(self.refcount(name), 2)
+        self.assertEqual(blobs.collect_garbage(timedelta(0)), 0)
+
+        # Deleting the listing cascades to its images
+        self.listing.delete()
+        self.assertEqual(self.refcount(name), 0)
+        self.assertTrue(image_storage.exists(name))
+        self.assertEqual(blobs.collect_garbage(timedelta(0)), 1)
+        self.assertFalse(image_storage.exists(name))
+        self.assertFalse(StoredBlob.objects.exists())
+
+    def test_reupload_after_release_is_kept(self):
+        name = image_storage.save("a.jpg", ContentFile(b"photo"))
+        StoredBlob.objects.filter(name=name).update(
+            touched_at=timezone.now() - timedelta(days=1)
+        )
+        # Uploading the same content again refreshes the grace period
+        image_storage.save("b.jpg", ContentFile(b"photo"))
+        self.assertEqual(blobs.collect_garbage(), 0)
+        self.assertTrue(image_storage.exists(name))
+
+    def test_recount_and_command(self):
+        image = ListingImage.objects.create(
+            listing=self.listing, image=ContentFile(b"photo", name="photo.jpg")
+        )
+        orphan = image_storage.save("orphan.jpg", ContentFile(b"orphan"))
+        StoredBlob.objects.update(refcount=7)
+
+        out = StringIO()
+        call_command("collect_blobs", "--recount", "--grace-seconds", "0", stdout=out)
+        self.assertIn("Deleted 1 unreferenced blobs", out.getvalue())
+        self.assertEqual(self.refcount(image.image.name), 1)
+        self.assertFalse(image_storage.exists(orphan))
+
+
+class AvailabilityCalendarTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.addCleanup(django_cache.clear)
+        self.client = APIClient()
+        self.user = User.objects.create_user("host", password="pass12345")
+        self.listing = make_listing(title="Calendar Cabin")
+        self.url = f"/api/listings/{self.listing.slug}/availability/"
+        # Back to back stays merge into one run; the last one is clipped
+        self.booking(date(2030, 7, 1), date(2030, 7, 3))
+        self.booking(date(2030, 7, 3), date(2030, 7, 4))
+        self.booking(date(2030, 7, 9), date(2030, 7, 20))
+        self.booking(date(2030, 7, 5), date(2030, 7, 6), status="cancelled")
+
+    def booking(self, check_in, check_out, status="confirmed"):
+        return Booking.objects.create(
+            user=self.user,
+            listing=self.listing,
+            check_in_date=check_in,
+            check_out_date=check_out,
+            num_guests=1,
+            total_price=Decimal("100.00"),
+            status=status,
+        )
+
+    def calendar(self, **params):
+        params = {"start": "2030-06-30", "days": 12, **params}
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_runs_and_bitmap(self):
+        data = self.calendar(encoding="runs")
+        self.assertEqual(
+            data["booked"],
+            [["2030-07-01", "2030-07-04"], ["2030-07-09", "2030-07-12"]],
+        )
+        data = self.calendar()
+        self.assertEqual(data["encoding"], "bitmap")
+        bitmap = base64.b64decode(data["booked"])
+        self.assertEqual(len(bitmap), 2)
+        bits = "".join(f"{byte:08b}" for byte in bitmap)[:12]
+        self.assertEqual(bits, "011100000111")
+
+    def test_one_query_then_cached(self):
+        with self.assertNumQueries(2):
+            # Slug lookup and the bookings
+            self.calendar()
+        with self.assertNumQueries(1):
+            self.calendar(encoding="runs")
+
+    def test_booking_changes_invalidate(self):
+        self.assertEqual(len(self.calendar(encoding="runs")["booked"]), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = self.booking(date(2030, 7, 6), date(2030, 7, 7))
+        self.assertEqual(len(self.calendar(encoding="runs")["booked"]), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = "cancelled"
+            booking.save()
+        self.assertEqual(len(self.calendar(encoding="runs")["booked"]), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pending = self.booking(date(2030, 7, 6), date(2030, 7, 7), status="pending")
+        Booking.objects.filter(pk=pending.pk).update(
+            created_at=timezone.now() - timedelta(hours=2)
+        )
+        self.assertEqual(len(self.calendar(encoding="runs")["booked"]), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            reservations.expire_lapsed_holds()
+        self.assertEqual(len(self.calendar(encoding="runs")["booked"]), 2)
+
+    def test_invalid_parameters(self):
+        for params in (
+            {"start": "2030-13-01"},
+            {"start": "soon"},
+            {"days": 0},
+            {"days": "many"},
+            {"days": 10000},
+            {"encoding": "png"},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/listings/nowhere/availability/")
+        self.assertEqual(response.status_code, 404)
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(tasks.send_booking_confirmation_email, "delay")
+        self.confirmation = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("retry", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.listing = make_listing(title="Flaky Flat")
+        self.stay = {
+            "listing_id": self.listing.pk,
+            "check_in_date": "2030-09-01",
+            "check_out_date": "2030-09-03",
+            "num_guests": 2,
+        }
+
+    def book(self, key, **changes):
+        return self.client.post(
+            "/api/bookings/",
+            {**self.stay, **changes},
+            format="json",
+            headers={"Idempotency-Key": key},
+        )
+
+    def test_retried_booking_is_replayed(self):
+        first = self.book("book-1")
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(1):
+            retry = self.book("book-1")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Booking.objects.count(), 1)
+        self.confirmation.assert_called_once()
+
+        # Other users and keys are independent
+        self.assertEqual(self.book("book-2").status_code, 409)
+        other = User.objects.create_user("other", password="pass12345")
+        self.client.force_authenticate(other)
+        self.assertEqual(
+            self.book(
+                "book-1", check_in_date="2030-09-05", check_out_date="2030-09-06"
+            ).status_code,
+            201,
+        )
+
+    def test_key_reuse_and_in_flight_requests(self):
+        self.book("book-1")
+        self.assertEqual(self.book("book-1", num_guests=3).status_code, 422)
+        IdempotencyKey.objects.create(
+            user=self.user,
+            key="in-flight",
+            fingerprint="x" * 64,
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.assertEqual(self.book("in-flight", num_guests=3).status_code, 422)
+        record = IdempotencyKey.objects.get(key="in-flight")
+        record.fingerprint = IdempotencyKey.objects.get(key="book-1").fingerprint
+        record.save()
+        self.assertEqual(self.book("in-flight").status_code, 409)
+        self.assertEqual(self.book("").status_code, 400)
+
+        # A worker that died mid-request leaves the key retryable after a while
+        Booking.objects.all().delete()
+        IdempotencyKey.objects.filter(key="in-flight").update(
+            created_at=timezone.now() - timedelta(minutes=5)
+        )
+        self.assertEqual(self.book("in-flight", num_guests=3).status_code, 422)
+        self.assertEqual(self.book("in-flight").status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.get(key="in-flight").status_code, 201)
+
+    def test_errors_release_the_key(self):
+        self.assertEqual(self.book("book-1", num_guests=9).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.book("book-1").status_code, 201)
+
+    def test_payment_initiation_is_replayed(self):
+        booking = Booking.objects.create(
+            user=self.user,
+            listing=self.listing,
+            check_in_date=date(2030, 9, 1),
+            check_out_date=date(2030, 9, 3),
+            num_guests=1,
+            total_price=Decimal("200.00"),
+        )
+        url = f"/api/bookings/{booking.pk}/pay/"
+        with mock.patch("listings.views.Chapa") as chapa:
+            chapa.return_value.initialize.return_value = {
+                "status": "success",
+                "data": {"checkout_url": "https://checkout.example.com/1"},
+            }
+            responses = [
+                self.client.post(url, headers={"Idempotency-Key": "pay-1"})
+                for _ in range(3)
+            ]
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200])
+        self.assertEqual(
+            responses[2].data, {"checkout_url": "https://checkout.example.com/1"}
+        )
+        chapa.return_value.initialize.assert_called_once()
+        self.assertEqual(Payment.objects.filter(booking=booking).count(), 1)
+
+    def test_gateway_errors_are_replayed(self):
+        booking = Booking.objects.create(
+            user=self.user,
+            listing=self.listing,
+            check_in_date=date(2030, 9, 1),
+            check_out_date=date(2030, 9, 3),
+            num_guests=1,
+            total_price=Decimal("200.00"),
+        )
+        url = f"/api/bookings/{booking.pk}/pay/"
+        with mock.patch("listings.views.Chapa") as chapa:
+            chapa.return_value.initialize.side_effect = ConnectionError("timeout")
+            responses = [
+                self.client.post(url, headers={"Idempotency-Key": "pay-1"})
+                for _ in range(2)
+            ]
+        self.assertEqual([r.status_code for r in responses], [500, 500])
+        self.assertEqual(responses[1]["Idempotent-Replayed"], "true")
+        chapa.return_value.initialize.assert_called_once()
+        self.assertEqual(Payment.objects.filter(booking=booking).count(), 1)
+
+    def test_expired_keys_are_purged_and_reusable(self):
+        self.book("book-1")
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertEqual(
+            tasks.purge_idempotency_keys(), "Purged 1 expired idempotency keys"
+        )
+        self.assertEqual(self.book("book-1").status_code, 409)
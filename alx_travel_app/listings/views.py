@@ -9,44 +9,86 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.request import Request
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import transaction
 from django.db.models import QuerySet
 from typing import Any
-from .models import Listing, Amenity, Booking, Review, Payment
+from .models import Listing, Amenity, Booking, Review, Payment, FeaturedListing
 from .serializers import (
     ListingSerializer,
     AmenitySerializer,
     BookingSerializer,
     ReviewSerializer,
     PaymentSerializer,
+    StayQuoteSerializer,
 )
+from . import cache as listing_cache
+from .amenities import AmenityFilter
+from .availability import (
+    DEFAULT_CALENDAR_DAYS,
+    ENCODINGS,
+    MAX_CALENDAR_DAYS,
+    AvailabilityFilter,
+    availability_calendar,
+)
+from .conditional import ConditionalGetMixin
+from .export import export_response
+from .facets import listing_facets, price_histogram
+from .fastpath import FastListMixin
+from .fieldsets import SparseFieldsetViewMixin
+from .featured import MAX_FEATURED
+from .geo import GeoFilter
+from .idempotency import idempotent
+from .pagination import (
+    CreatedCursorPagination,
+    ListingCursorPagination,
+    UpcomingCursorPagination,
+)
+from .ratings import apply_rating_change
+from .renderers import EXPORT_RENDERER_CLASSES
+from .pricing import STAYS_PARAM, get_calendar, parse_stays, stay_price
+from .reservations import reserve_stay, stay_changed
+from .search import FullTextSearchFilter
 from rest_framework.views import APIView
 from chapa import Chapa
 from django.conf import settings
 import uuid
+from datetime import date
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_http_date
 from .tasks import send_payment_confirmation_email, send_booking_confirmation_email
 
 
 class InitiatePaymentView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request, booking_id):
-        booking = get_object_or_404(Booking, id=booking_id, user=request.user)
-
-        if booking.status == "confirmed":
-            return Response(
-                {"error": "This booking has already been paid for."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
         transaction_id = str(uuid.uuid4())
+        with transaction.atomic():
+            # Locked against the expiry sweeper, which skips locked bookings;
+            # the pending payment then extends the hold (see reservations)
+            booking = get_object_or_404(
+                Booking.objects.select_for_update(), id=booking_id, user=request.user
+            )
+            if booking.status == "confirmed":
+                return Response(
+                    {"error": "This booking has already been paid for."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if booking.status not in Booking.ACTIVE_STATUSES:
+                return Response(
+                    {"error": f"This booking is {booking.status}."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
 
-        payment = Payment.objects.create(
-            booking=booking,
-            amount=booking.total_price,
-            transaction_id=transaction_id,
-            status="pending",
-        )
+            payment = Payment.objects.create(
+                booking=booking,
+                amount=booking.total_price,
+                transaction_id=transaction_id,
+                status="pending",
+            )
 
         chapa = Chapa(settings.CHAPA_SECRET_KEY)
 
@@ -101,16 +143,36 @@ class VerifyPaymentView(APIView):
         try:
             response = chapa.verify(transaction_id)
             if response.get("status") == "success":
-                payment = get_object_or_404(Payment, transaction_id=transaction_id)
-                payment.status = "completed"
-                payment.save()
-
-                booking = payment.booking
-                booking.status = "confirmed"
-                booking.save()
-
-                # Trigger Celery task to send email
-                send_payment_confirmation_email.delay(payment.id)
+                booking_id = get_object_or_404(
+                    Payment.objects.values_list("booking_id", flat=True),
+                    transaction_id=transaction_id,
+                )
+                with transaction.atomic():
+                    # Lock in the expiry sweeper's order: booking, then payment
+                    booking = Booking.objects.select_for_update().get(pk=booking_id)
+                    payment = Payment.objects.select_for_update().get(
+                        transaction_id=transaction_id
+                    )
+                    if payment.status == "completed":
+                        return Response(
+                            {"status": "Payment already verified."},
+                            status=status.HTTP_200_OK,
+                        )
+                    if payment.status == "cancelled" or booking.status != "pending":
+                        # The booking's hold lapsed and its nights were released
+                        return Response(
+                            {"error": "The booking expired before payment completed."},
+                            status=status.HTTP_409_CONFLICT,
+                        )
+                    payment.status = "completed"
+                    payment.save(update_fields=["status", "updated_at"])
+                    booking.status = "confirmed"
+                    booking.save(update_fields=["status", "updated_at"])
+
+                    # Trigger Celery task to send email
+                    transaction.on_commit(
+                        lambda: send_payment_confirmation_email.delay(payment.id)
+                    )
 
                 return Response(
                     {"status": "Payment verified successfully."},
@@ -119,7 +181,7 @@ class VerifyPaymentView(APIView):
             else:
                 payment = get_object_or_404(Payment, transaction_id=transaction_id)
                 payment.status = "failed"
-                payment.save()
+                payment.save(update_fields=["status", "updated_at"])
                 return Response(
                     {"error": "Payment verification failed."},
                     status=status.HTTP_400_BAD_REQUEST,
@@ -130,7 +192,9 @@ class VerifyPaymentView(APIView):
             )
 
 
-class ListingViewSet(viewsets.ModelViewSet):
+class ListingViewSet(
+    FastListMixin, ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet
+):
     """
     API endpoint for travel listings
     """
@@ -139,9 +203,15 @@ class ListingViewSet(viewsets.ModelViewSet):
     serializer_class = ListingSerializer
     lookup_field = "slug"
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = ListingCursorPagination
+    compact_actions = ("list", "featured")
+    fast_actions = ("list",)
     filter_backends = [
         DjangoFilterBackend,
-        filters.SearchFilter,
+        FullTextSearchFilter,
+        GeoFilter,
+        AvailabilityFilter,
+        AmenityFilter,
         filters.OrderingFilter,
     ]
     filterset_fields = [
@@ -151,16 +221,193 @@ class ListingViewSet(viewsets.ModelViewSet):
         "max_guests",
         "bedrooms",
     ]
-    search_fields = ["title", "description", "location", "address"]
-    ordering_fields = ["price_per_night", "created_at", "bedrooms", "max_guests"]
+    ordering_fields = [
+        "price_per_night",
+        "created_at",
+        "bedrooms",
+        "max_guests",
+        "rating_avg",
+        "rating_count",
+    ]
+
+    def get_queryset(self) -> QuerySet[Listing]:  # type: ignore
+        """Load only the columns and relations the response will render"""
+        return self.optimize_queryset(super().get_queryset())
+
+    def retrieve(self, request, *args, **kwargs):
+        """Serve listing details from the per-slug cache when possible"""
+        if request.query_params:
+            # Only the plain representation is cached: sparse fieldsets,
+            # filters and ?near= distances all change the response
+            return super().retrieve(request, *args, **kwargs)
+
+        slug = kwargs[self.lookup_field]
+        host = f"{request.scheme}://{request.get_host()}"
+        entry, tokens = listing_cache.get_listing_detail(slug, host)
+        if entry is None:
+            response = super().retrieve(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                listing_cache.set_listing_detail(
+                    slug,
+                    host,
+                    tokens,
+                    response.data,
+                    response.get("ETag"),
+                    response.get("Last-Modified"),
+                )
+            return response
+
+        data, etag, last_modified = entry
+        if last_modified is not None:
+            last_modified = parse_http_date(last_modified)
+        not_modified = self.get_not_modified(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        return self.set_validators(Response(data), etag, last_modified)
+
+    @action(detail=False)
+    def facets(self, request):
+        """Get facet counts for the current filters"""
+        data = listing_cache.get_facets(request.query_params)
+        if data is None:
+            data = listing_facets(self.filter_queryset(self.get_queryset()))
+            listing_cache.set_facets(request.query_params, data)
+        return Response(data)
+
+    @action(detail=False)
+    def price_histogram(self, request):
+        """Get the price_per_night distribution for the current filters"""
+        try:
+            buckets = int(request.query_params.get("buckets", 20))
+        except ValueError:
+            buckets = 0
+        if not 1 <= buckets <= 100:
+            return Response(
+                {"buckets": "Must be an integer between 1 and 100."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(price_histogram(queryset, buckets))
 
     @action(detail=False)
     def featured(self, request):
-        """Get featured listings"""
-        featured = self.get_queryset().filter(is_available=True)[:5]
+        """Get featured listings, optionally per listing_type"""
+        try:
+            limit = int(request.query_params.get("limit", 5))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_FEATURED:
+            return Response(
+                {"limit": f"Must be an integer between 1 and {MAX_FEATURED}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        listing_type = request.query_params.get("listing_type")
+        if listing_type and listing_type not in dict(Listing.LISTING_TYPE_CHOICES):
+            return Response(
+                {"listing_type": f"Unknown listing type: {listing_type}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        queryset = self.get_queryset().filter(is_available=True)
+        if listing_type:
+            ranked = queryset.filter(
+                featured_rank__listing_type=listing_type,
+                featured_rank__type_rank__lte=limit,
+            ).order_by("featured_rank__type_rank")
+        else:
+            ranked = queryset.filter(featured_rank__rank__lte=limit).order_by(
+                "featured_rank__rank"
+            )
+        featured = list(ranked)
+
+        # Until the ranking task has run, fall back to the newest listings
+        if not featured and not FeaturedListing.objects.exists():
+            if listing_type:
+                queryset = queryset.filter(listing_type=listing_type)
+            featured = queryset[:limit]
+
         serializer = self.get_serializer(featured, many=True)
         return Response(serializer.data)
 
+    @action(detail=True)
+    def availability(self, request, slug=None):
+        """Get the listing's booked nights as a bitmap or as date runs"""
+        params = request.query_params
+        try:
+            start = parse_date(params["start"]) if "start" in params else date.today()
+        except ValueError:
+            start = None
+        if start is None:
+            return Response(
+                {"start": "Enter a date in YYYY-MM-DD format."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            days = int(params.get("days", DEFAULT_CALENDAR_DAYS))
+        except ValueError:
+            days = 0
+        if not 1 <= days <= MAX_CALENDAR_DAYS:
+            return Response(
+                {"days": f"Must be an integer between 1 and {MAX_CALENDAR_DAYS}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        encoding = params.get("encoding", ENCODINGS[0])
+        if encoding not in ENCODINGS:
+            return Response(
+                {"encoding": f"Must be one of: {', '.join(ENCODINGS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        listing_id = (
+            Listing.objects.filter(slug=slug).values_list("pk", flat=True).first()
+        )
+        if listing_id is None:
+            raise Http404
+        data, version = listing_cache.get_availability(listing_id, start, days)
+        if data is None:
+            data = availability_calendar(listing_id, start, days)
+            listing_cache.set_availability(listing_id, version, start, days, data)
+        return Response(
+            {
+                "listing": listing_id,
+                "start": start.isoformat(),
+                "days": days,
+                "encoding": encoding,
+                "booked": data[encoding],
+            }
+        )
+
+    @action(detail=True)
+    def quote(self, request, slug=None):
+        """Price one or more stays, given as ?stays=check_in/check_out,..."""
+        stays = parse_stays(request.query_params.get(STAYS_PARAM))
+        listing = get_object_or_404(
+            Listing.objects.only("pk", "price_per_night", "weekend_multiplier"),
+            slug=slug,
+        )
+        calendar = get_calendar(listing.pk)
+        quotes = [
+            calendar.quote(listing, check_in, check_out)
+            for check_in, check_out in stays
+        ]
+        return Response(
+            {
+                "listing": listing.pk,
+                "quotes": StayQuoteSerializer(quotes, many=True).data,
+            }
+        )
+
+    @action(
+        detail=False,
+        permission_classes=[permissions.IsAdminUser],
+        renderer_classes=EXPORT_RENDERER_CLASSES,
+    )
+    def export(self, request):
+        """Stream every listing matching the filters as NDJSON or CSV"""
+        return export_response(
+            request, self.filter_queryset(self.get_queryset()), "listings"
+        )
+
 
 class AmenityViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -172,7 +419,7 @@ class AmenityViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 
-class BookingViewSet(viewsets.ModelViewSet):
+class BookingViewSet(FastListMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     """
     API endpoint for bookings
     """
@@ -193,42 +440,98 @@ class BookingViewSet(viewsets.ModelViewSet):
     ]
     ordering_fields = ["created_at", "check_in_date", "total_price"]
     ordering = ["-created_at"]
+    compact_actions = ("list", "my_bookings", "upcoming")
+    fast_actions = ("my_bookings", "upcoming")
 
     def get_queryset(self) -> QuerySet[Booking]:  # type: ignore
         """Filter bookings by user for non-staff users"""
+        queryset = self.optimize_queryset(Booking.objects.all())
         if self.request.user.is_staff:
-            return Booking.objects.all()
-        return Booking.objects.filter(user=self.request.user)
+            return queryset
+        return queryset.filter(user=self.request.user)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """Create a booking; a retried Idempotency-Key replays the first response"""
+        return super().create(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         """Set the user to the current user when creating a booking and send confirmation email"""
-        booking = serializer.save(user=self.request.user)
+        data = serializer.validated_data
+        with transaction.atomic():
+            listing = reserve_stay(
+                data["listing_id"],
+                data["check_in_date"],
+                data["check_out_date"],
+                data["num_guests"],
+            )
+            booking = serializer.save(
+                user=self.request.user,
+                total_price=stay_price(
+                    listing, data["check_in_date"], data["check_out_date"]
+                ),
+            )
 
         # Trigger Celery task to send booking confirmation email
         send_booking_confirmation_email.delay(booking.id)
 
-    @action(detail=False, methods=["get"])
+    def perform_update(self, serializer):
+        """Re-check availability when an update moves or reactivates a stay"""
+        booking, data = serializer.instance, serializer.validated_data
+        old_listing_id = booking.listing_id
+        if data.get("listing_id", old_listing_id) != old_listing_id:
+            # The booking signal only sees the listing it moves to
+            transaction.on_commit(
+                lambda: listing_cache.invalidate_availability(old_listing_id)
+            )
+        if not stay_changed(booking, data):
+            serializer.save()
+            return
+        check_in = data.get("check_in_date", booking.check_in_date)
+        check_out = data.get("check_out_date", booking.check_out_date)
+        with transaction.atomic():
+            listing = reserve_stay(
+                data.get("listing_id", booking.listing_id),
+                check_in,
+                check_out,
+                data.get("num_guests", booking.num_guests),
+                exclude=booking.pk,
+            )
+            serializer.save(total_price=stay_price(listing, check_in, check_out))
+
+    @action(detail=False, methods=["get"], pagination_class=CreatedCursorPagination)
     def my_bookings(self, request):
-        """Get current user's bookings"""
-        bookings = Booking.objects.filter(user=request.user)
-        serializer = self.get_serializer(bookings, many=True)
-        return Response(serializer.data)
+        """Get current user's bookings, newest first"""
+        bookings = self.optimize_queryset(Booking.objects.filter(user=request.user))
+        return self.list_response(self.filter_queryset(bookings))
 
-    @action(detail=False, methods=["get"])
+    @action(detail=False, methods=["get"], pagination_class=UpcomingCursorPagination)
     def upcoming(self, request):
-        """Get upcoming bookings for current user"""
-        from datetime import date
-
-        upcoming_bookings = Booking.objects.filter(
-            user=request.user,
-            check_in_date__gte=date.today(),
-            status__in=["pending", "confirmed"],
+        """Get upcoming bookings for current user, soonest first"""
+        upcoming_bookings = self.optimize_queryset(
+            Booking.objects.filter(
+                user=request.user,
+                status__in=Booking.ACTIVE_STATUSES,
+                check_in_date__gte=date.today(),
+            )
+        )
+        return self.list_response(self.filter_queryset(upcoming_bookings))
+
+    @action(
+        detail=False,
+        permission_classes=[permissions.IsAdminUser],
+        renderer_classes=EXPORT_RENDERER_CLASSES,
+    )
+    def export(self, request):
+        """Stream every booking matching the filters as NDJSON or CSV"""
+        return export_response(
+            request, self.filter_queryset(self.get_queryset()), "bookings"
         )
-        serializer = self.get_serializer(upcoming_bookings, many=True)
-        return Response(serializer.data)
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(
+    FastListMixin, ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet
+):
     """
     API endpoint for reviews
     """
@@ -247,10 +550,14 @@ class ReviewViewSet(viewsets.ModelViewSet):
     ]
     ordering_fields = ["created_at", "rating"]
     ordering = ["-created_at"]
+    # Reviews embed their listing, so listing edits change the payload too
+    conditional_fields = ("updated_at", "listing__updated_at")
+    compact_actions = ("list", "my_reviews", "top_rated")
+    fast_actions = ("list", "my_reviews")
 
     def get_queryset(self) -> QuerySet[Review]:  # type: ignore
         """Filter reviews and allow users to edit only their own reviews"""
-        queryset = Review.objects.all()
+        queryset = self.optimize_queryset(Review.objects.all())
 
         # Filter by listing_id if specified in query params
         listing_id = getattr(self.request, "query_params", self.request.GET).get(  # type: ignore
@@ -268,18 +575,44 @@ class ReviewViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """Set the user to the current user when creating a review"""
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            review = serializer.save(user=self.request.user)
+            apply_rating_change(review.listing_id, added=review.rating)
+
+    def perform_update(self, serializer):
+        """Move the review's rating between listing aggregates as needed"""
+        old_listing_id = serializer.instance.listing_id
+        old_rating = serializer.instance.rating
+        with transaction.atomic():
+            review = serializer.save()
+            if review.listing_id != old_listing_id:
+                apply_rating_change(old_listing_id, removed=old_rating)
+                apply_rating_change(review.listing_id, added=review.rating)
+            elif review.rating != old_rating:
+                apply_rating_change(
+                    review.listing_id, added=review.rating, removed=old_rating
+                )
 
-    @action(detail=False, methods=["get"])
+    @action(detail=False, methods=["get"], pagination_class=CreatedCursorPagination)
     def my_reviews(self, request):
-        """Get current user's reviews"""
-        reviews = Review.objects.filter(user=request.user)
-        serializer = self.get_serializer(reviews, many=True)
-        return Response(serializer.data)
+        """Get current user's reviews, newest first"""
+        reviews = self.optimize_queryset(Review.objects.filter(user=request.user))
+        return self.list_response(self.filter_queryset(reviews))
 
     @action(detail=False, methods=["get"])
     def top_rated(self, request):
         """Get top rated reviews (5 stars)"""
-        top_reviews = Review.objects.filter(rating=5)[:10]
+        top_reviews = self.optimize_queryset(Review.objects.filter(rating=5))[:10]
         serializer = self.get_serializer(top_reviews, many=True)
         return Response(serializer.data)
+
+    @action(
+        detail=False,
+        permission_classes=[permissions.IsAdminUser],
+        renderer_classes=EXPORT_RENDERER_CLASSES,
+    )
+    def export(self, request):
+        """Stream every review matching the filters as NDJSON or CSV"""
+        return export_response(
+            request, self.filter_queryset(self.get_queryset()), "reviews"
+        )
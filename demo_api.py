@@ -22,7 +22,7 @@ def demo_api_operations():
     print("\n🏠 Fetching all listings...")
     response = requests.get(f"{BASE_URL}/listings/")
     if response.status_code == 200:
-        listings = response.json()
+        listings = response.json()["results"]
         print(f"✅ Found {len(listings)} listings")
         if listings:
             first_listing = listings[0]
@@ -36,14 +36,14 @@ def demo_api_operations():
     print("\n🔍 Testing filtering - Hotels only...")
     response = requests.get(f"{BASE_URL}/listings/?listing_type=hotel")
     if response.status_code == 200:
-        hotels = response.json()
+        hotels = response.json()["results"]
         print(f"✅ Found {len(hotels)} hotels")
 
     # Test search
     print("\n🔍 Testing search - Beach properties...")
     response = requests.get(f"{BASE_URL}/listings/?search=beach")
     if response.status_code == 200:
-        beach_properties = response.json()
+        beach_properties = response.json()["results"]
         print(f"✅ Found {len(beach_properties)} beach properties")
 
     # Test getting a specific listing
@@ -24,7 +24,7 @@ def test_listings_api():
     # Test GET all listings
     response = requests.get(f"{BASE_URL}/listings/")
     if response.status_code == 200:
-        listings = response.json()
+        listings = response.json()["results"]
         print(f"✅ GET /api/listings/ - Found {len(listings)} listings")
 
         if listings:
@@ -127,7 +127,7 @@ def test_api_filtering():
     # Test filtering listings by type
     response = requests.get(f"{BASE_URL}/listings/?listing_type=hotel")
     if response.status_code == 200:
-        hotels = response.json()
+        hotels = response.json()["results"]
         print(f"✅ GET /api/listings/?listing_type=hotel - Found {len(hotels)} hotels")
     else:
         print(f"❌ Filtering by listing_type failed with status {response.status_code}")
@@ -135,7 +135,7 @@ def test_api_filtering():
     # Test search functionality
     response = requests.get(f"{BASE_URL}/listings/?search=beach")
     if response.status_code == 200:
-        beach_listings = response.json()
+        beach_listings = response.json()["results"]
         print(
             f"✅ GET /api/listings/?search=beach - Found {len(beach_listings)} beach listings"
         )